@@ -0,0 +1,216 @@
+# analysis.py
+# Granite workflow analysis of an extracted BPD.
+# Documents that fit in one prompt are analyzed in a single call. Larger ones are split into
+# step-aligned sections that are analyzed concurrently (map) and merged back into one ordered
+# step list (reduce), shaped like a single Granite response so extract_from_granite is unchanged.
+# Every call's max_new_tokens is sized to the steps it has to describe (see budgets.py).
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import budgets
+import granite
+import parsing
+import tracing
+
+# ~4 characters per token keeps a section well inside the model context next to the instructions
+MAX_SECTION_CHARS = int(os.getenv('ANALYSIS_SECTION_CHARS', 12000))
+MAX_WORKERS = int(os.getenv('ANALYSIS_WORKERS', 4))
+# Start of the company introduction repeated in every later section so each one keeps the
+# business context
+PREAMBLE_CHARS = 1500
+
+# Step headings start a line; inline references like "see Step 3" do not start a section
+STEP_PATTERN = re.compile(r'(?im)^\s*(?:step|stage|phase)\s*#?\s*\d+\b')
+NUMBERED_ITEM_PATTERN = re.compile(r'(?m)^\s*(\d+)[.)]\s')
+
+PROMPT_TEMPLATE = """You are an expert business workflow analyzer. Your role is to analyze a business's context, analyze each step in its current workflow critically and score each step. Your tasks are as follows:
+
+Use only the provided context: {context}
+
+1. **Extract the Company Context:**
+- Retrieve key details from the company introduction (name, size, industry, location). Do not output any response yet.
+
+2. **Process Each Workflow Step:**
+- For each {scope}, extract the detailed information including the business tools in use and any quantitative metrics provided.
+- Summarize each step into a concise 10 to 15 word sentence that captures the essence of the step.Do not output any response yet.
+
+3. **Score Workflow Efficiency:**
+- Evaluate and assign an efficiency score for each workflow step. Use scoring metrics similar to those employed in IBM business assessments (for example, consider factors like throughput, error rate, cycle time, and automation effectiveness).
+- The score should be a numerical value from 1 (poor efficiency) to 10 (excellent efficiency). Be as critical as possible, do not just award > 6 without justification since there is always room for improvement in the current step! Do not output any response yet.
+
+4. **Output Format:** - Here is the output format:
+- Only produce the final output in a JSON array only, not a dictionary named 'workflow_steps' or anything like 'JSON Output:' or [JSON_OUTPUT]! Verify that none of that is mentioned. No other descriptions are required.
+- Each JSON object should have the following keys:
+    - "step_summary": the 10 to 15 word summary of the step.
+    - "efficiency_score": the numerical score assigned.
+    - "explanation": a description of the main factor(s) leading to workflow inefficiency, with associated metrics, in this step.
+- Ensure the JSON is clean and fully parsable.
+
+Please process the test_data accordingly and output the results in the required JSON format.
+
+Think through this step by step. Verify each step. Do not ever hallucinate.
+"""
+
+
+def build_prompt(context, section=None, total=None):
+    if section is None:
+        scope = 'workflow step in the document'
+    else:
+        scope = (f'workflow step in this excerpt (section {section} of {total} of the document; '
+                 'the company introduction is repeated for context, only analyze the steps in the excerpt)')
+    return PROMPT_TEMPLATE.format(context=context, scope=scope)
+
+
+def _split_paragraphs(text, max_chars):
+    parts, buffer, size = [], [], 0
+    for paragraph in re.split(r'\n\s*\n|(?<=[.!?])\s+', text):
+        if buffer and size + len(paragraph) > max_chars:
+            parts.append(' '.join(buffer))
+            buffer, size = [], 0
+        buffer.append(paragraph)
+        size += len(paragraph) + 1
+    if buffer:
+        parts.append(' '.join(buffer))
+    return parts
+
+
+def split_sections(text, max_chars=MAX_SECTION_CHARS):
+    # Returns (preamble, sections), together covering all of text. The text before the first step
+    # heading is analyzed like any other, as the start of the first section(s); preamble is its
+    # beginning, to be repeated as context for the sections after the first. Sections never cut
+    # through a step heading unless a single step is longer than max_chars on its own.
+    starts = [match.start() for match in STEP_PATTERN.finditer(text)]
+    if not starts:
+        return '', _split_paragraphs(text, max_chars)
+
+    preamble = text[:starts[0]].strip()
+    blocks = [text[start:end].strip() for start, end in zip(starts, starts[1:] + [len(text)])]
+    if preamble:
+        blocks = _split_paragraphs(preamble, max_chars) + blocks
+
+    sections, current = [], ''
+    for block in blocks:
+        if len(block) > max_chars:
+            if current:
+                sections.append(current)
+                current = ''
+            sections.extend(_split_paragraphs(block, max_chars))
+        elif current and len(current) + len(block) + 1 > max_chars:
+            sections.append(current)
+            current = block
+        else:
+            current = f'{current} {block}' if current else block
+    if current:
+        sections.append(current)
+    return preamble[:PREAMBLE_CHARS], sections
+
+
+def _normalize(summary):
+    return re.sub(r'\W+', ' ', str(summary)).strip().lower()
+
+
+def merge_steps(partials):
+    # Partial step lists arrive in section order; a step split across two sections can be
+    # reported by both, so consecutive duplicates are dropped
+    merged = []
+    for steps in partials:
+        for step in steps:
+            if merged and _normalize(merged[-1].get('step_summary')) == _normalize(step.get('step_summary')):
+                continue
+            merged.append(step)
+    return merged
+
+
+def _as_response(steps, partial_responses):
+    # Same shape as a single Granite response so downstream parsing does not change
+    return {
+        'results': [{'generated_text': json.dumps(steps)}],
+        'sections': len(partial_responses),
+    }
+
+
+def estimate_steps(text):
+    # Workflow steps in the text: distinct "Step n" headings, else numbered list items. None when
+    # neither is found, and budgets fall back to budgets.DEFAULT_STEPS.
+    numbers = {re.search(r'\d+', match.group()).group() for match in STEP_PATTERN.finditer(text)}
+    if not numbers:
+        numbers = set(NUMBERED_ITEM_PATTERN.findall(text))
+    return len(numbers) or None
+
+
+def generation_parameters(text, attempt=0):
+    # max_new_tokens sized to the steps in text, doubled for each retry after a truncated answer
+    budget = budgets.generation_budget(estimate_steps(text)) * 2 ** attempt
+    return {'max_new_tokens': min(budget, budgets.MAX_NEW_TOKENS)}
+
+
+def generate(prompt, text, bypass_cache=False, attempt=0):
+    # One Granite call with an adaptive budget. A response cut off at max_new_tokens would be
+    # truncated JSON, so it is retried with a larger budget until the cap is reached.
+    while True:
+        parameters = generation_parameters(text, attempt)
+        response_data, cache_hit = granite.generate(prompt, parameters, bypass_cache=bypass_cache)
+        if not granite.truncated(response_data) or parameters['max_new_tokens'] >= budgets.MAX_NEW_TOKENS:
+            return response_data, cache_hit
+        print(f"Granite output truncated at {parameters['max_new_tokens']} tokens; retrying with a larger budget")
+        attempt += 1
+
+
+def needs_sections(text, max_chars=MAX_SECTION_CHARS):
+    return len(text) > max_chars
+
+
+def stream_analyze(text, bypass_cache=False):
+    # Single-prompt analysis streamed as text chunks; returns (chunks, cache_hit). A stream cut off
+    # at max_new_tokens is completed by generate() with larger budgets: greedy output with a larger
+    # budget starts with the text already streamed, so only the rest is yielded.
+    prompt = build_prompt(text)
+    parameters = generation_parameters(text)
+    chunks, cache_hit = granite.stream_generate(prompt, parameters, bypass_cache=bypass_cache)
+
+    def complete():
+        response_data = yield from chunks
+        if not granite.truncated(response_data) or parameters['max_new_tokens'] >= budgets.MAX_NEW_TOKENS:
+            return
+        print(f"Granite output truncated at {parameters['max_new_tokens']} tokens; retrying with a larger budget")
+        streamed = response_data['results'][0]['generated_text']
+        response_data, _ = generate(prompt, text, bypass_cache, attempt=1)
+        generated = response_data['results'][0]['generated_text']
+        if generated.startswith(streamed):
+            if len(generated) > len(streamed):
+                yield generated[len(streamed):]
+        else:
+            print("Retried output does not continue the streamed output; keeping the streamed steps")
+
+    return complete(), cache_hit
+
+
+def analyze(text, bypass_cache=False, max_chars=MAX_SECTION_CHARS, max_workers=MAX_WORKERS):
+    # Returns (response_data, cache_hit); cache_hit is True only if every call was served from cache
+    with tracing.span('analysis', characters=len(text)) as span:
+        if not needs_sections(text, max_chars):
+            span.set('sections', 1)
+            return generate(build_prompt(text), text, bypass_cache)
+
+        preamble, sections = split_sections(text, max_chars)
+        span.set('sections', len(sections))
+        # The first section starts with the preamble already
+        prompts = [
+            build_prompt(f'{preamble}\n\n{section}' if preamble and index > 1 else section, index, len(sections))
+            for index, section in enumerate(sections, start=1)
+        ]
+        # Each section is budgeted for its own steps
+        generate_section = tracing.wrap(lambda prompt, section: generate(prompt, section, bypass_cache))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(generate_section, prompts, sections))
+
+        partial_responses = [response_data for response_data, _ in results]
+        partials = []
+        for response_data in partial_responses:
+            try:
+                partials.append(parsing.parse_steps(response_data['results'][0]['generated_text'], parsing.STEP_KEYS))
+            except (parsing.ParseError, KeyError, IndexError) as e:
+                print(f"Skipping unparsable section: {e}")
+        return _as_response(merge_steps(partials), partial_responses), all(hit for _, hit in results)
@@ -0,0 +1,215 @@
+# batch.py
+# Headless batch analysis of many BPDs.
+# Each document goes through extraction -> Granite analysis -> (optionally) the S3 agent chain,
+# with a bounded number of documents in flight and a cap on how often model stages start.
+# Results are appended to a JSONL file as soon as each document finishes, one line per document,
+# and a rerun with the same output file skips documents that already succeeded. Each record
+# carries the document's token usage; per-document and batch totals are logged.
+#
+#   python batch.py ./bpds --output results.jsonl --concurrency 4 --rate 2 --s3
+#   python batch.py manifest.txt --output results.jsonl      (one PDF path per line)
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dotenv import load_dotenv
+
+# Before the project modules, some of which read their configuration at import time
+load_dotenv()
+
+import analysis
+import extraction
+import parsing
+import scheduler
+import tracing
+import usage
+import utils
+
+CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 4))
+# Model stages started per second across all documents; 0 disables the limit
+RATE = float(os.getenv('BATCH_RATE', 0))
+
+# Scanned images are OCRed like scanned PDFs
+DOCUMENT_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg')
+
+OK = 'ok'
+ERROR = 'error'
+
+
+class RateLimiter:
+    # Spaces calls at least 1/rate seconds apart across threads
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def find_documents(sources):
+    # Directories are searched recursively for PDFs and scanned images. Any other file is taken as
+    # a document if it has one of those extensions, otherwise as a manifest with one path per line
+    # (relative to the manifest).
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            for root, _, files in os.walk(source):
+                paths.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(DOCUMENT_EXTENSIONS))
+        elif source.lower().endswith(DOCUMENT_EXTENSIONS):
+            paths.append(source)
+        else:
+            base = os.path.dirname(source)
+            with open(source) as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith('#'):
+                        paths.append(os.path.join(base, line))
+    seen = set()
+    return [path for path in paths if not (path in seen or seen.add(path))]
+
+
+def completed_documents(output):
+    # Document keys already written with status ok; unreadable (e.g. truncated) lines are ignored
+    done = set()
+    if not os.path.exists(output):
+        return done
+    with open(output) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('status') == OK:
+                done.add(record.get('document'))
+    return done
+
+
+def s3_steps(agent_response):
+    # utils.analyze_workflow has already raised if the run failed
+    content = agent_response.get('body', {}).get('choices', [{}])[0].get('message', {}).get('content', '[]')
+    return parsing.parse_steps(content)
+
+
+def analyze_document(data, run_s3=False, bypass_cache=False, limiter=None):
+    # Returns the result record for one document; raises on failure
+    limiter = limiter or RateLimiter(0)
+    started = time.time()
+    text, extraction_cache_hit = extraction.cached_extract_text(data)
+    if not text.strip():
+        raise ValueError('No text could be extracted from the document.')
+
+    limiter.wait()
+    response_data, cache_hit = analysis.analyze(text, bypass_cache=bypass_cache)
+    steps = parsing.parse_steps(response_data['results'][0]['generated_text'], parsing.STEP_KEYS)
+    record = {
+        'steps': steps,
+        'extraction_cache_hit': extraction_cache_hit,
+        'analysis_cache_hit': cache_hit,
+    }
+
+    if run_s3:
+        limiter.wait()
+        document = extraction.document_key(data)
+        agent_response = utils.analyze_workflow(response_data, run_id=None if bypass_cache else document, document=text)
+        record['s3'] = s3_steps(agent_response)
+
+    record['elapsed'] = round(time.time() - started, 3)
+    return record
+
+
+def run_batch(paths, output, concurrency=CONCURRENCY, rate=RATE, run_s3=False, bypass_cache=False, resume=True, log=print):
+    # Returns (succeeded, failed, skipped) counts
+    done = completed_documents(output) if resume else set()
+    limiter = RateLimiter(rate)
+    write_lock = threading.Lock()
+    counts = {OK: 0, ERROR: 0, 'skipped': 0}
+    batch_usage = usage.TokenUsage()
+
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+
+    def process(path):
+        record = {'path': path}
+        try:
+            data = extraction.read_pdf_bytes(path)
+            record['document'] = extraction.document_key(data)
+            if record['document'] in done:
+                return None
+            # One trace per document; its ID ties the JSONL record to the exported spans
+            # Batch work yields to interactive sessions and S3 jobs sharing the model scheduler
+            with tracing.span('document', root=True, path=path) as span, usage.track() as document_usage, \
+                    scheduler.priority(scheduler.BATCH):
+                record['trace_id'] = span.trace_id
+                try:
+                    record.update(analyze_document(data, run_s3, bypass_cache, limiter))
+                finally:
+                    # Failed documents still report the tokens spent before the failure
+                    record['usage'] = document_usage.to_dict()
+            record['status'] = OK
+        except Exception as e:
+            traceback.print_exc()
+            record.update(status=ERROR, error=str(e))
+        return record
+
+    with open(output, 'a' if resume else 'w') as out, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(process, path): path for path in paths}
+        for future in as_completed(futures):
+            record = future.result()
+            if record is None:
+                counts['skipped'] += 1
+                continue
+            with write_lock:
+                out.write(json.dumps(record) + '\n')
+                out.flush()
+            counts[record['status']] += 1
+            document_usage = usage.TokenUsage.from_dict(record.get('usage', {}))
+            batch_usage.merge(document_usage)
+            log(f"[{sum(counts.values())}/{len(paths)}] {record['status']}: {record['path']} ({document_usage})")
+
+    log(f"Batch used {batch_usage}")
+    return counts[OK], counts[ERROR], counts['skipped']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyze business process documents without the Streamlit app.')
+    parser.add_argument('sources', nargs='+', help='PDF or image files, directories of them or manifest files listing their paths')
+    parser.add_argument('-o', '--output', default='results.jsonl', help='JSONL file results are appended to')
+    parser.add_argument('-c', '--concurrency', type=int, default=CONCURRENCY, help='documents analyzed at once')
+    parser.add_argument('-r', '--rate', type=float, default=RATE, help='model stages started per second (0 = unlimited)')
+    parser.add_argument('--s3', action='store_true', help='also run the S3 summarizer/scorer/suggester chain')
+    parser.add_argument('--bypass-cache', action='store_true', help='ignore cached Granite responses and S3 stages')
+    parser.add_argument('--restart', action='store_true', help='overwrite the output instead of resuming it')
+    args = parser.parse_args(argv)
+
+    tracing.configure()
+    paths = find_documents(args.sources)
+    if not paths:
+        parser.error('no documents found')
+    succeeded, failed, skipped = run_batch(
+        paths, args.output,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        run_s3=args.s3,
+        bypass_cache=args.bypass_cache,
+        resume=not args.restart,
+        log=lambda message: print(message, file=sys.stderr),
+    )
+    print(f'{succeeded} succeeded, {failed} failed, {skipped} already done', file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+# benchmark.py
+# Offline benchmarks for the analysis pipeline, run against the local stand-in in mock_watsonx.py.
+# Times PDF extraction on test_data.pdf, Granite generation (plain, cached and streamed), step
+# parsing as done by extract_from_granite, section analysis and the full S3 chain, and writes the
+# results as JSON with sorted keys so runs from different commits can be diffed or compared.
+#
+#   python benchmark.py --output bench.json
+#   python benchmark.py --latency 0.2 --tokens-per-second 40 --compare bench.json --fail-above 20
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_watsonx import MockWatsonx
+
+SCHEMA_VERSION = 1
+HERE = os.path.dirname(os.path.abspath(__file__))
+PDF_PATH = os.path.join(HERE, 'test_data.pdf')
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    p95 = timings[min(len(timings) - 1, round(0.95 * (len(timings) - 1)))]
+    return {
+        'runs': len(timings),
+        'min_ms': round(timings[0] * 1000, 3),
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'mean_ms': round(statistics.mean(timings) * 1000, 3),
+        'p95_ms': round(p95 * 1000, 3),
+        'max_ms': round(timings[-1] * 1000, 3),
+    }
+
+
+def measure(fn, repeat, warmup=1):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return summarize(timings)
+
+
+def cases(s3=True):
+    # (name, fn, warmup) in the order they run. Project modules are imported here, after the
+    # environment points them at the stand-in server.
+    import analysis
+    import extraction
+    import granite
+    import parsing
+
+    with open(PDF_PATH, 'rb') as f:
+        pdf = f.read()
+    text = extraction.extract_text(pdf)
+    response_data, _ = granite.generate(analysis.build_prompt(text), bypass_cache=True)
+    generated_text = response_data['results'][0]['generated_text']
+
+    def stream_first_chunk():
+        chunks, _ = analysis.stream_analyze(text, bypass_cache=True)
+        next(chunks)
+        chunks.close()
+
+    def stream_total():
+        chunks, _ = analysis.stream_analyze(text, bypass_cache=True)
+        for _ in chunks:
+            pass
+
+    yield 'extraction.extract_text', lambda: extraction.extract_text(pdf), 1
+    yield 'extraction.cached_extract_text', lambda: extraction.cached_extract_text(pdf), 1
+    yield 'granite.generate', lambda: granite.generate(analysis.build_prompt(text), bypass_cache=True), 1
+    yield 'granite.generate.cached', lambda: granite.generate(analysis.build_prompt(text)), 1
+    yield 'granite.stream.first_chunk', stream_first_chunk, 1
+    yield 'granite.stream.total', stream_total, 1
+    yield 'parsing.parse_steps', lambda: parsing.parse_steps(generated_text, parsing.STEP_KEYS), 1
+    yield 'parsing.parse_steps.truncated', lambda: parsing.parse_steps(generated_text[:-40], parsing.STEP_KEYS), 1
+    yield 'analysis.analyze.sections', lambda: analysis.analyze(text * 8, bypass_cache=True, max_chars=len(text) + 1), 1
+    if s3:
+        import utils
+
+        # The first run builds the agent graphs once per process; it is the warmup.
+        # A failed run raises utils.S3RunError.
+        yield 's3.chain', lambda: utils.analyze_workflow(response_data), 1
+
+
+def run(repeat=5, latency=0.0, tokens_per_second=0.0, s3=True, only=None):
+    # TLS because ibm_watsonx_ai, behind the S3 agents, only accepts https URLs
+    with MockWatsonx(latency=latency, tokens_per_second=tokens_per_second, tls=True) as mock, \
+            tempfile.TemporaryDirectory() as cache_dir:
+        os.environ.update(mock.environ())
+        os.environ['WORKWISE_CACHE_DIR'] = cache_dir
+        os.environ.setdefault('NEW_API_KEY', 'mock')
+        os.environ.setdefault('IBM_API_KEY', 'mock')
+        # Time the pipeline, not the scheduler's rate limits (unless the caller set them)
+        os.environ.setdefault('MODEL_REQUESTS_PER_SECOND', '0')
+
+        results = {}
+        for name, fn, warmup in cases(s3):
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            try:
+                results[name] = measure(fn, repeat, warmup)
+            except Exception as e:
+                results[name] = {'error': f'{type(e).__name__}: {e}'}
+            print(f'{name}: {results[name]}', file=sys.stderr)
+
+        return {
+            'schema': SCHEMA_VERSION,
+            'commit': commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'settings': {'repeat': repeat, 'latency': latency, 'tokens_per_second': tokens_per_second},
+            'results': results,
+            'server_requests': dict(mock.requests),
+        }
+
+
+def compare(report, baseline, fail_above=None):
+    # Prints the change in median per benchmark; returns the names that regressed past fail_above %
+    regressed = []
+    for name, result in sorted(report['results'].items()):
+        before = baseline.get('results', {}).get(name, {})
+        if 'median_ms' not in result or 'median_ms' not in before:
+            continue
+        change = (result['median_ms'] - before['median_ms']) / before['median_ms'] * 100 if before['median_ms'] else 0.0
+        print(f'{name:36} {before["median_ms"]:10.3f} -> {result["median_ms"]:10.3f} ms  {change:+7.1f}%', file=sys.stderr)
+        if fail_above is not None and change > fail_above:
+            regressed.append(name)
+    return regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline offline against a local watsonx stand-in.')
+    parser.add_argument('-o', '--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('-n', '--repeat', type=int, default=5, help='timed runs per benchmark')
+    parser.add_argument('--latency', type=float, default=0.0, help='stand-in seconds before each response starts')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help='stand-in generation rate (0 = instant)')
+    parser.add_argument('--no-s3', action='store_true', help='skip the S3 chain benchmark')
+    parser.add_argument('--only', nargs='*', help='run only benchmarks whose names start with these prefixes')
+    parser.add_argument('--compare', help='baseline JSON report to compare medians against')
+    parser.add_argument('--fail-above', type=float, help='exit non-zero if a median regresses by more than this %%')
+    args = parser.parse_args(argv)
+
+    report = run(args.repeat, args.latency, args.tokens_per_second, not args.no_s3, args.only)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressed = compare(report, json.load(f), args.fail_above)
+        if regressed:
+            print(f'Regressed: {", ".join(regressed)}', file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+# budgets.py
+# Output token budgets sized to the work instead of fixed caps. Each workflow step costs roughly
+# the same number of output tokens whatever the document, so a budget is an overhead plus a
+# per-step allowance, clamped to a floor and to a cap. Short documents no longer reserve capacity
+# they never use, and long ones are not cut off mid-JSON.
+import contextlib
+import contextvars
+import os
+
+# Steps assumed when a count cannot be detected; with the defaults below this gives the old
+# fixed Granite budget of about 2000 tokens
+DEFAULT_STEPS = int(os.getenv('BUDGET_DEFAULT_STEPS', 12))
+
+# Granite text generation (max_new_tokens): one JSON object per step. The cap is raised from the
+# old fixed 2000, which cut documents of more than about 12 steps off mid-JSON, to 4000 (~26 steps).
+GENERATION_OVERHEAD = int(os.getenv('GENERATION_OVERHEAD_TOKENS', 100))
+GENERATION_TOKENS_PER_STEP = int(os.getenv('GENERATION_TOKENS_PER_STEP', 150))
+MIN_NEW_TOKENS = int(os.getenv('GENERATION_MIN_NEW_TOKENS', 300))
+MAX_NEW_TOKENS = int(os.getenv('GENERATION_MAX_NEW_TOKENS', 4000))
+
+# ChatWatsonx (max_tokens) per S3 agent call. Agents also write tool calls and reasoning, so the
+# overhead is larger; the cap is the previous fixed value.
+CHAT_OVERHEAD = int(os.getenv('CHAT_OVERHEAD_TOKENS', 400))
+CHAT_TOKENS_PER_STEP = {
+    'summarizer': int(os.getenv('SUMMARIZER_TOKENS_PER_STEP', 120)),
+    'scorer': int(os.getenv('SCORER_TOKENS_PER_STEP', 250)),
+    'suggester': int(os.getenv('SUGGESTER_TOKENS_PER_STEP', 250)),
+}
+MIN_CHAT_TOKENS = int(os.getenv('CHAT_MIN_TOKENS', 512))
+MAX_CHAT_TOKENS = int(os.getenv('CHAT_MAX_TOKENS', 7500))
+
+_output_budget = contextvars.ContextVar('output_budget', default=None)
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, value))
+
+
+def generation_budget(steps=None):
+    # max_new_tokens for a Granite analysis of this many steps
+    steps = steps or DEFAULT_STEPS
+    return _clamp(GENERATION_OVERHEAD + steps * GENERATION_TOKENS_PER_STEP, MIN_NEW_TOKENS, MAX_NEW_TOKENS)
+
+
+def chat_budget(role, steps=None):
+    # max_tokens for one call of the summarizer, scorer or suggester over this many steps
+    steps = steps or DEFAULT_STEPS
+    per_step = CHAT_TOKENS_PER_STEP.get(role, max(CHAT_TOKENS_PER_STEP.values()))
+    return _clamp(CHAT_OVERHEAD + steps * per_step, MIN_CHAT_TOKENS, MAX_CHAT_TOKENS)
+
+
+def current_output_budget():
+    return _output_budget.get()
+
+
+@contextlib.contextmanager
+def output_budget(max_tokens):
+    # Chat model calls made in this context are capped at max_tokens (see utils.S3Engine)
+    token = _output_budget.set(max_tokens)
+    try:
+        yield max_tokens
+    finally:
+        _output_budget.reset(token)
@@ -0,0 +1,92 @@
+# chat_history.py
+# What the chat sends to the ai_service deployment. Instead of the whole conversation, each
+# request carries a rolling summary of the older turns plus a window of the most recent messages,
+# together kept under a token budget, so payload size and latency stop growing with every turn.
+# Messages that slide out of the window are folded into the summary by Granite (greedy, so
+# cached like any other generation), with a plain truncated transcript as the fallback.
+import os
+
+import compaction
+import granite
+
+HISTORY_BUDGET = int(os.getenv('CHAT_HISTORY_BUDGET', 1500))
+WINDOW_MESSAGES = int(os.getenv('CHAT_WINDOW_MESSAGES', 8))
+SUMMARY_TOKENS = int(os.getenv('CHAT_SUMMARY_TOKENS', 300))
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and WorkWiseAI, an assistant that analyzes business workflows.
+Update the summary with the new messages. Keep the workflow steps, scores, recommendations and user questions that were discussed, and any decisions or preferences the user stated. Be factual and brief, at most {words} words. Output only the updated summary.
+
+Current summary:
+{summary}
+
+New messages:
+{transcript}
+
+Updated summary:"""
+
+
+def _transcript(messages):
+    return '\n'.join(f"{message['role']}: {message['content']}" for message in messages)
+
+
+def summarize(summary, messages, max_tokens=SUMMARY_TOKENS):
+    # Returns summary updated with messages
+    prompt = SUMMARY_PROMPT.format(
+        words=max_tokens * 3 // 4,
+        summary=summary or '(none yet)',
+        transcript=_transcript(messages),
+    )
+    try:
+        response_data, _ = granite.generate(prompt, {'max_new_tokens': max_tokens})
+        text = response_data['results'][0]['generated_text'].strip()
+        if text:
+            return text
+    except Exception as e:
+        print(f"Chat summary failed, keeping a truncated transcript instead: {e}")
+    # Most recent text wins when the fallback has to be cut
+    return f'{summary}\n{_transcript(messages)}'.strip()[-max_tokens * 4:]
+
+
+class ChatHistory:
+    # messages is the full conversation, for display; payload() is what is sent
+    def __init__(self, budget=HISTORY_BUDGET, window=WINDOW_MESSAGES, summarizer=summarize):
+        self.messages = []
+        self.summary = ''
+        self.summarized = 0  # messages[:summarized] are covered by the summary
+        self.budget = budget
+        self.window = window
+        self.summarizer = summarizer
+
+    def append(self, role, content):
+        self.messages.append({'role': role, 'content': content})
+
+    @property
+    def first_question(self):
+        # True until the assistant has answered, i.e. the question being asked cannot refer back
+        # to earlier turns ("and step 3?")
+        return not any(message['role'] == 'assistant' for message in self.messages)
+
+    def _summary_message(self):
+        return {'role': 'system', 'content': f'Summary of the earlier conversation: {self.summary}'}
+
+    def _window_start(self):
+        # Newest messages that fit beside the summary; the latest message is always sent
+        remaining = self.budget - (compaction.message_tokens([self._summary_message()]) if self.summary else 0)
+        start = len(self.messages)
+        while start > max(self.summarized, len(self.messages) - self.window):
+            tokens = compaction.message_tokens([self.messages[start - 1]])
+            if tokens > remaining and start < len(self.messages):
+                break
+            remaining -= tokens
+            start -= 1
+        return start
+
+    def payload(self):
+        # Folds whatever left the window into the summary, then returns the messages to send
+        start = self._window_start()
+        while start > self.summarized:
+            self.summary = self.summarizer(self.summary, self.messages[self.summarized:start])
+            self.summarized = start
+            # A longer summary leaves less room for the window
+            start = self._window_start()
+        return ([self._summary_message()] if self.summary else []) + self.messages[start:]
@@ -0,0 +1,158 @@
+# checkpoints.py
+# Checkpointing for S3 agent runs.
+# - Every run gets its own thread IDs, so concurrent users never share agent state.
+# - The default in-memory checkpointer evicts threads by count and age, so a long-lived process
+#   does not grow without limit. S3_CHECKPOINTER=sqlite keeps checkpoints on disk instead
+#   (requires the langgraph-checkpoint-sqlite package).
+# - RunStore records each completed stage's output, so an interrupted
+#   summarizer -> scorer -> suggester chain resumes after its last completed stage. It is bounded
+#   by run count and age like the checkpointer; in memory unless S3_CHECKPOINTER=sqlite.
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from cache import CACHE_DIR
+
+CHECKPOINTER = os.getenv('S3_CHECKPOINTER', 'memory')
+CHECKPOINT_PATH = os.getenv('S3_CHECKPOINT_PATH', os.path.join(CACHE_DIR, 's3_checkpoints.sqlite3'))
+RUN_STORE_PATH = os.getenv('S3_RUN_STORE_PATH', os.path.join(CACHE_DIR, 's3_runs.sqlite3'))
+
+MAX_THREADS = int(os.getenv('S3_CHECKPOINT_MAX_THREADS', 256))
+MAX_AGE = float(os.getenv('S3_CHECKPOINT_MAX_AGE', 2 * 60 * 60))
+RUN_MAX_AGE = float(os.getenv('S3_RUN_MAX_AGE', 7 * 24 * 60 * 60))
+
+
+def new_run_id():
+    return uuid.uuid4().hex
+
+
+class BoundedMemorySaver(MemorySaver):
+    # MemorySaver that forgets the least recently written threads once there are more than
+    # max_threads of them, or once they have not been written for max_age seconds
+    def __init__(self, max_threads=MAX_THREADS, max_age=MAX_AGE):
+        super().__init__()
+        self.max_threads = max_threads
+        self.max_age = max_age
+        self._touched = OrderedDict()
+        self._evict_lock = threading.Lock()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        result = super().put(config, checkpoint, metadata, new_versions)
+        self._touch(config['configurable']['thread_id'])
+        return result
+
+    def _touch(self, thread_id):
+        now = time.time()
+        with self._evict_lock:
+            self._touched[thread_id] = now
+            self._touched.move_to_end(thread_id)
+            while len(self._touched) > 1:
+                oldest, touched_at = next(iter(self._touched.items()))
+                if len(self._touched) <= self.max_threads and now - touched_at <= self.max_age:
+                    break
+                del self._touched[oldest]
+                self._drop(oldest)
+
+    def _drop(self, thread_id):
+        self.storage.pop(thread_id, None)
+        for store in (self.writes, getattr(self, 'blobs', {})):
+            for key in [key for key in list(store) if key[0] == thread_id]:
+                store.pop(key, None)
+
+    @property
+    def thread_count(self):
+        # Not __len__: langgraph tests `if checkpointer`, and an empty saver must still be truthy
+        return len(self._touched)
+
+
+def create_checkpointer(kind=CHECKPOINTER, path=CHECKPOINT_PATH):
+    if kind == 'sqlite':
+        try:
+            from langgraph.checkpoint.sqlite import SqliteSaver
+        except ImportError as e:
+            raise ImportError(
+                "S3_CHECKPOINTER=sqlite requires the langgraph-checkpoint-sqlite package "
+                "(pip install langgraph-checkpoint-sqlite)"
+            ) from e
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        return SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+    return BoundedMemorySaver()
+
+
+class RunStore:
+    # Completed stage outputs per run. path=None keeps them in memory. The least recently completed
+    # runs are dropped once there are more than max_runs of them, and stages older than max_age.
+    def __init__(self, path=None, max_age=RUN_MAX_AGE, max_runs=MAX_THREADS):
+        self.max_age = max_age
+        self.max_runs = max_runs
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._connection = sqlite3.connect(path or ':memory:', check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS stages ('
+                'run_id TEXT NOT NULL, stage TEXT NOT NULL, output TEXT NOT NULL, '
+                'completed_at REAL NOT NULL, PRIMARY KEY (run_id, stage))'
+            )
+
+    def get(self, run_id, stage):
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT output FROM stages WHERE run_id = ? AND stage = ?', (run_id, stage)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, run_id, stage, output):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO stages (run_id, stage, output, completed_at) VALUES (?, ?, ?, ?)',
+                (run_id, stage, json.dumps(output), time.time()),
+            )
+            self._connection.execute('DELETE FROM stages WHERE completed_at < ?', (time.time() - self.max_age,))
+            self._connection.execute(
+                'DELETE FROM stages WHERE run_id NOT IN ('
+                'SELECT run_id FROM stages GROUP BY run_id ORDER BY MAX(completed_at) DESC LIMIT ?)',
+                (self.max_runs,),
+            )
+
+    def stages(self, run_id):
+        with self._lock:
+            rows = self._connection.execute(
+                'SELECT stage FROM stages WHERE run_id = ? ORDER BY completed_at', (run_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+def create_run_store(kind=CHECKPOINTER, path=RUN_STORE_PATH):
+    # In memory, stage outputs are kept no longer than the checkpoints they were produced from
+    if kind == 'sqlite':
+        return RunStore(path)
+    return RunStore(max_age=MAX_AGE)
+
+
+def invoke_stage(agent, inputs, config, on_token=None):
+    # Picks an interrupted stage up from its last checkpoint instead of starting it over.
+    # With on_token, the agent's text is passed to on_token(text) as the model streams it.
+    snapshot = agent.get_state(config)
+    if snapshot.values and snapshot.next:
+        return _invoke(agent, None, config, on_token)
+    if snapshot.values and snapshot.values.get('messages'):
+        return snapshot.values
+    return _invoke(agent, inputs, config, on_token)
+
+
+def _invoke(agent, inputs, config, on_token):
+    if on_token is None:
+        return agent.invoke(inputs, config)
+    # Token chunks from the model node; tool-calling turns carry no text
+    for chunk, metadata in agent.stream(inputs, config, stream_mode='messages'):
+        if metadata.get('langgraph_node') == 'agent' and isinstance(chunk.content, str) and chunk.content:
+            on_token(chunk.content)
+    return agent.get_state(config).values
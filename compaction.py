@@ -0,0 +1,131 @@
+# compaction.py
+# Context compaction between S3 agent stages.
+# Instead of replaying every earlier agent's full transcript (tool outputs, the workflow context,
+# intermediate reasoning) into the next agent, only a structured state is carried forward:
+# the numbered steps, their inefficiencies, scores and the metrics cited for them.
+import json
+import os
+import re
+
+import parsing
+
+CONTEXT_BUDGET = int(os.getenv('S3_CONTEXT_BUDGET', 2000))
+
+_encoding = None
+
+SCORE_PATTERN = re.compile(r'(\d+(?:\.\d+)?)\s*(?:/|out of)\s*10\b', re.IGNORECASE)
+STEP_HEADING_PATTERN = re.compile(r'\bstep\s*#?\s*(\d+)\b', re.IGNORECASE)
+METRIC_PATTERN = re.compile(r'metrics?\s*(?:used)?\s*[:\-]\s*([^\n]+)', re.IGNORECASE)
+
+
+def estimate_tokens(text):
+    # tiktoken when it is installed, otherwise the usual ~4 characters per token
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding('cl100k_base')
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+def _content(message):
+    content = message.get('content') if isinstance(message, dict) else getattr(message, 'content', '')
+    return content if isinstance(content, str) else json.dumps(content)
+
+
+def message_tokens(messages):
+    return sum(estimate_tokens(_content(message)) for message in messages)
+
+
+def _final_text(messages):
+    # Content of the last message, which is the agent's answer
+    return _content(messages[-1]) if messages else ''
+
+
+def normalize_steps(items):
+    # Summarizer steps as {step_number, summary, inefficiencies}, whatever shape they came in
+    steps = []
+    for item in items:
+        steps.extend(item['steps'] if isinstance(item.get('steps'), list) else [item])
+    return [
+        {
+            'step_number': step.get('step_number', index),
+            'summary': step.get('summary') or step.get('step_summary', ''),
+            'inefficiencies': list(step.get('inefficiencies') or []),
+        }
+        for index, step in enumerate(steps, start=1) if isinstance(step, dict)
+    ]
+
+
+def summarized_steps(summary_messages):
+    try:
+        return normalize_steps(parsing.parse_steps(_final_text(summary_messages)))
+    except parsing.ParseError:
+        return []
+
+
+def scored_steps(scored_messages):
+    # The scorer answers in prose; pick out each step's score and the metrics it cites
+    text = _final_text(scored_messages)
+    headings = list(STEP_HEADING_PATTERN.finditer(text))
+    scores = {}
+    for heading, following in zip(headings, headings[1:] + [None]):
+        block = text[heading.start():following.start() if following else len(text)]
+        score = SCORE_PATTERN.search(block)
+        scores[int(heading.group(1))] = {
+            'score': float(score.group(1)) if score else None,
+            'metrics': [metric.strip() for metric in METRIC_PATTERN.findall(block)],
+        }
+    return scores
+
+
+def _fit(steps, budget):
+    # Trim the least important detail first until the state fits the token budget
+    def size():
+        return estimate_tokens(json.dumps(steps))
+
+    for limit in (3, 2, 1):
+        if size() <= budget:
+            break
+        for step in steps:
+            step['inefficiencies'] = step['inefficiencies'][:limit]
+            if 'metrics' in step:
+                step['metrics'] = step['metrics'][:limit]
+    while size() > budget and any(len(step['summary']) > 60 for step in steps):
+        for step in steps:
+            step['summary'] = step['summary'][:60]
+    return steps
+
+
+def compact_steps(steps, scored_messages=None, original=(), budget=CONTEXT_BUDGET):
+    # Returns (messages, report). messages holds the structured state as one user message, or the
+    # original messages when there are no steps to carry forward.
+    original = list(original)
+    original_tokens = message_tokens(original)
+    if not steps:
+        return original, {'original_tokens': original_tokens, 'compacted_tokens': original_tokens, 'saved_tokens': 0}
+
+    scores = scored_steps(scored_messages) if scored_messages else {}
+    steps = [{**step, **scores.get(step['step_number'], {})} for step in steps]
+    state = {'steps': _fit(steps, budget)}
+    if scored_messages and any(step.get('score') is None for step in steps):
+        # Scores we could not pick out are kept as a bounded slice of the scorer's answer
+        remaining = max(0, budget - estimate_tokens(json.dumps(state)))
+        state['scorer_notes'] = _final_text(scored_messages)[:remaining * 4]
+    state = json.dumps(state)
+    messages = [{"role": "user", "content": f"Business workflow steps with inefficiencies, scores and metrics: {state}"}]
+    compacted_tokens = message_tokens(messages)
+    return messages, {
+        'original_tokens': original_tokens,
+        'compacted_tokens': compacted_tokens,
+        'saved_tokens': max(0, original_tokens - compacted_tokens),
+    }
+
+
+def compact(summary_messages, scored_messages=None, budget=CONTEXT_BUDGET):
+    original = list(summary_messages) + list(scored_messages or [])
+    return compact_steps(summarized_steps(summary_messages), scored_messages, original, budget)
@@ -0,0 +1,54 @@
+# embeddings.py
+# Sentence embeddings on CPU, shared by the semantic answer cache and the document index.
+# The model is loaded once per process on first use: sentence-transformers pulls in torch, so it
+# is not imported when the app starts (see importtime.py). Vectors are L2-normalized float32,
+# so a dot product is the cosine similarity.
+import logging
+import os
+import threading
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = os.getenv('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
+BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 32))
+
+_model = None
+_error = None
+_lock = threading.Lock()
+
+
+class EmbeddingUnavailable(Exception):
+    pass
+
+
+def get_model():
+    # Raises EmbeddingUnavailable if the model cannot be loaded; the failure is remembered, so
+    # callers fall back without retrying the load on every call
+    global _model, _error
+    with _lock:
+        if _model is None and _error is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+                _model = SentenceTransformer(MODEL_NAME, device='cpu')
+            except Exception as e:
+                _error = e
+                logger.warning("Embedding model %s unavailable: %s", MODEL_NAME, e)
+        if _model is None:
+            raise EmbeddingUnavailable(f'{MODEL_NAME}: {_error}')
+        return _model
+
+
+def embed(texts):
+    # Returns a (len(texts), dimensions) float32 array
+    model = get_model()
+    with tracing.span('embedding', texts=len(texts)):
+        vectors = model.encode(
+            list(texts),
+            batch_size=BATCH_SIZE,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        )
+    return vectors.astype('float32', copy=False)
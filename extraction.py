@@ -0,0 +1,245 @@
+# extraction.py
+# Page-sharded PDF text extraction.
+# PyMuPDF (fitz) is the fast default backend. pdfplumber is only used for the pages that need
+# layout-aware extraction: pages PyMuPDF returns no text for, and table-like pages.
+# Scanned pages, which have no text layer at all, are OCRed (ocr.py) in the same process pool.
+# Images (png, jpg) are converted to one-page PDFs first, so they take the scanned-page path.
+import collections
+import io
+import itertools
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import ocr
+import tracing
+from cache import CACHE_DIR, DiskCache, LRUCache, TieredCache, content_hash
+
+# Bump whenever a change here alters the extracted text for the same input
+EXTRACTOR_VERSION = "3"
+
+MAX_WORKERS = int(os.getenv('EXTRACTION_WORKERS', os.cpu_count() or 1))
+PAGES_PER_SHARD = 16
+# Below this page count the pool hand-off costs more than it saves
+PARALLEL_MIN_PAGES = 8
+# Pages drawing at least this many ruling lines/rectangles are treated as tables
+TABLE_LINE_THRESHOLD = 20
+
+_pool = None
+
+# Extracted text keyed by the hash of the uploaded bytes and EXTRACTOR_VERSION
+document_cache = TieredCache(
+    LRUCache(maxsize=int(os.getenv('DOCUMENT_CACHE_SIZE', 32))),
+    DiskCache(os.path.join(CACHE_DIR, 'documents')),
+)
+
+
+def _get_pool():
+    # One pool per process, so Streamlit reruns don't pay the worker start-up cost again
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+    return _pool
+
+
+def read_pdf_bytes(file):
+    # Accepts a Streamlit UploadedFile, a file-like object, raw bytes or a path
+    if isinstance(file, (bytes, bytearray)):
+        return bytes(file)
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, 'rb') as f:
+            return f.read()
+    if hasattr(file, 'getvalue'):
+        return file.getvalue()
+    file.seek(0)
+    return file.read()
+
+
+def as_pdf(data):
+    # PDF bytes as they are; any other document or image PyMuPDF can open, converted to a PDF
+    if data[:5] == b'%PDF-':
+        return data
+    import fitz  # PyMuPDF
+
+    with fitz.open(stream=data) as doc:
+        return doc.convert_to_pdf()
+
+
+def _needs_layout(page, text):
+    if not text.strip():
+        return True
+    lines = 0
+    for drawing in page.get_drawings():
+        for item in drawing['items']:
+            if item[0] in ('l', 're'):
+                lines += 1
+                if lines >= TABLE_LINE_THRESHOLD:
+                    return True
+    return False
+
+
+def _iter_shard(source, start, stop):
+    # source is either a path (worker processes) or the raw bytes (in-process).
+    # Yields None for pages that need OCR.
+    import fitz  # PyMuPDF
+
+    plumber = None
+    if isinstance(source, bytes):
+        doc = fitz.open(stream=source, filetype='pdf')
+    else:
+        doc = fitz.open(source)
+    try:
+        for number in range(start, stop):
+            page = doc[number]
+            text = page.get_text('text')
+            if ocr.needs_ocr(page, text):
+                yield None
+                continue
+            if _needs_layout(page, text):
+                if plumber is None:
+                    import pdfplumber
+                    plumber = pdfplumber.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+                text = plumber.pages[number].extract_text() or text
+            yield text or ''
+    finally:
+        doc.close()
+        if plumber is not None:
+            plumber.close()
+
+
+def _extract_shard(source, start, stop):
+    return list(_iter_shard(source, start, stop))
+
+
+def page_count(file):
+    import fitz  # PyMuPDF
+
+    with fitz.open(stream=read_pdf_bytes(file), filetype='pdf') as doc:
+        return doc.page_count
+
+
+def _shards(page_count, workers):
+    size = max(1, min(PAGES_PER_SHARD, -(-page_count // workers)))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def _spill(data):
+    # Workers read the document from a temporary file instead of each task pickling the bytes
+    with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
+        tmp.write(data)
+        return tmp.name
+
+
+def _iter_shards(path, total, workers):
+    # At most two shards per worker are in flight, so memory stays flat however long the document is
+    pool = _get_pool()
+    pending = collections.deque()
+    shards = iter(_shards(total, workers))
+    try:
+        for start, stop in itertools.islice(shards, workers * 2):
+            pending.append(pool.submit(_extract_shard, path, start, stop))
+        while pending:
+            texts = pending.popleft().result()
+            shard = next(shards, None)
+            if shard is not None:
+                pending.append(pool.submit(_extract_shard, path, *shard))
+            yield from texts
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def _page_text(item):
+    # item is a page's text or the future of its OCR
+    if isinstance(item, str):
+        return item
+    try:
+        return item.result()
+    except ocr.OCRUnavailable as e:
+        ocr.unavailable(e)
+        return ''
+
+
+def _ocr_pages(texts, source, workers):
+    # Replaces the pages _iter_shard marked None with their OCR text, keeping page order.
+    # Up to two pages per worker are recognised in the pool at once, even for short documents.
+    path = None if isinstance(source, bytes) else source
+    pending = collections.deque()
+    try:
+        for number, text in enumerate(texts):
+            if text is None and workers <= 1:
+                try:
+                    text = ocr.ocr_page(source, number)
+                except ocr.OCRUnavailable as e:
+                    ocr.unavailable(e)
+                    text = ''
+            elif text is None:
+                if path is None:
+                    path = _spill(source)
+                text = _get_pool().submit(ocr.ocr_page, path, number)
+            pending.append(text)
+            while pending and (isinstance(pending[0], str) or pending[0].done() or len(pending) > workers * 2):
+                yield _page_text(pending.popleft())
+        while pending:
+            yield _page_text(pending.popleft())
+    finally:
+        for item in pending:
+            if not isinstance(item, str):
+                item.cancel()
+        if path is not None and path is not source:
+            os.unlink(path)
+
+
+def iter_pages(file, workers=None):
+    # Yields the text of every page, in page order, as soon as it is available
+    data = as_pdf(read_pdf_bytes(file))
+    total = page_count(data)
+    workers = workers or MAX_WORKERS
+
+    if workers <= 1 or total < PARALLEL_MIN_PAGES:
+        yield from _ocr_pages(_iter_shard(data, 0, total), data, workers)
+        return
+
+    path = _spill(data)
+    del data
+    try:
+        yield from _ocr_pages(_iter_shards(path, total, workers), path, workers)
+    finally:
+        os.unlink(path)
+
+
+def extract_text(file, workers=None, progress=None):
+    # progress(done, total) is called after every page when given
+    data = as_pdf(read_pdf_bytes(file))
+    total = page_count(data) if progress else None
+    parts = []
+    for done, page in enumerate(iter_pages(data, workers=workers), start=1):
+        page = page.strip()
+        if page:
+            parts.append(page)
+        if progress:
+            progress(done, total)
+    return ' '.join(parts)
+
+
+def document_key(data):
+    return content_hash(data, EXTRACTOR_VERSION)
+
+
+def cached_extract_text(file, workers=None, progress=None):
+    # Returns (text, cache_hit); reruns and re-uploads of the same document skip extraction
+    with tracing.span('extraction') as span:
+        data = read_pdf_bytes(file)
+        span.set('bytes', len(data))
+        key = document_key(data)
+        text = document_cache.get(key)
+        cache_hit = text is not None
+        span.set(tracing.CACHE_HIT, cache_hit)
+        if not cache_hit:
+            failures = ocr.failures
+            text = extract_text(data, workers=workers, progress=progress)
+            # Not cached when pages went unrecognised, so they are OCRed once Tesseract is installed
+            if ocr.failures == failures:
+                document_cache.set(key, text)
+        span.set('characters', len(text))
+        return text, cache_hit
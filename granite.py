@@ -0,0 +1,205 @@
+# granite.py
+# Granite text-generation calls on watsonx.ai, with a deterministic response cache.
+# Greedy decoding always gives the same output for the same model, prompt and parameters, so
+# those responses are cached (LRU + TTL in memory, optionally persisted to disk).
+import hashlib
+import json
+import os
+
+import budgets
+import http_client
+import iam
+import scheduler
+import tracing
+import usage
+from cache import CACHE_DIR, DiskCache, LRUCache, TieredCache, content_hash
+
+WATSONX_URL = os.getenv('WATSONX_URL', 'https://us-south.ml.cloud.ibm.com')
+GENERATION_URL = f'{WATSONX_URL}/ml/v1/text/generation?version=2023-05-29'
+GENERATION_STREAM_URL = f'{WATSONX_URL}/ml/v1/text/generation_stream?version=2023-05-29'
+
+MODEL_ID = "ibm/granite-3-8b-instruct"
+PROJECT_ID = "f284f75e-ea6b-4395-a973-1b7b02b2c176"
+
+DEFAULT_PARAMETERS = {
+    'decoding_method': 'greedy',
+    # Callers size this to the document with budgets.generation_budget(); this default assumes
+    # budgets.DEFAULT_STEPS steps
+    'max_new_tokens': budgets.generation_budget(),
+    'min_new_tokens': 0,
+    'repetition_penalty': 1
+}
+
+CACHE_SIZE = int(os.getenv('GENERATION_CACHE_SIZE', 64))
+CACHE_TTL = float(os.getenv('GENERATION_CACHE_TTL', 24 * 60 * 60))
+CACHE_PERSIST = os.getenv('GENERATION_CACHE_PERSIST', '0') == '1'
+
+response_cache = TieredCache(
+    LRUCache(maxsize=CACHE_SIZE, ttl=CACHE_TTL),
+    DiskCache(os.path.join(CACHE_DIR, 'generations'), ttl=CACHE_TTL) if CACHE_PERSIST else None,
+)
+
+
+class GenerationError(Exception):
+    def __init__(self, status_code, text):
+        super().__init__(f'{status_code} - {text}')
+        self.status_code = status_code
+        self.text = text
+
+
+def is_deterministic(parameters):
+    # Sampling is only reproducible when a random seed is pinned
+    return parameters.get('decoding_method', 'greedy') == 'greedy' or 'random_seed' in parameters
+
+
+def cache_key(prompt, parameters, model_id=MODEL_ID):
+    prompt_hash = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+    return content_hash(model_id, prompt_hash, json.dumps(parameters, sort_keys=True))
+
+
+def generate(prompt, parameters=None, model_id=MODEL_ID, project_id=PROJECT_ID,
+             api_key_env='NEW_API_KEY', bypass_cache=False):
+    # Returns (response_data, cache_hit). bypass_cache skips the lookup but still stores the
+    # fresh response. Raises GenerationError on a non-200 response.
+    with tracing.span('granite.generate', model_id=model_id) as span:
+        parameters = {**DEFAULT_PARAMETERS, **(parameters or {})}
+        span.set('max_new_tokens', parameters.get('max_new_tokens'))
+        cacheable = is_deterministic(parameters)
+        key = cache_key(prompt, parameters, model_id)
+
+        if cacheable and not bypass_cache:
+            cached = response_cache.get(key)
+            if cached is not None:
+                span.set(tracing.CACHE_HIT, True)
+                return cached, True
+
+        span.set(tracing.CACHE_HIT, False)
+        estimate = estimate_tokens(prompt, parameters)
+        response = http_client.post(
+            GENERATION_URL,
+            endpoint='generation',
+            headers=_headers(api_key_env),
+            json=_body(prompt, parameters, model_id, project_id),
+            tokens=estimate,
+        )
+        if response.status_code != 200:
+            raise GenerationError(response.status_code, response.text)
+
+        response_data = response.json()
+        _record_tokens(span, response_data.get('results', [{}])[0], estimate)
+        if cacheable:
+            response_cache.set(key, response_data)
+        return response_data, False
+
+
+def estimate_tokens(prompt, parameters):
+    # What the scheduler charges before the call: the prompt plus the whole output budget
+    return scheduler.estimate_tokens(prompt) + parameters.get('max_new_tokens', 0)
+
+
+def _record_tokens(span, result, estimate):
+    span.set(tracing.INPUT_TOKENS, result.get('input_token_count', 0))
+    span.set(tracing.GENERATED_TOKENS, result.get('generated_token_count', 0))
+    if result.get('stop_reason'):
+        span.set('stop_reason', result['stop_reason'])
+    usage.record_generation(result)
+    scheduler.correct(estimate, result.get('input_token_count', 0) + result.get('generated_token_count', 0))
+
+
+def truncated(response_data):
+    # True when generation stopped because it ran out of max_new_tokens
+    return response_data.get('results', [{}])[0].get('stop_reason') == 'max_tokens'
+
+
+def _body(prompt, parameters, model_id, project_id):
+    return {
+        'input': prompt,
+        'Output': '',
+        'parameters': parameters,
+        'model_id': model_id,
+        'project_id': project_id
+    }
+
+
+def _headers(api_key_env, accept="application/json"):
+    return {
+        "Accept": accept,
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {iam.get_token(api_key_env)}"
+    }
+
+
+def stream_generate(prompt, parameters=None, model_id=MODEL_ID, project_id=PROJECT_ID,
+                    api_key_env='NEW_API_KEY', bypass_cache=False):
+    # Returns (chunks, cache_hit) where chunks yields generated text as it arrives and returns the
+    # response, in the shape generate() returns, when exhausted (`response = yield from chunks`).
+    # A cached response is replayed as a single chunk; a completed stream is stored in the same
+    # cache unless it was cut off at max_new_tokens.
+    parameters = {**DEFAULT_PARAMETERS, **(parameters or {})}
+    cacheable = is_deterministic(parameters)
+    key = cache_key(prompt, parameters, model_id)
+
+    if cacheable and not bypass_cache:
+        cached = response_cache.get(key)
+        if cached is not None:
+            tracing.start_span('granite.stream', model_id=model_id, **{tracing.CACHE_HIT: True}).end()
+            return _replay(cached), True
+
+    # Not a current span: the generator is resumed from the caller's context between chunks
+    span = tracing.start_span('granite.stream', model_id=model_id, max_new_tokens=parameters.get('max_new_tokens'),
+                              **{tracing.CACHE_HIT: False})
+
+    def chunks():
+        error = None
+        estimate = estimate_tokens(prompt, parameters)
+        try:
+            with tracing.use_span(span):
+                response = http_client.post(
+                    GENERATION_STREAM_URL,
+                    endpoint='generation',
+                    headers=_headers(api_key_env, accept="text/event-stream"),
+                    json=_body(prompt, parameters, model_id, project_id),
+                    stream=True,
+                    tokens=estimate,
+                )
+            if response.status_code != 200:
+                error = GenerationError(response.status_code, response.text)
+                # Return the streamed connection to the pool before giving up on it
+                response.close()
+                raise error
+
+            generated = []
+            result = {}
+            with response:
+                for event in http_client.iter_events(response):
+                    for result in event.get('results', []):
+                        text = result.get('generated_text', '')
+                        if text:
+                            if not generated:
+                                span.set('first_chunk_seconds', round(span.duration, 3))
+                            generated.append(text)
+                            yield text
+            _record_tokens(span, result, estimate)
+        except GeneratorExit:
+            span.set('abandoned', True)
+            raise
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            span.end(error)
+        # The last event carries the final token counts and stop reason
+        response_data = {
+            'model_id': model_id,
+            'results': [{**result, 'generated_text': ''.join(generated)}],
+        }
+        if cacheable and not truncated(response_data):
+            response_cache.set(key, response_data)
+        return response_data
+
+    return chunks(), False
+
+
+def _replay(response_data):
+    yield response_data['results'][0]['generated_text']
+    return response_data
@@ -0,0 +1,143 @@
+# http_client.py
+# Shared HTTP client for watsonx and IAM calls: one pooled keep-alive session per process,
+# per-endpoint timeouts and jittered exponential backoff on 429/5xx and connection errors.
+# Model calls pass their estimated token cost and go through the shared scheduler (scheduler.py).
+import json
+import logging
+import random
+import threading
+import time
+
+import scheduler
+import tracing
+
+logger = logging.getLogger(__name__)
+
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 32
+
+# (connect, read) timeouts in seconds per logical endpoint
+TIMEOUTS = {
+    'iam': (5, 30),
+    'generation': (5, 300),
+    'ai_service': (5, 600),
+    'default': (5, 60),
+}
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+
+_session = None
+_session_lock = threading.Lock()
+
+# Callables invoked as listener(endpoint, method, status, elapsed, attempt) after every attempt;
+# status is None when the attempt raised
+latency_listeners = []
+
+
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            # requests is imported on the first call rather than when the app starts
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+        return _session
+
+
+def add_latency_listener(listener):
+    latency_listeners.append(listener)
+
+
+def _report(endpoint, method, status, elapsed, attempt):
+    logger.info("%s %s -> %s in %.3fs (attempt %d)", method, endpoint, status, elapsed, attempt)
+    for listener in latency_listeners:
+        try:
+            listener(endpoint, method, status, elapsed, attempt)
+        except Exception as e:
+            logger.warning("Latency listener failed: %s", e)
+
+
+def retry_after(response):
+    # Seconds requested by a Retry-After header, if it is given in seconds
+    value = response.headers.get('Retry-After') if response is not None else None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, response=None):
+    # Full jitter, but never sooner than the server asked for
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+    requested = retry_after(response)
+    if requested is not None:
+        delay = max(delay, requested)
+    return delay
+
+
+def request(method, url, endpoint='default', timeout=None, retries=MAX_RETRIES, tokens=None, **kwargs):
+    # Returns the last response, even if it still has a retryable status after all retries,
+    # so callers keep their own status_code handling. Connection errors are re-raised.
+    # With tokens (the call's estimated cost) every attempt waits for admission by the scheduler,
+    # and a 429's Retry-After holds back all scheduled calls, not just this one. Attempts that
+    # fail with a connection error or a retryable status used no tokens, so their charge is refunded.
+    import requests
+
+    session = get_session()
+    timeout = timeout or TIMEOUTS.get(endpoint, TIMEOUTS['default'])
+    for attempt in range(retries + 1):
+        if tokens is not None:
+            scheduler.acquire(tokens)
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _report(endpoint, method, None, time.perf_counter() - started, attempt + 1)
+            if tokens is not None:
+                scheduler.correct(tokens, 0)
+            if attempt == retries:
+                raise
+            tracing.add_attribute(tracing.RETRIES)
+            delay = backoff_delay(attempt)
+            logger.warning("%s %s failed (%s); retrying in %.2fs", method, endpoint, e, delay)
+            time.sleep(delay)
+            continue
+
+        _report(endpoint, method, response.status_code, time.perf_counter() - started, attempt + 1)
+        if tokens is not None and response.status_code in RETRY_STATUSES:
+            scheduler.correct(tokens, 0)
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            return response
+        tracing.add_attribute(tracing.RETRIES)
+        delay = backoff_delay(attempt, response)
+        if tokens is not None and response.status_code == 429 and retry_after(response) is not None:
+            scheduler.pause(retry_after(response))
+        logger.warning("%s %s returned %s; retrying in %.2fs", method, endpoint, response.status_code, delay)
+        response.close()
+        time.sleep(delay)
+
+
+def iter_events(response):
+    # Server-sent events from a streamed response: one JSON payload per `data:` line
+    for line in response.iter_lines(decode_unicode=True):
+        if line and line.startswith('data:'):
+            data = line[len('data:'):].strip()
+            if data:
+                yield json.loads(data)
+
+
+def post(url, endpoint='default', **kwargs):
+    return request('POST', url, endpoint=endpoint, **kwargs)
+
+
+def get(url, endpoint='default', **kwargs):
+    return request('GET', url, endpoint=endpoint, **kwargs)
@@ -0,0 +1,115 @@
+# iam.py
+# Shared IBM Cloud IAM token provider.
+# Tokens are fetched lazily on first use, cached until shortly before they expire and refreshed
+# in the background, so callers never block on IAM while a valid token exists. A lock ensures
+# concurrent sessions trigger a single refresh.
+import logging
+import os
+import threading
+import time
+
+import http_client
+import tracing
+
+logger = logging.getLogger(__name__)
+
+IAM_URL = os.getenv('IBM_IAM_URL', 'https://iam.cloud.ibm.com/identity/token')
+# Refresh this many seconds before the token's expires_in runs out
+REFRESH_MARGIN = 300
+# Used when IAM does not report expires_in
+DEFAULT_EXPIRES_IN = 3600
+
+
+class TokenError(Exception):
+    pass
+
+
+class TokenProvider:
+    def __init__(self, api_key_env='IBM_API_KEY', refresh_margin=REFRESH_MARGIN):
+        self.api_key_env = api_key_env
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._refreshing_lock = threading.Lock()
+
+    def _fetch(self):
+        api_key = os.getenv(self.api_key_env)
+        if not api_key:
+            raise TokenError(f"{self.api_key_env} environment variable not set.")
+
+        requested_at = time.time()
+        response = http_client.post(
+            IAM_URL,
+            endpoint='iam',
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            data={"grant_type": "urn:ibm:params:oauth:grant-type:apikey", "apikey": api_key},
+        )
+        if response.status_code != 200:
+            raise TokenError(f"Error with IAM token: {response.text}")
+        payload = response.json()
+        token = payload.get("access_token")
+        if not token:
+            raise TokenError("Access token not found in response!")
+        expires_in = payload.get("expires_in") or DEFAULT_EXPIRES_IN
+        return token, requested_at + expires_in
+
+    def _is_fresh(self):
+        return self._token is not None and time.time() < self._expires_at - self.refresh_margin
+
+    def _refresh(self):
+        with self._lock:
+            # Another caller may have refreshed while we waited for the lock
+            if not self._is_fresh():
+                with tracing.span('iam.refresh'):
+                    self._token, self._expires_at = self._fetch()
+                logger.info("IAM token refreshed for %s", self.api_key_env)
+            return self._token
+
+    def _refresh_in_background(self):
+        with self._refreshing_lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self._refresh()
+            except Exception as e:
+                logger.warning("Background IAM token refresh failed: %s", e)
+            finally:
+                with self._refreshing_lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name=f"iam-refresh-{self.api_key_env}", daemon=True).start()
+
+    def get_token(self):
+        if self._is_fresh():
+            return self._token
+        if self._token is not None and time.time() < self._expires_at:
+            # Still valid but inside the refresh margin: serve it and refresh behind the caller
+            self._refresh_in_background()
+            return self._token
+        return self._refresh()
+
+    def invalidate(self):
+        with self._lock:
+            self._token = None
+            self._expires_at = 0.0
+
+
+_providers = {}
+_providers_lock = threading.Lock()
+
+
+def get_provider(api_key_env='IBM_API_KEY'):
+    with _providers_lock:
+        provider = _providers.get(api_key_env)
+        if provider is None:
+            provider = _providers[api_key_env] = TokenProvider(api_key_env)
+        return provider
+
+
+def get_token(api_key_env='IBM_API_KEY'):
+    return get_provider(api_key_env).get_token()
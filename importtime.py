@@ -0,0 +1,91 @@
+# importtime.py
+# Import-time report: what it costs to start the app or a worker, broken down by module.
+# Each target is imported in a fresh interpreter with `python -X importtime`, with socket access
+# recorded, so the report also shows any network call made while importing.
+#
+#   python importtime.py                  (utils, batch and the pipeline modules)
+#   python importtime.py main --top 30    (the Streamlit script itself)
+import argparse
+import collections
+import os
+import subprocess
+import sys
+
+DEFAULT_TARGETS = ['utils', 'batch', 'analysis', 'extraction', 'jobs']
+
+# Runs in the child interpreter before the target is imported
+GUARD = '''
+import socket, sys
+_calls = []
+def _record(name, original):
+    def wrapper(*args, **kwargs):
+        _calls.append('%s%r' % (name, args[1:2] if name == 'connect' else args[:2]))
+        return original(*args, **kwargs)
+    return wrapper
+socket.socket.connect = _record('connect', socket.socket.connect)
+socket.getaddrinfo = _record('getaddrinfo', socket.getaddrinfo)
+sys.stderr.write('start\\n')
+import {target}
+for call in _calls:
+    sys.stderr.write('network: %s\\n' % call)
+'''
+
+
+def measure(target):
+    # Returns (per-package self time in microseconds, cumulative time of the target, network calls)
+    here = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', GUARD.format(target=target)],
+        cwd=here, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f'importing {target} failed:\n{result.stderr.strip().splitlines()[-1]}')
+
+    packages = collections.Counter()
+    total = 0
+    network = []
+    # Only what the target imports counts, not the guard's own imports before the marker
+    lines = result.stderr.splitlines()
+    for line in lines[lines.index('start') + 1:]:
+        if line.startswith('network: '):
+            network.append(line[len('network: '):])
+            continue
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        packages[name.split('.')[0]] += int(self_us)
+        if name == target:
+            total = int(cumulative_us)
+    return packages, total, network
+
+
+def report(targets, top=15):
+    # Returns the number of targets that failed to import or made network calls while importing
+    offenders = 0
+    for target in targets:
+        try:
+            packages, total, network = measure(target)
+        except RuntimeError as e:
+            print(f'{e}\n')
+            offenders += 1
+            continue
+        print(f'{target}: {total / 1000:.1f} ms to import')
+        for name, self_us in packages.most_common(top):
+            print(f'  {self_us / 1000:8.1f} ms  {name}')
+        for call in network:
+            print(f'  network call during import: {call}')
+        offenders += bool(network)
+        print()
+    return offenders
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Report import time per module and network calls made while importing.')
+    parser.add_argument('targets', nargs='*', default=DEFAULT_TARGETS, help='modules to import')
+    parser.add_argument('--top', type=int, default=15, help='packages listed per target')
+    args = parser.parse_args(argv)
+    return 1 if report(args.targets, args.top) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
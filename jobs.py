@@ -0,0 +1,148 @@
+# jobs.py
+# Background job execution for long analyses.
+# Jobs run on a process-wide worker pool instead of the Streamlit script thread. Each job has an
+# ID the UI polls for status and partial results, and finished results are written to disk so
+# they survive reruns, reconnects and restarts.
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from cache import CACHE_DIR, DiskCache
+
+MAX_WORKERS = int(os.getenv('S3_JOB_WORKERS', 2))
+JOB_RESULT_TTL = float(os.getenv('S3_JOB_RESULT_TTL', 7 * 24 * 60 * 60))
+# Finished jobs stay in memory this long; after that they are served from the disk store
+JOB_MEMORY_TTL = 60 * 60
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class Job:
+    def __init__(self, job_id):
+        self.id = job_id
+        self.status = QUEUED
+        self.partial = []
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.trace_id = None
+
+    @property
+    def done(self):
+        return self.status in (SUCCEEDED, FAILED)
+
+    def report(self, stage, output=None):
+        # Called from the worker as each stage completes
+        self.partial.append({'stage': stage, 'output': output, 'at': time.time()})
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'partial': self.partial,
+            'result': self.result,
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'trace_id': self.trace_id,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        job = cls(data['id'])
+        for key, value in data.items():
+            if key != 'id':
+                setattr(job, key, value)
+        return job
+
+
+class JobManager:
+    def __init__(self, max_workers=MAX_WORKERS, store=None):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='s3-job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.store = store
+
+    def submit(self, job_id, fn, *args, **kwargs):
+        # fn(*args, report=job.report, **kwargs) runs on the pool. Submitting an ID that already
+        # has a job returns that job instead of starting another one, including a failed job, so
+        # its error can be shown; resubmit starts it again.
+        return self._submit(job_id, fn, args, kwargs, retry=False)
+
+    def resubmit(self, job_id, fn, *args, **kwargs):
+        # Like submit, but a failed job is started again
+        return self._submit(job_id, fn, args, kwargs, retry=True)
+
+    def _submit(self, job_id, fn, args, kwargs, retry):
+        with self._lock:
+            job = self._jobs.get(job_id) or self._load(job_id)
+            if job is not None and not (retry and job.status == FAILED):
+                self._jobs[job_id] = job
+                return job
+            self._prune()
+            job = self._jobs[job_id] = Job(job_id)
+        self._pool.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                job = self._load(job_id)
+                if job is not None:
+                    self._jobs[job_id] = job
+            return job
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.done and now - job.finished_at > JOB_MEMORY_TTL:
+                del self._jobs[job_id]
+
+    def _load(self, job_id):
+        if self.store is None:
+            return None
+        data = self.store.get(job_id)
+        return Job.from_dict(data) if data else None
+
+    def _run(self, job, fn, args, kwargs):
+        job.status = RUNNING
+        job.started_at = time.time()
+        try:
+            with tracing.span('job', root=True, job_id=job.id) as span:
+                job.trace_id = span.trace_id
+                job.result = fn(*args, report=job.report, **kwargs)
+            job.status = SUCCEEDED
+        except Exception as e:
+            traceback.print_exc()
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            job.finished_at = time.time()
+            # Only results are kept; a failure may be transient and is retried from memory
+            if self.store is not None and job.status == SUCCEEDED:
+                try:
+                    self.store.set(job.id, job.to_dict())
+                except Exception as e:
+                    print(f"Could not store result of job {job.id}: {e}")
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager(store=DiskCache(os.path.join(CACHE_DIR, 'jobs'), ttl=JOB_RESULT_TTL))
+        return _manager
@@ -1,21 +1,32 @@
 import streamlit as st
-import pdfplumber
-import fitz  # PyMuPDF
 # from sentence_transformers import SentenceTransformer
-import requests
-import os
 from dotenv import load_dotenv
 import json
+import logging
 import time
-from streamlit_flow import streamlit_flow
-from streamlit_flow.elements import StreamlitFlowNode, StreamlitFlowEdge
-from streamlit_flow.state import StreamlitFlowState
-import pandas as pd
-import altair as alt
+# streamlit_flow, pandas and altair are imported where they are used, so the app starts without
+# them (see importtime.py)
+import analysis
+import cache
+import chat_history
+import extraction
+import granite
+import http_client
+import parsing
+import utils
+import iam
+import jobs
+import scheduler
+import semantic_cache
+import tracing
+import usage
+import vector_index
 
 # pip install pdfplumber sentence-transformers firebase-admin pinecone-client  requests
 
 load_dotenv()
+tracing.configure()  # Exporters and the metrics endpoint, if configured; once per process
+logger = logging.getLogger(__name__)
 
 st.title("IBM Granite Hackathon: WorkWiseAI")
 st.write('Built on IBM’s open source granite-3.1-8b-instruct powered by IBM AgentLab, WorkWiseAI provides businesses with deep workflow insights, data-driven efficiency scoring, and AI-generated optimization strategies.')
@@ -24,65 +35,165 @@ st.markdown("View [GitHub repository](https://www.github.com/ParinAcharyaGit/wor
 
 # embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
 
-# Authentication token for IBM Watson
-API_KEY = os.environ['IBM_API_KEY']
-token_response = requests.post('https://iam.cloud.ibm.com/identity/token', data={"apikey":
-API_KEY, "grant_type": 'urn:ibm:params:oauth:grant-type:apikey'})
-mltoken = token_response.json()["access_token"]
-
-def generate_iam_token():
-    # Retrieve and trim the API key from the environment variable.
-    NEW_API_KEY = os.environ.get('NEW_API_KEY')
-
-    url = 'https://iam.cloud.ibm.com/identity/token'
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
-    data = {
-        "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
-        "apikey": NEW_API_KEY
-    }
-
-    response = requests.post(url, headers=headers, data=data)
-    if response.status_code == 200:
-        token = response.json().get("access_token")
-        if token:
-            return token
-        else:
-            print("Access token not found in response!")
-            return None
-    else:
-        print('Error with IAM token:', response.text)
-        return None
+def extract_text_from_pdf(file):
+    # Pages are sharded across a process pool; PyMuPDF first, pdfplumber for layout-heavy pages,
+    # OCR for scanned pages and images.
+    # Results are cached by content hash, so reruns of the same BPD skip extraction entirely.
+    progress_bar = st.progress(0.0, text='Extracting text...')
 
-access_token = generate_iam_token()
-print(access_token)
+    def report_progress(done, total):
+        progress_bar.progress(done / total, text=f'Extracted page {done} of {total}')
 
-def extract_text_from_pdf(file):
-    start_time = time.time()  # Start timing
-    text = ''
-    with pdfplumber.open(file) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + ' '  # Concatenate text from each page
-    end_time = time.time()  # End timing
-    extraction_time = end_time - start_time  # Calculate extraction time
-    st.write(f'Time taken to extract text: {extraction_time:.2f} seconds')  # Display extraction time
+    # Timing and cache hits are recorded on the extraction span and shown in the timing panel
+    text, cache_hit = extraction.cached_extract_text(file, progress=report_progress)
+    progress_bar.empty()
     return text.strip()  # Return the extracted text without leading/trailing spaces
 
+def show_timings(trace_ids):
+    # Timing panel: every finished stage of the given traces, with tokens, retries and cache hits
+    rows = tracing.timings([trace_id for trace_id in trace_ids if trace_id])
+    if rows:
+        with st.expander('Stage timings'):
+            st.dataframe(rows, use_container_width=True, hide_index=True)
+
+def session_usage():
+    # Token totals for this browser session, kept across reruns
+    return st.session_state.setdefault('session_usage', usage.TokenUsage())
+
+def show_usage(label, ledger):
+    st.caption(f'{label}: {ledger.input_tokens:,} input + {ledger.output_tokens:,} output tokens '
+               f'in {ledger.calls} model calls')
+
+def show_session_usage():
+    ledger = session_usage()
+    with usage_panel.container():
+        st.metric('Session tokens', f'{ledger.total_tokens:,}')
+        st.caption(f'{ledger.input_tokens:,} input + {ledger.output_tokens:,} output in {ledger.calls} model calls')
+        answers = semantic_cache.answers
+        if answers.hits + answers.misses:
+            st.caption(f'Answer cache: {answers.hit_rate:.0%} hit rate over {answers.hits + answers.misses} '
+                       'questions (all sessions)')
+
+AI_SERVICE_URL = f'{granite.WATSONX_URL}/ml/v4/deployments/528030d4-dac7-48b5-b39f-3776f6bb4ecc'
+
+def record_reply_usage(reply_usage, estimate):
+    # The AI service reports what the agents used for a reply
+    if reply_usage:
+        session_usage().merge(reply_usage)
+        scheduler.correct(estimate, usage.TokenUsage.from_dict(reply_usage).total_tokens)
+
+def stream_reply(messages):
+    # Yields the assistant's reply as the ai_service deployment streams it; a deployment without
+    # a stream endpoint gets one non-streamed call instead. Interactive, so the scheduler admits
+    # it ahead of queued S3 and batch calls.
+    payload = {"messages": messages}
+    estimate = scheduler.estimate_tokens(json.dumps(payload))
+    headers = {'Authorization': 'Bearer ' + iam.get_token()}
+    response = http_client.post(f'{AI_SERVICE_URL}/ai_service_stream?version=2021-05-01', endpoint='ai_service',
+                                json=payload, headers=headers, tokens=estimate, stream=True)
+    if response.status_code != 200:
+        response.close()
+        response = http_client.post(f'{AI_SERVICE_URL}/ai_service?version=2021-05-01', endpoint='ai_service',
+                                    json=payload, headers=headers, tokens=estimate)
+        final_data = response.json()
+        record_reply_usage(final_data.get('usage'), estimate)
+        yield final_data['choices'][0]['message']['content']
+        return
+    with response:
+        for event in http_client.iter_events(response):
+            record_reply_usage(event.get('usage'), estimate)
+            for choice in event.get('choices', []):
+                text = (choice.get('delta') or {}).get('content')
+                if text:
+                    yield text
+
+def step_node(i, step):
+    step_summary = step['step_summary']
+    efficiency_score = step['efficiency_score']
+    explanation = step['explanation']
+
+    # Determine the background color based on the efficiency score
+    if efficiency_score < 4:
+        background_color = '#ff4d4d'  # Red
+    elif efficiency_score < 7:
+        background_color = '#ffcc00'  # Orange
+    else:
+        background_color = '#00c04b'  # Green
+
+    content = f'Step: {step_summary}\nScore: {efficiency_score}\nExplanation: {explanation}'
+
+    from streamlit_flow.elements import StreamlitFlowNode
+    return StreamlitFlowNode(
+        id=str(i + 1),  # Node ID starts from 1
+        pos=(100 + i * 300, 100),  # Increase spacing between nodes
+        data={'content': content},
+        node_type='default',  # Change as needed
+        source_position='right',
+        target_position='left',
+        draggable=False,
+        style={'color': 'white', 'backgroundColor': background_color, 'border': '2px solid white', 'width': '200px'}  # Set background color
+    )
+
+def step_edge(i):
+    # Edge from step i to step i + 1 (0-based)
+    from streamlit_flow.elements import StreamlitFlowEdge
+    return StreamlitFlowEdge(
+        id=f'{i+1}-{i+2}',
+        source=str(i + 1),
+        target=str(i + 2),
+        animated=True,
+        marker_end={'type': 'arrow'}
+    )
+
+def render_flow(nodes, edges, key='static_flow'):
+    # Create the flow state and render the flow visualization
+    from streamlit_flow import streamlit_flow
+    from streamlit_flow.state import StreamlitFlowState
+
+    state = StreamlitFlowState(nodes, edges)
+    streamlit_flow(key,
+                   state,
+                   fit_view=True,
+                   show_minimap=False,
+                   show_controls=False,
+                   pan_on_drag=True,
+                   allow_zoom=True)  # Allow zooming for better visibility
+
+def stream_flow_diagram(text, bypass_cache=False):
+    # Streams the Granite analysis and appends each step's node and edge to the diagram as soon
+    # as the step object is complete. Returns (response_data, cache_hit) like analysis.analyze.
+    chunks, cache_hit = analysis.stream_analyze(text, bypass_cache=bypass_cache)
+    placeholder = st.empty()
+    nodes, edges = [], []
+    generated = []
+
+    def record(chunks):
+        for chunk in chunks:
+            generated.append(chunk)
+            yield chunk
+
+    # Steps are recovered one by one, so a stray token late in the output only costs that step
+    for step in parsing.iter_steps(record(chunks), parsing.STEP_KEYS):
+        i = len(nodes)
+        nodes.append(step_node(i, step))
+        if i > 0:
+            edges.append(step_edge(i - 1))
+        with placeholder.container():
+            # A new key per update so each redraw replaces the previous component
+            render_flow(list(nodes), list(edges), key=f'static_flow_{i + 1}')
+    response_data = {'results': [{'generated_text': ''.join(generated)}]}
+    if not nodes:
+        extract_from_granite(response_data)  # Reports the parse error
+    return response_data, cache_hit
+
 def extract_from_granite(response_data):
     workflow_steps = []  # Initialize workflow_steps to avoid UnboundLocalError
     try:
         # Access the results
         results = response_data['results'][0]['generated_text']
         
-        # Extract the JSON output from the generated text
-        json_output = results.replace("[JSON Output]", "").strip()  # Remove the [JSON Output] marker
-        json_output = json_output[json_output.find("["):].strip()  # Find the actual array start
-        
-        # Load the JSON output
-        workflow_steps = json.loads(json_output)  # Parse the JSON
+        # Recover every complete step object, repairing malformed or truncated output
+        workflow_steps = parsing.parse_steps(results, parsing.STEP_KEYS)
         
         # Print each step's details to the terminal
         for step in workflow_steps:
@@ -94,7 +205,7 @@ def extract_from_granite(response_data):
             print(f"Explanation: {explanation}")
             print("-" * 40)  # Separator for readability
 
-    except json.JSONDecodeError as e:
+    except parsing.ParseError as e:
         st.error(f"Failed to decode JSON: {str(e)}")
     except IndexError as e:
         st.error(f"Index error: {str(e)} - Check the structure of the response data.")
@@ -104,63 +215,18 @@ def extract_from_granite(response_data):
     if workflow_steps:  # Only proceed if workflow_steps is not empty
         st.write("Generating flow diagram...")
 
-        # Create nodes for each workflow step
-        nodes = []
-        for i, step in enumerate(workflow_steps):
-            step_summary = step['step_summary']
-            efficiency_score = step['efficiency_score']
-            explanation = step['explanation']
-            
-            # Determine the background color based on the efficiency score
-            if efficiency_score < 4:
-                background_color = '#ff4d4d'  # Red
-            elif efficiency_score < 7:
-                background_color = '#ffcc00'  # Orange
-            else:
-                background_color = '#00c04b'  # Green
-
-            content = f'Step: {step_summary}\nScore: {efficiency_score}\nExplanation: {explanation}'
-            
-            node = StreamlitFlowNode(
-                id=str(i + 1),  # Node ID starts from 1
-                pos=(100 + i * 300, 100),  # Increase spacing between nodes
-                data={'content': content},
-                node_type='default',  # Change as needed
-                source_position='right',
-                target_position='left',
-                draggable=False,
-                style={'color': 'white', 'backgroundColor': background_color, 'border': '2px solid white', 'width': '200px'}  # Set background color
-            )
-            nodes.append(node)
-
-        # Create edges for the flow in a linear fashion
-        edges = []
-        for i in range(len(workflow_steps) - 1):
-            edges.append(StreamlitFlowEdge(
-                id=f'{i+1}-{i+2}', 
-                source=str(i + 1), 
-                target=str(i + 2), 
-                animated=True, 
-                marker_end={'type': 'arrow'}
-            ))
-
-        # Create the flow state
-        state = StreamlitFlowState(nodes, edges)
-
-        # Render the flow visualization
-        streamlit_flow('static_flow',
-                       state,
-                       fit_view=True,
-                       show_minimap=False,
-                       show_controls=False,
-                       pan_on_drag=True,
-                       allow_zoom=True)  # Allow zooming for better visibility
+        # Create nodes for each workflow step, with edges for the flow in a linear fashion
+        nodes = [step_node(i, step) for i, step in enumerate(workflow_steps)]
+        edges = [step_edge(i) for i in range(len(workflow_steps) - 1)]
+        render_flow(nodes, edges)
     else:
         st.error("No workflow steps found. Please check the response data.")
 # function ends here
 
 # Starting point
 tab1, tab2 = st.tabs(['Home', 'Agent'])
+usage_panel = st.sidebar.empty()
+show_session_usage()
 
 if 'tab1_completed' not in st.session_state:
     st.session_state.tab1_completed = False
@@ -213,92 +279,90 @@ with tab1:
 
 # File uploader
     uploaded_file = st.file_uploader("Upload Business Process Document (BPD)", type=["pdf", "txt", "png", "jpg"])
+    # Identical documents give identical greedy generations, so responses are cached unless bypassed
+    bypass_cache = st.toggle("Bypass response cache", value=False)
+    # Render flow-diagram steps as the model produces them instead of after the full generation
+    stream_analysis = st.toggle("Stream analysis", value=True)
 
     if uploaded_file is not None:
+        # One trace per document run: extraction, Granite calls and parsing become its spans
+        document_span = tracing.start_span('document', root=True, file=uploaded_file.name)
+        # Tokens used by this document's model calls; cached responses cost nothing
+        document_usage = usage.TokenUsage()
+
         # Display the file based on its type
         if uploaded_file.type == "application/pdf":
             st.write("Displaying PDF:")
             st.download_button("Download PDF", uploaded_file, file_name=uploaded_file.name)
-            text = extract_text_from_pdf(uploaded_file)  # Extract text from the uploaded PDF
+            with tracing.use_span(document_span), usage.track(document_usage):
+                text = extract_text_from_pdf(uploaded_file)  # Extract text from the uploaded PDF
             st.success('Text received successfully!')  # Display success message for text received
 
+        elif uploaded_file.type in ("image/png", "image/jpeg"):
+            # Scanned documents: OCRed into the same pipeline as PDFs
+            st.image(uploaded_file)
+            with tracing.use_span(document_span), usage.track(document_usage):
+                text = extract_text_from_pdf(uploaded_file)
+            if text:
+                st.success('Text received successfully!')
+            else:
+                st.warning("No text could be recognised in the image.")
+
         else:
+            text = ''
             st.warning("Unsupported file type.")
 
         if text:
-            url = 'https://us-south.ml.cloud.ibm.com/ml/v1/text/generation?version=2023-05-29'
-
-            body = {
-                'input': f"""You are an expert business workflow analyzer. Your role is to analyze a business'\''s context, analyze each step in its current workflow critically and score each step. Your tasks are as follows:
-
-                    Use only the provided context: {text}
-
-                    1. **Extract the Company Context:**  
-                    - Retrieve key details from the company introduction (name, size, industry, location). Do not output any response yet.
-
-                    2. **Process Each Workflow Step:**  
-                    - For each of the 10 workflow steps, extract the detailed information including the business tools in use and any quantitative metrics provided.
-                    - Summarize each step into a concise 10 to 15 word sentence that captures the essence of the step.Do not output any response yet.
-
-                    3. **Score Workflow Efficiency:**  
-                    - Evaluate and assign an efficiency score for each workflow step. Use scoring metrics similar to those employed in IBM business assessments (for example, consider factors like throughput, error rate, cycle time, and automation effectiveness).
-                    - The score should be a numerical value from 1 (poor efficiency) to 10 (excellent efficiency). Be as critical as possible, do not just award > 6 without justification since there is always room for improvement in the current step! Do not output any response yet.
-
-                    4. **Output Format:** - Here is the output format:
-                    - Only produce the final output in a JSON array only, not a dictionary named 'workflow_steps' or anything like 'JSON Output:' or [JSON_OUTPUT]! Verify that none of that is mentioned. No other descriptions are required. 
-                    - Each JSON object should have the following keys:
-                        - \"step_summary\": the 10 to 15 word summary of the step.
-                        - \"efficiency_score\": the numerical score assigned.
-                        - \"explanation\": a description of the main factor(s) leading to workflow inefficiency, with associated metrics, in this step.
-                    - Ensure the JSON is clean and fully parsable.
-
-                    Please process the test_data accordingly and output the results in the required JSON format.
-
-                    Think through this step by step. Verify each step. Do not ever hallucinate.
-                    """, 
-                'Output': '',
-                'parameters': {
-                    'decoding_method': 'greedy',
-                    'max_new_tokens': 2000,
-                    'min_new_tokens': 0,
-                    'repetition_penalty': 1
-                },
-                "model_id": "ibm/granite-3-8b-instruct",
-                "project_id": "f284f75e-ea6b-4395-a973-1b7b02b2c176"
-            }
-            
-            # move the bearer token to .env or add mltoken from above: Check access rights
-            headers = {
-            "Accept": "application/json",
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {access_token}"
-            }
-
+            # Ready by the time the chat or the S3 agents query it
+            vector_index.prefetch(text)
             st.write("Making API request...")
-            response = requests.post(url, headers=headers, json=body)
-
-            if response.status_code == 200:
-                st.success('Response received successfully!')  # Display success message for response
-                response_data = response.json()  # Get the JSON data from the response
+            streamed = stream_analysis and not analysis.needs_sections(text)
+            try:
+                with tracing.use_span(document_span), usage.track(document_usage):
+                    if streamed:
+                        st.write("Generated Visualizations")
+                        response_data, cache_hit = stream_flow_diagram(text, bypass_cache=bypass_cache)
+                    else:
+                        # Large documents are analyzed section by section and merged into one step list
+                        response_data, cache_hit = analysis.analyze(text, bypass_cache=bypass_cache)
+            except (granite.GenerationError, iam.TokenError) as e:
+                response_data = None
+                document_span.end(e)
+                st.error(f'Error: {e}')
+            document_span.end()
+            show_timings([document_span.trace_id])
+            show_usage('Tokens for this document', document_usage)
+            logger.info("Document %s used %s", uploaded_file.name, document_usage)
+
+            if response_data is not None:
+                st.success('Response received from cache!' if cache_hit else 'Response received successfully!')
                 
                                 
                 # set_response(response_data) # for use in utils.py
 
-                st.write("Generated Visualizations")
-                extract_from_granite(response_data)  # Parse JSON to create flowchart
+                if not streamed:
+                    st.write("Generated Visualizations")
+                    extract_from_granite(response_data)  # Parse JSON to create flowchart
                 # generate_vizualizations(response_data)  
 
                 # Make sidepanel available?
                 st.title("WorkWiseAI chat interface")
-                st.session_state.clear()
 
                 # Clear session state on initial load
                 if 'page_refreshed' not in st.session_state:
                     st.session_state.clear()  # Clears session on initial load
                     st.session_state.page_refreshed = True
 
-                if "messages" not in st.session_state:
-                    st.session_state.messages = []  # Initialize chat history
+                # Start a new chat when a different document is analyzed. Clearing the whole session
+                # on every rerun would also drop the chat history and background job IDs.
+                document_id = cache.content_hash(text)
+                if st.session_state.get('chat_document') != document_id:
+                    st.session_state.chat_history = chat_history.ChatHistory()
+                    st.session_state.chat_document = document_id
+
+                if "chat_history" not in st.session_state:
+                    st.session_state.chat_history = chat_history.ChatHistory()  # Initialize chat history
+                history = st.session_state.chat_history
 
                 # Turn-taking logic
                 if 'waiting_for_user' not in st.session_state:
@@ -307,16 +371,10 @@ with tab1:
                 # Ensure we have a session key for user_input?
 
                 # Display all messages in the history
-                for message in st.session_state.messages:
+                for message in history.messages:
                     with st.chat_message(message["role"]):
                         st.markdown(message['content'])
 
-                API_KEY = os.getenv('IBM_API_KEY')
-                headers = {
-                    'Authorization': f'Bearer + {mltoken}',
-                    'Content-Type': 'application/json',
-                }
-
                 input = st.text_area("Ask WorkWiseAI ...", height = 150)
                 # Add button to control the chat flow
                 send_button = st.button('send')
@@ -326,32 +384,42 @@ with tab1:
                 if send_button:
                     print('user message received')
                     st.chat_message("user").markdown(input)
-                    st.session_state.messages.append({"role": "user", "content": f'{input}'})
+                    history.append("user", f'{input}')
                     st.session_state.user_input = "" # Clear input after sending, preparing for follow-up
 
                     if not st.session_state.waiting_for_user:
                         st.session_state.waiting_for_user = True
 
-                        with st.spinner("Thinking..."):
-                            payload_scoring = {
-                                "messages": st.session_state.messages
-                            }
-
-                            response_scoring = requests.post(
-                                'https://us-south.ml.cloud.ibm.com/ml/v4/deployments/528030d4-dac7-48b5-b39f-3776f6bb4ecc/ai_service?version=2021-05-01',
-                                json=payload_scoring,
-                                headers={'Authorization': 'Bearer ' + mltoken}
-                            )
-
+                        with st.chat_message("assistant"):
                             try:
-                                final_data = response_scoring.json()
-
-                                assistant_reply = final_data['choices'][0]['message']['content']
+                                # A question asked before about this document, in any wording, is
+                                # answered from the shared cache. Only a chat's first question: the
+                                # cache is keyed by document and question, and follow-ups depend on
+                                # the earlier turns too.
+                                cached_reply, question_vector = (
+                                    semantic_cache.answers.lookup(document_id, input)
+                                    if history.first_question else (None, None)
+                                )
+                                if cached_reply is not None:
+                                    assistant_reply = cached_reply
+                                    st.markdown(assistant_reply)
+                                    st.caption('Answered from cache')
+                                else:
+                                    # Recent turns plus a rolling summary of older ones, not the whole chat
+                                    with st.spinner("Thinking..."):
+                                        messages = history.payload()
+                                        # Grounded in the passages that answer the question, not the whole BPD
+                                        passages = vector_index.retrieve(text, input)
+                                        if passages:
+                                            messages = messages[:-1] + [vector_index.passages_message(passages)] + messages[-1:]
+                                    assistant_reply = st.write_stream(stream_reply(messages))
+                                    semantic_cache.answers.store(document_id, input, assistant_reply, question_vector)
                             except Exception as e:
                                 assistant_reply = f"Error: {str(e)}"
+                                st.markdown(assistant_reply)
                             finally:
-                                st.chat_message("assistant").markdown(assistant_reply)
-                                st.session_state.messages.append({"role": "assistant", "content": assistant_reply})
+                                history.append("assistant", assistant_reply)
+                        show_session_usage()
 
                         # Unlock for next message and clear input so it won't resend
                         st.session_state.waiting_for_user = False
@@ -359,223 +427,72 @@ with tab1:
                     follow_up = st.button('follow-up')
                     if follow_up:
                         st.rerun()
-            else:
-                st.error(f'Error: {response.status_code} - {response.text}') 
-            
-     # Display error message if response is not 200
-            st.session_state.tab1_completed = True
+
+            # Tab 2 only runs on a successful analysis
+            st.session_state.tab1_completed = response_data is not None
             st.session_state.required_response = response_data
+            st.session_state.document_text = text
+            session_usage().merge(document_usage)
+            show_session_usage()
     # load context for tab 2
     # parsed_context = response_data
 
 with tab2:
     st.image("./images/workflow.png", caption='Architecture Overview')
     st.write('Upload Business Process Document in the Home tab to get started with S3 Agent Analysis')
-    if st.session_state.tab1_completed:
+    if st.session_state.tab1_completed and st.session_state.required_response is not None:
         # Waits for tab 1 session to complete before accessing global variables.
         # prevents on_load errors
 
         required_data = st.session_state.required_response    
         
-        with st.spinner('Hang on tight for a response from the WorkWise S3 Agent.'):
-            IBM_API_KEY = os.getenv('IBM_API_KEY')
-            url = "https://iam.cloud.ibm.com/identity/token"
-
-            headers = {
-                "Content-Type": "application/x-www-form-urlencoded"
-            }
-
-            data = {
-                "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
-                "apikey": IBM_API_KEY
-            }
-
-            response = requests.post(url, headers=headers, data=data)
-            watsonx_token = response.json().get("access_token")
-            if watsonx_token: print("token created successfully")
-
-            params = {
-            "space_id": "825b15ec-b09f-413c-80ed-4e7fd3fc0bb0"
-            }
-
-            def gen_ai_service(context, params=params, **custom):
-                from langchain_ibm import ChatWatsonx
-                from ibm_watsonx_ai import APIClient
-                from langchain_core.messages import AIMessage, HumanMessage
-                from langchain_community.tools import WikipediaQueryRun, DuckDuckGoSearchRun
-                from langchain_community.utilities import WikipediaAPIWrapper
-                from langgraph.checkpoint.memory import MemorySaver
-                from langgraph.prebuilt import create_react_agent
-
-                model = "meta-llama/llama-3-3-70b-instruct"
-                service_url = "https://us-south.ml.cloud.ibm.com"
-
-                credentials = {
-                    "url": service_url,
-                    "token": context.generate_token()
-                }
-
-                client = APIClient(credentials)
-                space_id = params.get("space_id")
-                client.set.default_space(space_id)
-
-                def create_chat_model(watsonx_client):
-                    parameters = {
-                        "frequency_penalty": 0,
-                        "max_tokens": 7500,
-                        "presence_penalty": 0,
-                        "temperature": 0,
-                        "top_p": 1
-                    }
-                    return ChatWatsonx(
-                        model_id=model,
-                        url=service_url,
-                        space_id=space_id,
-                        params=parameters,
-                        watsonx_client=watsonx_client,
-                    )
-
-                def create_tools():
-                    from langchain_community.utilities import WikipediaAPIWrapper
-                    tools = []
-                    tools.append(WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper(top_k_results=2)))
-                    tools.append(DuckDuckGoSearchRun(name='business_metrics_search'))
-                    return tools
-
-                def create_agent(model, tools, role_instructions):
-                    memory = MemorySaver()
-                    return create_react_agent(model, tools=tools, checkpointer=memory, state_modifier=role_instructions)
-
-                def convert_messages(messages):
-                    return [
-                        HumanMessage(content=msg["content"]) if msg["role"] == "user" 
-                        else AIMessage(content=msg["content"])
-                        for msg in messages
-                    ]
-
-                def generate(context):
-                    # Get workflow response from the analyzer instance
-
-                    payload = context.get_json()
-                    messages = convert_messages(payload.get("messages", []))
-                    
-                    model_instance = create_chat_model(client)
-                    tools = create_tools()
-                    
-                    # Initialize agent workers
-                    summarizer = create_agent(model_instance, create_tools(), f"""From the context provided: {required_data}
-                    - Identify, Analyze and number each business workflow step. Never combine steps.
-                    - Highlight inefficiency factors.
-                    - Summarize each business workflow step in 10-15 words.
-                    - Output format:
-                        {{
-                            "steps": [
-                                {{
-                                    "step_number": 1,
-                                    "summary": "10-15 word description",
-                                    "inefficiencies": ["list"]
-                                }}
-                            ]
-                        }}
-                    """)
-                    
-                    scorer = create_agent(model_instance, [DuckDuckGoSearchRun()], 'Score EACH business workflow step separately from 1 to 10, where 10 indicates highest efficiency, using named industry metrics. Be as critical as possible, do not just score highly without justification. Mention the metric used.')
-
-                    suggester = create_agent(model_instance, tools, """ Your role is to suggest improvements for each step. Do not use any tools in this step, your output should be JSON only.
-                            
-                    """)
-
-                    # Chaining the agents together through carried context
-                    try:
-                        summary_result = summarizer.invoke(
-                            {'messages': messages},
-                            {'configurable':{'thread_id': 42 }, 'recursion_limit': 300 }
-                        )
-
-                        scored_result = scorer.invoke(
-                            {'messages': summary_result['messages']},
-                            {'configurable':{'thread_id': 42 }, 'recursion_limit': 300 }
-                        )
-
-                        suggestions = suggester.invoke(
-                            {
-                                'messages': [
-                                    *summary_result['messages'],
-                                    *scored_result['messages'],
-                                    {
-                                        "role": "user",
-                                        "content": """REMINDER: Final output must be JSON array with: step_summary, efficiency_score, improvements and expected_impact for EACH business workflow step.
-                                            - The JSON object output must have the following keys. DO THIS FOR EACH OF THE BUSINESS WORKFLOW STEPS, YOU MUST INCLUDE ALL STEPS AND THEIR KEYS IN THE OUTPUT!!!:
-                                                - "step_summary": the brief 10 to 15 word summary of each business workflow step with the step number in chronological order.
-                                                - "explanation": an insightful 30 word description of specific steps to improve workflow efficiency. Include specific tools/methodologies that could be used for instance. Include which affected metrics would improve, and by what extent for each business workflow step.  
-                                                - "efficiency_score": an updated numerical score as an estimate out of 10 that estimates the workflow efficiency after possible implementation of specific steps/tools/methodologies to improve workflow efficiency in this step. 
-                                        """
-                                    }
-                                ]
-                            }, 
-                            {'configurable':{'thread_id': 42 }, 'recursion_limit': 300, 'timeout': 1200 }
-                        )
-
-                        try:
-                            output_data = json.loads(suggestions["messages"][-1].content)
-                            if not isinstance(output_data, list):
-                                output_data = [output_data]
-                        except:
-                            output_data = []
-
-                        return {
-                            "headers": {"Content-Type": "application/json"},
-                            "body": {
-                                "choices": [{
-                                    "message": {
-                                        "role": "assistant",
-                                        "content": json.dumps(output_data)
-                                    }
-                                }]
-                            }
-                        }
-                    except Exception as e:
-                        print(f"Error in generate function: {str(e)}")
-                        return {
-                            "headers": {"Content-Type": "application/json"},
-                            "body": {
-                                "choices": [{
-                                    "message": {
-                                        "role": "assistant",
-                                        "content": json.dumps([{"error": str(e)}])
-                                    }
-                                }]
-                            }
-                        }
-
-                return generate, None
-
-            class RealContext:
-                def __init__(self, messages):
-                    self._messages = messages
-                    self._token = watsonx_token
-                    if not self._token:
-                        raise Exception("WATSONX_TOKEN environment variable not set.")
-
-                def generate_token(self):
-                    return self._token
-
-                def get_token(self):
-                    return self.generate_token()
-
-                def get_json(self):
-                    return {"messages": self._messages}
-
-
-            messages = [
-                {"role": "system", "content": "You are an expert multi-agent framework that analyzes of a business workflow. Maintain JSON format throughout the output of the analysis chain and present in a clean, parsable format."},
-                {"role": "user", "content": "Begin the business workflow analysis chain."}
-            ]
-
-            context = RealContext(messages)
-            generate, _ = gen_ai_service(context)
-            agent_response = generate(context)             # this will be used to populate the AI
+        # The S3 chain (summarizer, then per-step fan-out of the scorer and suggester) runs as a
+        # background job, so the rest of the app stays responsive. The job ID follows the document:
+        # reruns and reconnects pick up the same job, and an interrupted run resumes after its last
+        # completed stage. Bypassing the cache starts one fresh job per document and session.
+        job_id = cache.content_hash(json.dumps(required_data, sort_keys=True))
+        if bypass_cache:
+            job_id = st.session_state.setdefault(f's3_job_{job_id}', cache.content_hash(job_id, str(time.time())))
+        job_args = (job_id, utils.analyze_workflow, required_data)
+        job_kwargs = {'run_id': job_id, 'document': st.session_state.get('document_text')}
+        job = jobs.get_manager().submit(*job_args, **job_kwargs)
+
+        if not job.done:
+            @st.fragment(run_every=2)
+            def show_job_progress():
+                job = jobs.get_manager().get(job_id)
+                if job.done:
+                    st.rerun()
+                with st.spinner('Hang on tight for a response from the WorkWise S3 Agent.'):
+                    st.write(f"S3 analysis {job.status}. Completed stages: {len(job.partial)}")
+                    for stage in job.partial:
+                        st.caption(f"✓ {stage['stage']}")
+                show_timings([job.trace_id])
+
+            show_job_progress()
+            st.stop()
+
+        if job.status == jobs.FAILED:
+            st.error(f'S3 analysis failed: {job.error}')
+            if st.button('Retry S3 analysis'):
+                jobs.get_manager().resubmit(*job_args, **job_kwargs)
+                st.rerun()
+            st.stop()
+
+        with st.container():
+            agent_response = job.result             # this will be used to populate the AI
             print(json.dumps(agent_response, indent=2))
+            show_timings([job.trace_id])
+
+            # Added to the session totals once per job, however often the tab is rerun
+            job_usage = agent_response.get('body', {}).get('usage')
+            if job_usage:
+                show_usage('Tokens for the S3 analysis', usage.TokenUsage.from_dict(job_usage))
+                counted_jobs = st.session_state.setdefault('usage_counted_jobs', set())
+                if job_id not in counted_jobs:
+                    counted_jobs.add(job_id)
+                    session_usage().merge(job_usage)
+                    show_session_usage()
 
         # Function to parse JSON response
             def parse_responses(raw_response):
@@ -604,12 +521,8 @@ with tab2:
                 # Access the results
                 analyzed_results = response_data['results'][0]['generated_text']
                 
-                # Extract the JSON output from the generated text
-                json_output = analyzed_results.replace("[JSON Output]", "").strip()  # Remove the [JSON Output] marker
-                json_output = json_output[json_output.find("["):].strip()  # Find the actual array start
-                
-                # Load the JSON output
-                analyzed_steps = json.loads(json_output)  # Parse the JSON
+                # Recover every complete step object, repairing malformed or truncated output
+                analyzed_steps = parsing.parse_steps(analyzed_results, parsing.STEP_KEYS)
                 
                 # Print each step's details to the terminal
                 for step in analyzed_steps:
@@ -619,7 +532,7 @@ with tab2:
                     # with st.expander(f"{step['step_summary']} (Score: {step['efficiency_score']})"):
                     #     st.markdown(f"**Explanation:** {step['explanation']}")
 
-            except json.JSONDecodeError as e:
+            except parsing.ParseError as e:
                 st.error(f"Failed to decode JSON: {str(e)}")
             except IndexError as e:
                 st.error(f"Index error: {str(e)} - Check the structure of the response data.")
@@ -690,6 +603,9 @@ with tab2:
             agent_scores = [step['efficiency_score'] for step in parsed_responses[0]['steps']]
             legacy_scores = [step['efficiency_score'] for step in analyzed_steps] if analyzed_steps else [0] * len(agent_scores)
 
+            import altair as alt
+            import pandas as pd
+
             # Create a DataFrame for the chart
             data = pd.DataFrame({
                 'Step': steps,
@@ -0,0 +1,359 @@
+# mock_watsonx.py
+# Local stand-in for the IBM Cloud endpoints the app calls: IAM tokens, text/generation and
+# text/chat (used by ChatWatsonx), plain and streamed, and ai_service deployments. Recorded
+# responses from fixtures/watsonx_responses.json are replayed after a configurable latency, at a
+# configurable token rate, so the pipeline can be run and timed without credentials.
+#
+#   python mock_watsonx.py --port 8765 --latency 0.2 --tokens-per-second 40
+#   WATSONX_URL=http://127.0.0.1:8765 IBM_IAM_URL=http://127.0.0.1:8765/identity/token streamlit run main.py
+#
+# ibm_watsonx_ai (behind ChatWatsonx and the S3 agents) only accepts https URLs, so --tls serves
+# with a throwaway self-signed certificate and prints the CA settings the clients need to trust it.
+import argparse
+import collections
+import json
+import os
+import re
+import ssl
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'watsonx_responses.json')
+
+# Characters per streamed chunk, roughly one token
+CHUNK_CHARS = 4
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // CHUNK_CHARS)
+
+
+class MockWatsonx:
+    # Serves on a background thread; use as a context manager or call start() and stop()
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, tokens_per_second=0.0, fixtures_path=FIXTURES_PATH,
+                 tls=False):
+        with open(fixtures_path) as f:
+            self.fixtures = json.load(f)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.requests = collections.Counter()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+        self.certificate = None
+        if tls:
+            self._certificate_dir = tempfile.TemporaryDirectory()
+            self.certificate, key = _self_signed_certificate(host, self._certificate_dir.name)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(self.certificate, key)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"{'https' if self.certificate else 'http'}://{host}:{port}"
+
+    def serve_forever(self):
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-watsonx', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def environ(self):
+        # Environment that points the app's clients at this server
+        environ = {
+            'WATSONX_URL': self.url,
+            'IBM_IAM_URL': f'{self.url}/identity/token',
+        }
+        if self.certificate:
+            environ.update({
+                'WATSONX_PLATFORM_URL': self.url,
+                'REQUESTS_CA_BUNDLE': self.certificate,
+                'WX_CLIENT_VERIFY_REQUESTS': self.certificate,
+                'SSL_CERT_FILE': self.certificate,
+            })
+        return environ
+
+    def count(self, route):
+        with self._lock:
+            self.requests[route] += 1
+
+    def generation_time(self, text):
+        return estimate_tokens(text) / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def chat_reply(self, messages):
+        # First fixture whose match string appears in the system prompt; '' matches anything
+        system = ' '.join(
+            str(message.get('content', '')) for message in messages
+            if isinstance(message, dict) and message.get('role') == 'system'
+        )
+        for fixture in self.fixtures['chat']:
+            if fixture['match'] in system:
+                return fixture['content']
+        return ''
+
+
+def _self_signed_certificate(host, directory):
+    # Returns (certificate path, key path) for a one-day certificate valid for host
+    import datetime
+    import ipaddress
+
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, host)])
+    try:
+        alternative = x509.IPAddress(ipaddress.ip_address(host))
+    except ValueError:
+        alternative = x509.DNSName(host)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([alternative]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    certificate_path = os.path.join(directory, 'mock_watsonx.pem')
+    key_path = os.path.join(directory, 'mock_watsonx.key')
+    with open(certificate_path, 'wb') as f:
+        f.write(certificate.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, 'wb') as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption(),
+        ))
+    return certificate_path, key_path
+
+
+def _handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _body(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+            try:
+                return json.loads(raw or b'{}')
+            except ValueError:
+                return {}
+
+        def _send_json(self, payload, status=200):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            path = self.path.split('?', 1)[0]
+            body = self._body()
+            time.sleep(mock.latency)
+            if path == '/identity/token':
+                mock.count('iam')
+                now = int(time.time())
+                self._send_json({
+                    'access_token': f'mock-{uuid.uuid4().hex}',
+                    'refresh_token': 'not_supported',
+                    'token_type': 'Bearer',
+                    'expires_in': 3600,
+                    'expiration': now + 3600,
+                    'scope': 'ibm openid',
+                })
+            elif path == '/ml/v1/text/generation':
+                mock.count('generation')
+                self._generation(body)
+            elif path == '/ml/v1/text/generation_stream':
+                mock.count('generation_stream')
+                self._generation_stream(body)
+            elif path == '/ml/v1/text/chat':
+                mock.count('chat')
+                self._chat(body)
+            elif path == '/ml/v1/text/chat_stream':
+                mock.count('chat_stream')
+                self._chat_stream(body)
+            elif re.fullmatch(r'/ml/v4/deployments/[^/]+/ai_service', path):
+                mock.count('ai_service')
+                content = mock.chat_reply(body.get('messages', []))
+                time.sleep(mock.generation_time(content))
+                self._send_json({'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}}]})
+            elif re.fullmatch(r'/ml/v4/deployments/[^/]+/ai_service_stream', path):
+                mock.count('ai_service_stream')
+                content = mock.chat_reply(body.get('messages', []))
+                self._send_events(
+                    {'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': chunk}}]}
+                    for chunk in _chunks(content)
+                )
+            else:
+                mock.count('other')
+                self._send_json({'errors': [{'code': 'not_found', 'message': f'No mock for POST {path}'}]}, 404)
+
+        def do_GET(self):
+            # Client libraries look up spaces, projects and deployments; any resource "exists"
+            path = self.path.split('?', 1)[0]
+            mock.count('get')
+            if path.endswith('/foundation_model_specs'):
+                self._send_json({
+                    'total_count': len(mock.fixtures['models']),
+                    'resources': [{'model_id': model_id, 'functions': [{'id': 'text_generation'}, {'id': 'text_chat'}]}
+                                  for model_id in mock.fixtures['models']],
+                })
+                return
+            resource_id = path.rstrip('/').rsplit('/', 1)[-1]
+            self._send_json({
+                'metadata': {'id': resource_id, 'guid': resource_id},
+                'entity': {'status': {'state': 'active'}},
+                'resources': [],
+            })
+
+        def _result(self, body, text):
+            fixture = mock.fixtures['generation']
+            return {
+                'generated_text': text,
+                'generated_token_count': estimate_tokens(text),
+                'input_token_count': fixture.get('input_token_count', estimate_tokens(body.get('input', ''))),
+                'stop_reason': fixture.get('stop_reason', 'eos_token'),
+            }
+
+        def _generation(self, body):
+            text = mock.fixtures['generation']['generated_text']
+            time.sleep(mock.generation_time(text))
+            self._send_json({
+                'model_id': body.get('model_id'),
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime()),
+                'results': [self._result(body, text)],
+            })
+
+        def _send_events(self, payloads):
+            # Server-sent events at the configured token rate, one payload per chunk
+            delay = 1 / mock.tokens_per_second if mock.tokens_per_second else 0.0
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            self.close_connection = True
+            try:
+                for index, payload in enumerate(payloads, start=1):
+                    time.sleep(delay)
+                    self.wfile.write(f'id: {index}\nevent: message\ndata: {json.dumps(payload)}\n\n'.encode())
+                    self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError, ssl.SSLError):
+                # The client stopped reading, e.g. after the first chunk
+                pass
+
+        def _generation_stream(self, body):
+            chunks = _chunks(mock.fixtures['generation']['generated_text'])
+
+            def payloads():
+                for index, chunk in enumerate(chunks, start=1):
+                    result = self._result(body, chunk)
+                    result['generated_token_count'] = index
+                    if index < len(chunks):
+                        result['stop_reason'] = 'not_finished'
+                    yield {'model_id': body.get('model_id'), 'results': [result]}
+
+            self._send_events(payloads())
+
+        def _chat(self, body):
+            messages = body.get('messages', [])
+            content = mock.chat_reply(messages)
+            time.sleep(mock.generation_time(content))
+            prompt_tokens = sum(estimate_tokens(json.dumps(message)) for message in messages)
+            completion_tokens = estimate_tokens(content)
+            self._send_json({
+                'id': f'chat-{uuid.uuid4().hex}',
+                'model_id': body.get('model_id'),
+                'created': int(time.time()),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                'usage': {
+                    'prompt_tokens': prompt_tokens,
+                    'completion_tokens': completion_tokens,
+                    'total_tokens': prompt_tokens + completion_tokens,
+                },
+            })
+
+        def _chat_stream(self, body):
+            messages = body.get('messages', [])
+            content = mock.chat_reply(messages)
+            chunks = _chunks(content)
+            chat_id = f'chat-{uuid.uuid4().hex}'
+            prompt_tokens = sum(estimate_tokens(json.dumps(message)) for message in messages)
+
+            def payloads():
+                for index, chunk in enumerate(chunks, start=1):
+                    payload = {
+                        'id': chat_id,
+                        'model_id': body.get('model_id'),
+                        'choices': [{'index': 0, 'delta': {'role': 'assistant', 'content': chunk},
+                                     'finish_reason': 'stop' if index == len(chunks) else None}],
+                    }
+                    if index == len(chunks):
+                        payload['usage'] = {
+                            'prompt_tokens': prompt_tokens,
+                            'completion_tokens': index,
+                            'total_tokens': prompt_tokens + index,
+                        }
+                    yield payload
+
+            self._send_events(payloads())
+
+    return Handler
+
+
+def _chunks(text):
+    return [text[i:i + CHUNK_CHARS] for i in range(0, len(text), CHUNK_CHARS)] or ['']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve recorded watsonx and IAM responses locally.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each response starts')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0, help='generation rate (0 = instant)')
+    parser.add_argument('--fixtures', default=FIXTURES_PATH, help='recorded responses to replay')
+    parser.add_argument('--tls', action='store_true', help='serve https with a self-signed certificate')
+    args = parser.parse_args(argv)
+
+    mock = MockWatsonx(args.host, args.port, args.latency, args.tokens_per_second, args.fixtures, args.tls)
+    for key, value in mock.environ().items():
+        print(f'{key}={value}')
+    try:
+        mock.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# ocr.py
+# Text for pages that have no text layer: scanned PDFs and image uploads. Each page is rendered
+# with PyMuPDF and recognised by Tesseract through PyMuPDF's own OCR support, so there is no extra
+# Python dependency; Tesseract and its language data must be installed (set TESSDATA_PREFIX if
+# PyMuPDF does not find them). Results are cached on disk by the hash of the rendered page, so a
+# page is recognised once however many documents, uploads or workers it turns up in.
+# ocr_page runs in extraction's worker processes; see extraction._ocr_pages.
+import logging
+import os
+
+from cache import CACHE_DIR, DiskCache, content_hash
+
+logger = logging.getLogger(__name__)
+
+OCR_DPI = int(os.getenv('OCR_DPI', 300))
+OCR_LANGUAGE = os.getenv('OCR_LANGUAGE', 'eng')
+# Bump when recognition changes so cached page text is not reused
+OCR_VERSION = "1"
+
+# Recognised text keyed by page_key
+page_cache = DiskCache(os.path.join(CACHE_DIR, 'ocr'))
+
+# Pages that could not be recognised in this process, see extraction.cached_extract_text
+failures = 0
+_warned = False
+
+
+class OCRUnavailable(Exception):
+    pass
+
+
+def needs_ocr(page, text):
+    # A page with images but no extractable text is a scan; blank pages are left alone
+    return not text.strip() and bool(page.get_images())
+
+
+def render(page, dpi=OCR_DPI):
+    import fitz  # PyMuPDF
+
+    return page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+
+
+def page_key(pixmap):
+    return content_hash(OCR_VERSION, OCR_LANGUAGE, f'{pixmap.width}x{pixmap.height}', pixmap.samples)
+
+
+def recognise(pixmap):
+    # Tesseract adds an invisible text layer to a one-page PDF of the image, which is then read
+    # back like any other PDF
+    import fitz  # PyMuPDF
+
+    try:
+        data = pixmap.pdfocr_tobytes(language=OCR_LANGUAGE)
+    except Exception as e:
+        raise OCRUnavailable(f'Tesseract ({OCR_LANGUAGE}): {e}') from e
+    with fitz.open(stream=data, filetype='pdf') as doc:
+        return doc[0].get_text('text')
+
+
+def ocr_page(source, number):
+    # source is either a path (worker processes) or the raw PDF bytes (in-process).
+    # Raises OCRUnavailable when Tesseract is missing.
+    import fitz  # PyMuPDF
+
+    if isinstance(source, bytes):
+        doc = fitz.open(stream=source, filetype='pdf')
+    else:
+        doc = fitz.open(source)
+    with doc:
+        pixmap = render(doc[number])
+    key = page_key(pixmap)
+    text = page_cache.get(key)
+    if text is None:
+        text = recognise(pixmap)
+        page_cache.set(key, text)
+    return text
+
+
+def unavailable(error):
+    # Counts a page left without text; warns once per process
+    global failures, _warned
+    failures += 1
+    if not _warned:
+        _warned = True
+        logger.warning("OCR unavailable, scanned pages will have no text: %s", error)
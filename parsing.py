@@ -0,0 +1,151 @@
+# parsing.py
+# Incremental, self-repairing parsing of workflow-step JSON in model output.
+# Model output is often almost-JSON: a stray marker, a trailing comma, a missing quote or a
+# generation cut off by max_new_tokens. Rather than discarding the whole (expensive) generation,
+# every complete step object is recovered on its own, and broken objects go through json_repair.
+import json
+
+import json_repair
+
+import tracing
+
+STEP_KEYS = ('step_summary', 'efficiency_score', 'explanation')
+
+
+class ParseError(ValueError):
+    pass
+
+
+def _repair(text):
+    # json_repair returns '' when nothing can be salvaged
+    try:
+        value = json.loads(text)
+    except ValueError:
+        value = json_repair.loads(text)
+    return value
+
+
+class StepStreamParser:
+    # Feed text chunks as they arrive; feed() returns every step object completed by the chunk
+    # and finish() returns the truncated trailing object, repaired, if there is one.
+    # A step is an object at the top level of the output or directly inside the top-level array.
+    # When required_keys is given, objects missing any of them are skipped.
+    def __init__(self, required_keys=None):
+        self.required_keys = tuple(required_keys or ())
+        self._stack = []
+        self._in_string = False
+        self._escaped = False
+        self._buffer = []
+        self._capturing = False
+
+    def feed(self, chunk):
+        steps = []
+        for char in chunk:
+            if self._capturing:
+                self._buffer.append(char)
+
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = self._capturing
+            elif char == '{':
+                if not self._capturing and self._stack in ([], ['[']):
+                    self._capturing = True
+                    self._buffer = [char]
+                self._stack.append(char)
+            elif char == '[':
+                self._stack.append(char)
+            elif char in '}]' and self._stack:
+                # Tolerate a mismatched closer by unwinding to the matching opener
+                opener = '{' if char == '}' else '['
+                while self._stack and self._stack.pop() != opener:
+                    pass
+                if char == '}' and self._capturing and self._stack in ([], ['[']):
+                    self._capturing = False
+                    step = self._decode(''.join(self._buffer))
+                    if step is not None:
+                        steps.append(step)
+                elif not self._stack and self._capturing:
+                    # The closer swallowed the object's opening brace; salvage what we have
+                    self._capturing = False
+                    step = self._decode(''.join(self._buffer))
+                    if step is not None:
+                        steps.append(step)
+        return steps
+
+    def finish(self):
+        steps = []
+        if self._capturing:
+            step = self._decode(''.join(self._buffer))
+            if step is not None:
+                steps.append(step)
+        self.__init__(self.required_keys)
+        return steps
+
+    def _decode(self, text):
+        try:
+            value = _repair(text)
+        except Exception:
+            return None
+        if not isinstance(value, dict) or not value:
+            return None
+        if any(key not in value for key in self.required_keys):
+            return None
+        return value
+
+
+def iter_steps(chunks, required_keys=None):
+    # Yields step objects from an iterable of text chunks as soon as each one is complete
+    parser = StepStreamParser(required_keys)
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.finish()
+
+
+def parse_steps(text, required_keys=None):
+    # Returns the list of step objects in text, recovering what it can from malformed or
+    # truncated output. Raises ParseError if nothing usable is found.
+    with tracing.span('parsing', characters=len(text)) as span:
+        steps, method = _parse_steps(text, required_keys)
+        span.set('steps', len(steps))
+        span.set('method', method)
+        return steps
+
+
+def _parse_steps(text, required_keys):
+    # Returns (steps, method), method being how they were recovered
+    cleaned = text.replace("[JSON Output]", "").strip()
+    start = cleaned.find("[")
+    if start != -1:
+        try:
+            value = json.loads(cleaned[start:])
+            if isinstance(value, list) and all(isinstance(item, dict) for item in value):
+                steps = [item for item in value if all(key in item for key in (required_keys or ()))]
+                if steps:
+                    return steps, 'json'
+        except ValueError:
+            pass
+
+    steps = list(iter_steps([cleaned], required_keys))
+    if steps:
+        return steps, 'per_object'
+
+    try:
+        value = json_repair.loads(cleaned)
+    except Exception as e:
+        raise ParseError(f"No JSON found in model output: {e}") from e
+    if isinstance(value, dict):
+        value = [value]
+    if isinstance(value, list):
+        steps = [item for item in value if isinstance(item, dict) and item
+                 and all(key in item for key in (required_keys or ()))]
+        if steps:
+            return steps, 'repaired'
+    raise ParseError("No workflow steps could be recovered from the model output.")
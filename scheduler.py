@@ -0,0 +1,194 @@
+# scheduler.py
+# Process-wide admission control for model calls: Granite generation, ai_service chat and the S3
+# agents' ChatWatsonx calls. Every Streamlit session, background job and batch worker shares it.
+# - Token buckets cap requests per second and tokens per minute. A call is charged its estimated
+#   tokens (prompt plus output budget) up front and corrected with the usage watsonx reports.
+# - Waiting calls are admitted strictly by priority class, interactive chat and analysis first,
+#   then S3 jobs, then batch work, and in arrival order within a class.
+# - A 429 with Retry-After pauses admissions for every caller until that time has passed.
+# - Queue depth, wait times and throttling are exported with the Prometheus metrics.
+import contextlib
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+
+import tracing
+
+REQUESTS_PER_SECOND = float(os.getenv('MODEL_REQUESTS_PER_SECOND', 8))
+REQUEST_BURST = int(os.getenv('MODEL_REQUEST_BURST', 8))
+# 0 disables the token limit
+TOKENS_PER_MINUTE = float(os.getenv('MODEL_TOKENS_PER_MINUTE', 0))
+# Pause after a 429 that gives no Retry-After, e.g. one the watsonx client library gave up on
+RETRY_AFTER_DEFAULT = float(os.getenv('MODEL_RETRY_AFTER_DEFAULT', 5))
+
+# Priority classes, most urgent first
+INTERACTIVE = 0
+S3 = 1
+BATCH = 2
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', S3: 's3', BATCH: 'batch'}
+
+WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Span attribute for the time a call spent queued
+QUEUE_WAIT = 'queue_wait_seconds'
+
+_priority = contextvars.ContextVar('scheduler_priority', default=INTERACTIVE)
+
+
+def current_priority():
+    return _priority.get()
+
+
+@contextlib.contextmanager
+def priority(level):
+    # Calls made in this context (and in threads started with tracing.wrap) are queued at level.
+    # Nesting never makes work more urgent, so the S3 chain run by a batch stays batch work.
+    token = _priority.set(max(_priority.get(), level))
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def estimate_tokens(text):
+    # ~4 characters per token, as in compaction.estimate_tokens
+    return len(text) // 4 + 1
+
+
+class TokenBucket:
+    # rate units per second up to capacity; a rate of 0 means unlimited
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self):
+        return self.rate <= 0
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self, amount, now):
+        # Seconds until amount is available; more than capacity only ever waits for a full bucket
+        if self.unlimited:
+            return 0.0
+        self._refill(now)
+        return max(0.0, min(amount, self.capacity) - self.level) / self.rate
+
+    def take(self, amount, now):
+        if not self.unlimited:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+    def give(self, amount):
+        # Refunds an overestimate, or charges an underestimate when amount is negative
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + amount)
+
+
+class Scheduler:
+    def __init__(self, requests_per_second=REQUESTS_PER_SECOND, burst=REQUEST_BURST,
+                 tokens_per_minute=TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_second, max(1, burst))
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        # Metrics
+        self.queue_depth = {level: 0 for level in PRIORITY_NAMES}
+        self.waits = {level: ([0] * (len(WAIT_BUCKETS) + 1), 0.0) for level in PRIORITY_NAMES}
+        self.throttled = 0
+
+    def acquire(self, tokens=0, level=None):
+        # Blocks until the call may start; returns the seconds it waited
+        level = current_priority() if level is None else level
+        entry = (level, next(self._sequence))
+        started = time.monotonic()
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            self.queue_depth[level] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    timeout = None
+                    # Only the most urgent caller may take capacity; the rest wait behind it
+                    if self._waiting[0] == entry:
+                        timeout = max(self._paused_until - now, self.requests.delay(1, now),
+                                      self.tokens.delay(tokens, now))
+                        if timeout <= 0:
+                            self.requests.take(1, now)
+                            self.tokens.take(tokens, now)
+                            break
+                    self._condition.wait(timeout)
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self.queue_depth[level] -= 1
+                self._condition.notify_all()
+            waited = time.monotonic() - started
+            counts, total = self.waits[level]
+            for index, bound in enumerate(WAIT_BUCKETS):
+                if waited <= bound:
+                    counts[index] += 1
+            counts[-1] += 1
+            self.waits[level] = (counts, total + waited)
+        tracing.add_attribute(QUEUE_WAIT, round(waited, 3))
+        return waited
+
+    def correct(self, estimated, actual):
+        # Settles a call's token charge once its real usage is known
+        with self._condition:
+            self.tokens.give(estimated - actual)
+            self._condition.notify_all()
+
+    def pause(self, seconds):
+        # Holds every caller back, e.g. for a 429's Retry-After
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self.throttled += 1
+            self._condition.notify_all()
+
+    def metrics_lines(self):
+        lines = [
+            '# HELP workwise_scheduler_queue_depth Model calls waiting for admission.',
+            '# TYPE workwise_scheduler_queue_depth gauge',
+        ]
+        with self._condition:
+            for level, depth in sorted(self.queue_depth.items()):
+                lines.append(f'workwise_scheduler_queue_depth{{priority="{PRIORITY_NAMES[level]}"}} {depth}')
+            lines.append('# HELP workwise_scheduler_wait_seconds Time model calls spent queued.')
+            lines.append('# TYPE workwise_scheduler_wait_seconds histogram')
+            for level, (counts, total) in sorted(self.waits.items()):
+                label = f'priority="{PRIORITY_NAMES[level]}"'
+                for bound, count in zip(WAIT_BUCKETS, counts):
+                    lines.append(f'workwise_scheduler_wait_seconds_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'workwise_scheduler_wait_seconds_bucket{{{label},le="+Inf"}} {counts[-1]}')
+                lines.append(f'workwise_scheduler_wait_seconds_sum{{{label}}} {total}')
+                lines.append(f'workwise_scheduler_wait_seconds_count{{{label}}} {counts[-1]}')
+            lines.append('# HELP workwise_scheduler_throttled_total Admission pauses after rate-limit responses.')
+            lines.append('# TYPE workwise_scheduler_throttled_total counter')
+            lines.append(f'workwise_scheduler_throttled_total {self.throttled}')
+        return lines
+
+
+scheduler = Scheduler()
+tracing.add_collector(scheduler.metrics_lines)
+
+
+def acquire(tokens=0, level=None):
+    return scheduler.acquire(tokens, level)
+
+
+def correct(estimated, actual):
+    scheduler.correct(estimated, actual)
+
+
+def pause(seconds):
+    scheduler.pause(seconds)
@@ -0,0 +1,79 @@
+# semantic_cache.py
+# Answers to chat questions, reused for questions that mean the same thing. Each question is
+# embedded (embeddings.py) and compared with the questions already answered for the same
+# document; above the similarity threshold the stored answer is returned instead of another
+# ai_service round-trip. Entries are scoped by document hash and evicted least recently used.
+# Hits and misses are counted here for the app and recorded on spans for the Prometheus metrics.
+import os
+import threading
+from collections import OrderedDict
+
+import embeddings
+import tracing
+
+SIMILARITY_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.85))
+MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_SIZE', 512))
+
+
+class SemanticCache:
+    def __init__(self, threshold=SIMILARITY_THRESHOLD, maxsize=MAX_ENTRIES, embed=embeddings.embed):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self._embed = embed
+        # (document, question) -> (vector, answer), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, document, question):
+        # Returns (answer or None, question vector). The vector is None when embeddings are
+        # unavailable; the cache is then bypassed rather than failing the chat.
+        with tracing.span('semantic_cache') as span:
+            try:
+                vector = self._embed([question])[0]
+            except embeddings.EmbeddingUnavailable:
+                span.set('unavailable', True)
+                return None, None
+
+            best_key, best_score = None, -1.0
+            with self._lock:
+                for key, (stored, _) in self._entries.items():
+                    if key[0] == document:
+                        score = float(stored @ vector)
+                        if score > best_score:
+                            best_key, best_score = key, score
+                hit = best_key is not None and best_score >= self.threshold
+                if hit:
+                    self._entries.move_to_end(best_key)
+                    self.hits += 1
+                    answer = self._entries[best_key][1]
+                else:
+                    self.misses += 1
+                    answer = None
+            span.set(tracing.CACHE_HIT, hit)
+            if best_key is not None:
+                span.set('similarity', round(best_score, 3))
+            return answer, vector
+
+    def store(self, document, question, answer, vector):
+        # Empty answers (e.g. a stream that broke off) are not worth replaying
+        if vector is None or not answer or not answer.strip():
+            return
+        with self._lock:
+            self._entries[document, question] = (vector, answer)
+            self._entries.move_to_end((document, question))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# One cache per process, so every session analyzing the same document shares its answers
+answers = SemanticCache()
@@ -0,0 +1,75 @@
+import analysis
+
+INTRO = 'Acme Logistics is a 200-person freight forwarder based in Rotterdam. ' * 40
+
+
+def document(steps=6, step_chars=3000):
+    body = ''.join(f'Step {i}: ' + 'The team checks every shipment by hand. ' * (step_chars // 40) + '\n'
+                   for i in range(1, steps + 1))
+    return f'{INTRO}\n\n{body}'
+
+
+def words(text):
+    return text.split()
+
+
+def test_split_sections_covers_the_whole_document():
+    text = document()
+    preamble, sections = analysis.split_sections(text, max_chars=8000)
+    assert len(sections) > 1
+    assert words(' '.join(sections)) == words(text)
+    assert all(len(section) <= 8000 for section in sections)
+
+
+def test_split_sections_analyzes_the_preamble_and_repeats_only_its_start():
+    intro = INTRO * 10  # far longer than PREAMBLE_CHARS
+    text = f'{intro}\n\n' + ''.join(f'Step {i}: do things.\n' for i in range(1, 4))
+    preamble, sections = analysis.split_sections(text, max_chars=4000)
+    assert preamble == intro.strip()[:analysis.PREAMBLE_CHARS]
+    assert words(' '.join(sections)) == words(text)
+
+
+def test_split_sections_keeps_steps_whole():
+    text = 'Acme Logistics moves freight.\n' + ''.join(
+        f'Step {i}: ' + 'The team checks every shipment by hand. ' * 25 + '\n' for i in range(1, 7))
+    preamble, sections = analysis.split_sections(text, max_chars=2500)
+    assert sections[0].startswith('Acme Logistics moves freight. Step 1:')
+    for section in sections[1:]:
+        assert section.startswith('Step ')
+
+
+def test_split_sections_ignores_inline_step_references():
+    text = 'Acme Logistics moves freight. As described in step 3 below, invoices are checked twice.\n' \
+        'Step 1: receive.\nStep 2: check.\nStep 3: pay.\n'
+    preamble, sections = analysis.split_sections(text, max_chars=len(text))
+    assert preamble == 'Acme Logistics moves freight. As described in step 3 below, invoices are checked twice.'
+    assert words(' '.join(sections)) == words(text)
+
+
+def test_split_sections_without_headings_splits_on_paragraphs():
+    text = '\n\n'.join('Paragraph %d. ' % i + 'words ' * 200 for i in range(10))
+    preamble, sections = analysis.split_sections(text, max_chars=3000)
+    assert preamble == ''
+    assert len(sections) > 1
+    assert words(' '.join(sections)) == words(text)
+
+
+def test_merge_steps_keeps_section_order_and_drops_repeats_across_boundaries():
+    partials = [
+        [{'step_summary': 'Receive orders'}, {'step_summary': 'Check stock.'}],
+        [{'step_summary': 'check stock'}, {'step_summary': 'Ship orders'}],
+        [{'step_summary': 'Invoice customers'}],
+    ]
+    assert [step['step_summary'] for step in analysis.merge_steps(partials)] == \
+        ['Receive orders', 'Check stock.', 'Ship orders', 'Invoice customers']
+
+
+def test_merge_steps_keeps_repeats_that_are_not_adjacent():
+    partials = [[{'step_summary': 'Review'}, {'step_summary': 'Approve'}], [{'step_summary': 'Review'}]]
+    assert len(analysis.merge_steps(partials)) == 3
+
+
+def test_estimate_steps_counts_headings_then_numbered_items():
+    assert analysis.estimate_steps(document(steps=4, step_chars=100)) == 4
+    assert analysis.estimate_steps('1. Receive\n2. Check\n3. Pay\n') == 3
+    assert analysis.estimate_steps('No structure here, see step 2.') is None
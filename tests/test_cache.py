@@ -0,0 +1,65 @@
+import time
+
+from cache import DiskCache, LRUCache, TieredCache, content_hash
+
+
+def test_content_hash_is_stable_and_separates_parts():
+    assert content_hash(b'abc', 'v1') == content_hash(b'abc', 'v1')
+    assert content_hash('ab', 'c') != content_hash('a', 'bc')
+    assert content_hash(b'abc', 'v1') != content_hash(b'abc', 'v2')
+
+
+def test_lru_evicts_the_least_recently_used_entry():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # a is now the most recently used
+    cache.set('c', 3)
+    assert 'b' not in cache
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert len(cache) == 2
+
+
+def test_lru_expires_entries_after_the_ttl():
+    cache = LRUCache(maxsize=2, ttl=0.05)
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    time.sleep(0.06)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_lru_counts_hits_and_misses():
+    cache = LRUCache()
+    cache.set('a', 1)
+    cache.get('a')
+    cache.get('b')
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_disk_cache_round_trips_and_expires(tmp_path):
+    cache = DiskCache(str(tmp_path), ttl=0.05)
+    key = content_hash('document')
+    cache.set(key, {'text': 'hello'})
+    assert cache.get(key) == {'text': 'hello'}
+    time.sleep(0.06)
+    assert cache.get(key) is None
+    assert cache.get(content_hash('missing'), 'default') == 'default'
+
+
+def test_tiered_cache_promotes_disk_hits_into_memory(tmp_path):
+    key = content_hash('document')
+    DiskCache(str(tmp_path)).set(key, 'text')
+    cache = TieredCache(LRUCache(), DiskCache(str(tmp_path)))
+    assert cache.get(key) == 'text'
+    assert cache.memory.get(key) == 'text'
+
+
+def test_get_or_compute_computes_once(tmp_path):
+    cache = TieredCache(LRUCache(), DiskCache(str(tmp_path)))
+    calls = []
+    compute = lambda: calls.append(1) or 'value'
+    assert cache.get_or_compute('k' * 64, compute) == 'value'
+    assert cache.get_or_compute('k' * 64, compute) == 'value'
+    assert calls == [1]
@@ -0,0 +1,68 @@
+import compaction
+from chat_history import ChatHistory
+
+
+def recording_summarizer(calls):
+    def summarize(summary, messages):
+        calls.append([message['content'] for message in messages])
+        return (summary + ' ' if summary else '') + '+'.join(message['content'] for message in messages)
+    return summarize
+
+
+def conversation(history, turns, size=20):
+    for turn in range(turns):
+        history.append('user', f'q{turn} ' + 'x' * size)
+        history.append('assistant', f'a{turn} ' + 'y' * size)
+
+
+def test_first_question_lasts_until_the_assistant_answers():
+    history = ChatHistory()
+    history.append('user', 'which step is slowest?')
+    assert history.first_question
+    history.append('assistant', 'Step 2')
+    history.append('user', 'and the fastest?')
+    assert not history.first_question
+
+
+def test_short_conversations_are_sent_whole():
+    calls = []
+    history = ChatHistory(budget=1000, window=8, summarizer=recording_summarizer(calls))
+    conversation(history, 2)
+    assert history.payload() == history.messages
+    assert calls == []
+
+
+def test_messages_beyond_the_window_are_folded_into_the_summary():
+    calls = []
+    history = ChatHistory(budget=10000, window=4, summarizer=recording_summarizer(calls))
+    conversation(history, 4)
+    payload = history.payload()
+    assert payload[0]['role'] == 'system'
+    assert payload[1:] == history.messages[-4:]
+    assert history.summarized == 4
+    assert calls == [[message['content'] for message in history.messages[:4]]]
+
+
+def test_each_message_is_summarized_once():
+    calls = []
+    history = ChatHistory(budget=10000, window=4, summarizer=recording_summarizer(calls))
+    conversation(history, 3)
+    history.payload()
+    conversation(history, 1)
+    history.payload()
+    folded = [content for call in calls for content in call]
+    assert folded == [message['content'] for message in history.messages[:4]]
+
+
+def test_payload_stays_within_the_token_budget():
+    history = ChatHistory(budget=200, window=50, summarizer=lambda summary, messages: 'short summary')
+    conversation(history, 10, size=200)
+    payload = history.payload()
+    assert compaction.message_tokens(payload) <= 200
+    assert payload[-1] == history.messages[-1]
+
+
+def test_the_latest_message_is_always_sent():
+    history = ChatHistory(budget=10, window=8, summarizer=lambda summary, messages: 's')
+    history.append('user', 'a question far longer than the budget ' * 10)
+    assert history.payload()[-1] == history.messages[-1]
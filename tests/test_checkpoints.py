@@ -0,0 +1,62 @@
+import time
+
+import checkpoints
+
+
+def test_new_run_ids_are_unique():
+    assert checkpoints.new_run_id() != checkpoints.new_run_id()
+
+
+def test_bounded_saver_is_truthy_when_empty():
+    # langgraph compiles agents without a checkpointer if it is falsy
+    assert checkpoints.BoundedMemorySaver()
+
+
+def test_bounded_saver_forgets_the_least_recently_written_threads():
+    saver = checkpoints.BoundedMemorySaver(max_threads=2)
+    for thread_id in ('a', 'b', 'c'):
+        saver.storage[thread_id] = {'': {}}
+        saver._touch(thread_id)
+    assert saver.thread_count == 2
+    assert 'a' not in saver.storage
+    assert {'b', 'c'} <= set(saver.storage)
+
+
+def test_bounded_saver_forgets_old_threads():
+    saver = checkpoints.BoundedMemorySaver(max_age=0.05)
+    saver.storage['old'] = {'': {}}
+    saver._touch('old')
+    time.sleep(0.06)
+    saver.storage['new'] = {'': {}}
+    saver._touch('new')
+    assert 'old' not in saver.storage
+    assert saver.thread_count == 1
+
+
+def test_run_store_records_completed_stages_in_order():
+    store = checkpoints.RunStore()
+    store.set('run', 'summarizer', [{'step': 1}])
+    store.set('run', 'batch-1', {'scores': [7]})
+    assert store.get('run', 'summarizer') == [{'step': 1}]
+    assert store.get('run', 'suggester') is None
+    assert store.stages('run') == ['summarizer', 'batch-1']
+    assert store.stages('other') == []
+
+
+def test_run_store_drops_old_stages():
+    store = checkpoints.RunStore(max_age=0.05)
+    store.set('old', 'summarizer', 1)
+    time.sleep(0.06)
+    store.set('new', 'summarizer', 2)
+    assert store.get('old', 'summarizer') is None
+    assert store.get('new', 'summarizer') == 2
+
+
+def test_run_store_keeps_only_the_most_recent_runs():
+    store = checkpoints.RunStore(max_runs=2)
+    for run_id in ('a', 'b', 'c'):
+        store.set(run_id, 'summarizer', run_id)
+        store.set(run_id, 'final', run_id)
+        time.sleep(0.01)
+    assert store.stages('a') == []
+    assert store.stages('b') == store.stages('c') == ['summarizer', 'final']
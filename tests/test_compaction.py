@@ -0,0 +1,63 @@
+import json
+
+import compaction
+
+SUMMARY = [{'steps': [
+    {'step_number': 1, 'summary': 'Invoices arrive by email and are keyed in by hand',
+     'inefficiencies': ['manual entry', 'no validation', 'duplicate checks', 'slow approvals']},
+    {'step_number': 2, 'summary': 'Managers approve invoices in a shared spreadsheet',
+     'inefficiencies': ['no audit trail']},
+]}]
+
+SCORER_ANSWER = """Step 1: 3/10. Metrics used: cycle time, error rate
+Manual keying dominates.
+
+Step 2 scores 6 out of 10.
+Metric: approval latency
+"""
+
+
+def test_normalize_steps_accepts_nested_and_flat_shapes():
+    flat = [{'step_summary': 'Pay suppliers', 'inefficiencies': None}]
+    assert compaction.normalize_steps(flat) == [{'step_number': 1, 'summary': 'Pay suppliers', 'inefficiencies': []}]
+    assert [step['step_number'] for step in compaction.normalize_steps(SUMMARY)] == [1, 2]
+
+
+def test_scored_steps_reads_scores_and_metrics_from_prose():
+    scores = compaction.scored_steps([{'role': 'assistant', 'content': SCORER_ANSWER}])
+    assert scores == {
+        1: {'score': 3.0, 'metrics': ['cycle time, error rate']},
+        2: {'score': 6.0, 'metrics': ['approval latency']},
+    }
+
+
+def test_fit_trims_detail_until_the_state_fits():
+    steps = [{'step_number': i, 'summary': 'A long description of the step ' * 5,
+              'inefficiencies': ['one', 'two', 'three', 'four', 'five'], 'metrics': ['a', 'b', 'c', 'd']}
+             for i in range(1, 11)]
+    fitted = compaction._fit(steps, budget=400)
+    assert compaction.estimate_tokens(json.dumps(fitted)) <= 400
+    assert all(len(step['inefficiencies']) <= 3 and len(step['summary']) <= 60 for step in fitted)
+
+
+def test_fit_leaves_small_states_alone():
+    steps = compaction.normalize_steps(SUMMARY)
+    assert compaction._fit([dict(step) for step in steps], budget=10000) == steps
+
+
+def test_compact_carries_steps_and_scores_forward_in_one_message():
+    summary_messages = [{'role': 'user', 'content': 'context ' * 500},
+                        {'role': 'assistant', 'content': json.dumps(SUMMARY)}]
+    scored_messages = [{'role': 'assistant', 'content': SCORER_ANSWER}]
+    messages, report = compaction.compact(summary_messages, scored_messages)
+    assert len(messages) == 1
+    state = json.loads(messages[0]['content'].split(': ', 1)[1])
+    assert [step['score'] for step in state['steps']] == [3.0, 6.0]
+    assert report['saved_tokens'] > 0
+
+
+def test_compact_keeps_the_original_messages_without_steps():
+    summary_messages = [{'role': 'assistant', 'content': 'No JSON here.'}]
+    messages, report = compaction.compact(summary_messages)
+    assert messages == summary_messages
+    assert report['saved_tokens'] == 0
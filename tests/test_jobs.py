@@ -0,0 +1,88 @@
+import threading
+
+import pytest
+
+import jobs
+
+
+class MemoryStore(dict):
+    def set(self, key, value):
+        self[key] = value
+
+
+def wait(job, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if job.done:
+            return job
+        threading.Event().wait(0.01)
+    pytest.fail(f'job {job.id} did not finish')
+
+
+@pytest.fixture
+def manager():
+    return jobs.JobManager(max_workers=2, store=MemoryStore())
+
+
+def test_submit_runs_the_function_and_reports_progress(manager):
+    def work(value, report):
+        report('first', {'value': value})
+        return value * 2
+
+    job = wait(manager.submit('a', work, 21))
+    assert job.status == jobs.SUCCEEDED
+    assert job.result == 42
+    assert [stage['stage'] for stage in job.partial] == ['first']
+    assert manager.store['a']['result'] == 42
+
+
+def test_submitting_a_running_job_returns_it(manager):
+    release = threading.Event()
+    calls = []
+
+    def work(report):
+        calls.append(1)
+        release.wait(5)
+
+    first = manager.submit('a', work)
+    second = manager.submit('a', work)
+    release.set()
+    wait(first)
+    assert first is second
+    assert calls == [1]
+
+
+def test_succeeded_jobs_are_served_from_the_store(manager):
+    wait(manager.submit('a', lambda report: 'done'))
+    restarted = jobs.JobManager(store=manager.store)
+    job = restarted.submit('a', lambda report: pytest.fail('ran again'))
+    assert job.status == jobs.SUCCEEDED
+    assert job.result == 'done'
+
+
+def test_failed_jobs_are_returned_until_resubmitted(manager):
+    calls = []
+
+    def fail(report):
+        calls.append(1)
+        raise RuntimeError('quota exceeded')
+
+    job = wait(manager.submit('a', fail))
+    assert job.status == jobs.FAILED
+    assert job.error == 'quota exceeded'
+    assert manager.submit('a', fail) is job
+    assert calls == [1]
+    # Failures are not stored, so they can be retried after a restart
+    assert 'a' not in manager.store
+
+    retried = wait(manager.resubmit('a', lambda report: 'ok'))
+    assert retried is not job
+    assert retried.status == jobs.SUCCEEDED
+
+
+def test_resubmit_does_not_restart_a_succeeded_job(manager):
+    job = wait(manager.submit('a', lambda report: 'done'))
+    assert manager.resubmit('a', lambda report: pytest.fail('ran again')) is job
+
+
+def test_get_unknown_job_returns_none(manager):
+    assert manager.get('missing') is None
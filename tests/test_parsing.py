@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+import parsing
+
+STEPS = [
+    {'step_summary': 'Receive invoices by email', 'efficiency_score': 4, 'explanation': 'Manual triage'},
+    {'step_summary': 'Approve invoices', 'efficiency_score': 6, 'explanation': 'Two sign-offs'},
+    {'step_summary': 'Pay suppliers', 'efficiency_score': 8, 'explanation': 'Automated runs'},
+]
+
+
+def test_parse_steps_reads_clean_json():
+    assert parsing.parse_steps(json.dumps(STEPS), parsing.STEP_KEYS) == STEPS
+
+
+def test_parse_steps_ignores_markers_around_the_array():
+    text = f'[JSON Output]\nHere are the steps:\n{json.dumps(STEPS)}'
+    assert parsing.parse_steps(text, parsing.STEP_KEYS) == STEPS
+
+
+def test_parse_steps_recovers_complete_steps_from_truncated_output():
+    text = json.dumps(STEPS)[:-40]
+    assert parsing.parse_steps(text, parsing.STEP_KEYS)[:2] == STEPS[:2]
+
+
+def test_parse_steps_repairs_trailing_commas():
+    text = json.dumps(STEPS).replace('}, {', '},, {').replace('"Pay suppliers",', '"Pay suppliers",,')
+    assert [step['step_summary'] for step in parsing.parse_steps(text, parsing.STEP_KEYS)] == \
+        [step['step_summary'] for step in STEPS]
+
+
+def test_parse_steps_skips_objects_missing_required_keys():
+    text = json.dumps([STEPS[0], {'step_summary': 'No score'}, STEPS[1]])
+    assert parsing.parse_steps(text, parsing.STEP_KEYS) == STEPS[:2]
+
+
+def test_parse_steps_raises_when_nothing_is_usable():
+    with pytest.raises(parsing.ParseError):
+        parsing.parse_steps('The model did not answer.', parsing.STEP_KEYS)
+
+
+def test_stream_parser_emits_each_step_when_it_completes():
+    text = json.dumps(STEPS)
+    first_end = text.index('}') + 1
+    parser = parsing.StepStreamParser(parsing.STEP_KEYS)
+    assert parser.feed(text[:first_end - 1]) == []
+    assert parser.feed(text[first_end - 1:first_end]) == STEPS[:1]
+    assert parser.feed(text[first_end:]) == STEPS[1:]
+    assert parser.finish() == []
+
+
+def test_stream_parser_handles_braces_inside_strings():
+    step = {'step_summary': 'Parse {curly} and "quoted" text', 'efficiency_score': 5, 'explanation': ']'}
+    assert list(parsing.iter_steps(json.dumps([step]), parsing.STEP_KEYS)) == [step]
+
+
+def test_stream_parser_salvages_a_truncated_last_step_on_finish():
+    text = json.dumps(STEPS)
+    cut = text.rindex('"explanation"')
+    chunks = [text[i:i + 7] for i in range(0, cut, 7)]
+    steps = list(parsing.iter_steps(chunks))
+    assert steps[:2] == STEPS[:2]
+    assert steps[2]['step_summary'] == 'Pay suppliers'
+
+
+def test_stream_parser_skips_nested_objects():
+    text = json.dumps([{**STEPS[0], 'metrics': {'error_rate': 0.1}}])
+    assert list(parsing.iter_steps(text, parsing.STEP_KEYS)) == [{**STEPS[0], 'metrics': {'error_rate': 0.1}}]
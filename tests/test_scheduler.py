@@ -0,0 +1,66 @@
+import threading
+import time
+
+import scheduler
+
+
+def wait_for_queue(s, depth):
+    deadline = time.monotonic() + 5
+    while sum(s.queue_depth.values()) < depth:
+        assert time.monotonic() < deadline, 'callers never queued'
+        time.sleep(0.005)
+
+
+def test_acquire_is_immediate_within_the_burst():
+    s = scheduler.Scheduler(requests_per_second=1, burst=3)
+    assert all(s.acquire(level=scheduler.INTERACTIVE) < 0.05 for _ in range(3))
+
+
+def test_waiting_calls_are_admitted_by_priority_then_arrival():
+    # Admissions 50 ms apart, so the order they are recorded in is the order they were admitted
+    s = scheduler.Scheduler(requests_per_second=20, burst=1)
+    s.pause(0.3)  # holds every caller until all of them have queued
+    order = []
+    callers = [('batch-1', scheduler.BATCH), ('s3-1', scheduler.S3), ('interactive-1', scheduler.INTERACTIVE),
+               ('batch-2', scheduler.BATCH), ('interactive-2', scheduler.INTERACTIVE)]
+    threads = []
+    for queued, (name, level) in enumerate(callers, start=1):
+        thread = threading.Thread(target=lambda name=name, level=level: (s.acquire(level=level), order.append(name)))
+        thread.start()
+        threads.append(thread)
+        wait_for_queue(s, queued)
+    for thread in threads:
+        thread.join(5)
+    assert order == ['interactive-1', 'interactive-2', 's3-1', 'batch-1', 'batch-2']
+
+
+def test_pause_holds_back_every_caller():
+    s = scheduler.Scheduler(requests_per_second=0)
+    s.pause(0.2)
+    assert s.acquire() >= 0.15
+    assert s.throttled == 1
+
+
+def test_tokens_per_minute_limit_and_correction():
+    s = scheduler.Scheduler(requests_per_second=0, tokens_per_minute=60000)
+    assert s.acquire(60000) < 0.05
+    # Refunding an overestimate makes the capacity available again straight away
+    s.correct(60000, 0)
+    assert s.acquire(30000) < 0.05
+    # 30000 tokens remain; 30200 more wait for 200 tokens at 1000 per second
+    assert 0.15 <= s.acquire(30200) < 1
+
+
+def test_priority_context_never_raises_urgency():
+    with scheduler.priority(scheduler.BATCH):
+        with scheduler.priority(scheduler.INTERACTIVE):
+            assert scheduler.current_priority() == scheduler.BATCH
+    assert scheduler.current_priority() == scheduler.INTERACTIVE
+
+
+def test_metrics_report_queue_depth_and_waits():
+    s = scheduler.Scheduler(requests_per_second=0)
+    s.acquire(level=scheduler.S3)
+    lines = s.metrics_lines()
+    assert 'workwise_scheduler_queue_depth{priority="s3"} 0' in lines
+    assert 'workwise_scheduler_wait_seconds_count{priority="s3"} 1' in lines
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+import embeddings
+from semantic_cache import SemanticCache
+
+VECTORS = {
+    'which step is slowest?': [1.0, 0.0, 0.0],
+    'what is the slowest step?': [0.96, 0.28, 0.0],
+    'how much does invoicing cost?': [0.0, 1.0, 0.0],
+    'who approves payments?': [0.0, 0.0, 1.0],
+}
+
+
+def fake_embed(texts):
+    return np.array([VECTORS[text] for text in texts], dtype='float32')
+
+
+def test_similar_questions_about_the_same_document_hit():
+    cache = SemanticCache(threshold=0.9, embed=fake_embed)
+    answer, vector = cache.lookup('doc', 'which step is slowest?')
+    assert answer is None
+    cache.store('doc', 'which step is slowest?', 'Step 2', vector)
+    assert cache.lookup('doc', 'what is the slowest step?')[0] == 'Step 2'
+    assert cache.lookup('doc', 'how much does invoicing cost?')[0] is None
+    assert cache.hits == 1 and cache.misses == 2
+    assert cache.hit_rate == pytest.approx(1 / 3)
+
+
+def test_answers_are_scoped_to_their_document():
+    cache = SemanticCache(embed=fake_embed)
+    _, vector = cache.lookup('doc-a', 'which step is slowest?')
+    cache.store('doc-a', 'which step is slowest?', 'Step 2', vector)
+    assert cache.lookup('doc-b', 'which step is slowest?')[0] is None
+
+
+def test_empty_answers_are_not_stored():
+    cache = SemanticCache(embed=fake_embed)
+    _, vector = cache.lookup('doc', 'which step is slowest?')
+    cache.store('doc', 'which step is slowest?', '', vector)
+    cache.store('doc', 'which step is slowest?', '  \n', vector)
+    assert len(cache) == 0
+
+
+def test_least_recently_used_answers_are_evicted():
+    cache = SemanticCache(maxsize=2, embed=fake_embed)
+    for question in ('which step is slowest?', 'how much does invoicing cost?', 'who approves payments?'):
+        _, vector = cache.lookup('doc', question)
+        cache.store('doc', question, question.upper(), vector)
+    assert len(cache) == 2
+    assert cache.lookup('doc', 'which step is slowest?')[0] is None
+    assert cache.lookup('doc', 'who approves payments?')[0] == 'WHO APPROVES PAYMENTS?'
+
+
+def test_cache_is_bypassed_without_an_embedding_model():
+    def unavailable(texts):
+        raise embeddings.EmbeddingUnavailable('no model')
+
+    cache = SemanticCache(embed=unavailable)
+    assert cache.lookup('doc', 'which step is slowest?') == (None, None)
+    cache.store('doc', 'which step is slowest?', 'Step 2', None)
+    assert len(cache) == 0
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import pytest
+
+import tool_cache
+
+
+@pytest.fixture
+def store(tmp_path):
+    return tool_cache.SQLiteStore(str(tmp_path / 'tools.sqlite3'))
+
+
+def test_normalize_query_ignores_case_and_punctuation():
+    assert tool_cache.normalize_query('Invoice processing error-rate?') == \
+        tool_cache.normalize_query('invoice processing  error rate')
+
+
+def test_results_are_reused_across_equivalent_queries(store):
+    cache = tool_cache.ToolResultCache(store)
+    calls = []
+    run = lambda query: calls.append(query) or f'result for {query}'
+    assert cache.get_or_run('wikipedia', 'Cycle time', run) == 'result for Cycle time'
+    assert cache.get_or_run('wikipedia', 'cycle time?', run) == 'result for Cycle time'
+    assert calls == ['Cycle time']
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_namespaces_are_cached_separately(store):
+    cache = tool_cache.ToolResultCache(store)
+    cache.get_or_run('wikipedia', 'cycle time', lambda query: 'wiki')
+    assert cache.get_or_run('search', 'cycle time', lambda query: 'search') == 'search'
+
+
+def test_results_survive_a_new_cache_on_the_same_store(store):
+    tool_cache.ToolResultCache(store).get_or_run('wikipedia', 'cycle time', lambda query: 'stored')
+    fresh = tool_cache.ToolResultCache(store)
+    assert fresh.get_or_run('wikipedia', 'cycle time', lambda query: pytest.fail('ran again')) == 'stored'
+
+
+def test_expired_results_are_looked_up_again(store):
+    cache = tool_cache.ToolResultCache(store, ttl=0.05)
+    cache.get_or_run('wikipedia', 'cycle time', lambda query: 'old')
+    time.sleep(0.06)
+    assert cache.get_or_run('wikipedia', 'cycle time', lambda query: 'new') == 'new'
+
+
+def test_concurrent_identical_lookups_run_the_tool_once(store):
+    cache = tool_cache.ToolResultCache(store)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow(query):
+        calls.append(query)
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    results = []
+    owner = threading.Thread(target=lambda: results.append(cache.get_or_run('search', 'q', slow)))
+    owner.start()
+    started.wait(5)
+    waiter = threading.Thread(target=lambda: results.append(cache.get_or_run('search', 'q', slow)))
+    waiter.start()
+    time.sleep(0.05)
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+    assert results == ['result', 'result']
+    assert calls == ['q']
+
+
+def test_a_lookup_that_finishes_meanwhile_is_not_run_again(store):
+    cache = tool_cache.ToolResultCache(store)
+    get = store.get
+
+    def finished_meanwhile(namespace, query, ttl):
+        # Another agent's identical lookup completes while this one checks the store
+        cache.memory.set((namespace, query), 'result')
+        return get(namespace, query, ttl)
+
+    store.get = finished_meanwhile
+    assert cache.get_or_run('search', 'q', lambda query: pytest.fail('ran again')) == 'result'
+    assert (cache.hits, cache.misses) == (1, 0)
+
+
+def test_failures_are_not_cached(store):
+    cache = tool_cache.ToolResultCache(store)
+
+    def fail(query):
+        raise RuntimeError('rate limited')
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_run('search', 'q', fail)
+    assert cache.get_or_run('search', 'q', lambda query: 'ok') == 'ok'
+
+
+def test_expired_rows_are_purged_as_results_are_written(store):
+    store.set('search', 'stale', 'old result')
+    with store._connect() as connection:
+        connection.execute('UPDATE tool_results SET stored_at = 0')
+    cache = tool_cache.ToolResultCache(store, ttl=60)
+    for index in range(tool_cache.PURGE_EVERY):
+        cache.get_or_run('search', f'query {index}', lambda query: query)
+    rows = store._connect().execute('SELECT query FROM tool_results').fetchall()
+    assert len(rows) == tool_cache.PURGE_EVERY
+    assert ('stale',) not in rows
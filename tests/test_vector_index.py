@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+import embeddings
+import vector_index
+
+
+def test_short_text_is_one_chunk():
+    assert vector_index.chunk_text('Invoices are approved twice.') == ['Invoices are approved twice.']
+    assert vector_index.chunk_text('') == []
+
+
+def test_chunks_respect_the_size_limit_and_overlap_at_word_boundaries():
+    text = '\n\n'.join(f'Paragraph {i}. ' + ' '.join(f'word{i}x{j}' for j in range(40)) for i in range(20))
+    chunks = vector_index.chunk_text(text, max_chars=400, overlap=60)
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 400 for chunk in chunks)
+    words = set(text.split())
+    for previous, chunk in zip(chunks, chunks[1:]):
+        # Each chunk starts with whole words from the end of the previous one
+        first = chunk.split()[0]
+        assert first in words
+        assert first in previous[-60:]
+
+
+def test_every_word_is_in_some_chunk():
+    text = ' '.join(f'sentence{i} ends here.' for i in range(300))
+    chunks = vector_index.chunk_text(text, max_chars=300, overlap=50)
+    assert set(' '.join(chunks).split()) == set(text.split())
+
+
+@pytest.fixture
+def fake_embeddings(monkeypatch, tmp_path):
+    # One dimension per keyword, so a query matches the chunks that mention it
+    keywords = ['invoice', 'shipping', 'payroll', 'audit']
+
+    def embed(texts):
+        vectors = np.array([[text.lower().count(keyword) for keyword in keywords] for text in texts], dtype='float32')
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-6)
+
+    monkeypatch.setattr(embeddings, 'embed', embed)
+    monkeypatch.setattr(vector_index, 'INDEX_DIR', str(tmp_path))
+    monkeypatch.setattr(vector_index, '_open_indexes', vector_index.LRUCache(maxsize=4))
+
+
+def test_retrieve_returns_the_relevant_passages_in_document_order(fake_embeddings):
+    paragraphs = [f'Section {i}: the {topic} team works by hand.' for i, topic in
+                  enumerate(['invoice', 'shipping', 'payroll', 'invoice', 'audit'])]
+    text = '\n\n'.join(paragraphs)
+    passages = vector_index.retrieve(text, 'invoice handling', k=2)
+    assert len(passages) == 1  # short paragraphs pack into one chunk
+    # Paragraphs too long to share a chunk
+    chunked = '\n\n'.join(paragraph + ' padding' * 70 for paragraph in paragraphs)
+    passages = vector_index.retrieve(chunked, 'invoice handling', k=2)
+    assert len(passages) == 2
+    assert 'Section 0: the invoice' in passages[0]
+    assert 'Section 3: the invoice' in passages[1]
+
+
+def test_indexes_are_stored_and_memory_mapped_back(fake_embeddings, tmp_path):
+    text = '\n\n'.join(f'The {topic} step.' + ' filler' * 150 for topic in ('invoice', 'audit', 'payroll'))
+    index = vector_index.get_index(text)
+    vector_index._open_indexes.clear()
+    reloaded = vector_index.get_index(text)
+    assert reloaded is not index
+    assert isinstance(reloaded.vectors, np.memmap)
+    assert reloaded.chunks == index.chunks
+
+
+def test_retrieve_without_an_embedding_model_returns_none(monkeypatch, tmp_path):
+    def unavailable(texts):
+        raise embeddings.EmbeddingUnavailable('no model')
+
+    monkeypatch.setattr(embeddings, 'embed', unavailable)
+    monkeypatch.setattr(vector_index, 'INDEX_DIR', str(tmp_path))
+    assert vector_index.retrieve('Some document text.', 'question') is None
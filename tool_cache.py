@@ -0,0 +1,197 @@
+# tool_cache.py
+# Process-wide cache for agent tool results (Wikipedia, DuckDuckGo).
+# The S3 agents keep looking up the same industry metrics, and each lookup is a slow external
+# round-trip. Results are keyed by tool namespace and a normalized query, kept for a TTL in a
+# SQLite store shared by every agent and session (with an LRU in front of it), and concurrent
+# identical lookups are collapsed into a single call.
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import tracing
+from cache import CACHE_DIR, LRUCache
+
+TOOL_CACHE_PATH = os.getenv('TOOL_CACHE_PATH', os.path.join(CACHE_DIR, 'tools.sqlite3'))
+TOOL_CACHE_TTL = float(os.getenv('TOOL_CACHE_TTL', 7 * 24 * 60 * 60))
+# Expired rows are deleted when the cache is created and after every this many writes
+PURGE_EVERY = 100
+
+
+def normalize_query(query):
+    # "Invoice processing error-rate?" and "invoice processing error rate" share an entry
+    return re.sub(r'[\W_]+', ' ', str(query)).strip().lower()
+
+
+class SQLiteStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS tool_results ('
+                'namespace TEXT NOT NULL, query TEXT NOT NULL, result TEXT NOT NULL, '
+                'stored_at REAL NOT NULL, PRIMARY KEY (namespace, query))'
+            )
+
+    def _connect(self):
+        # sqlite3 connections are not shared between threads, so keep one per thread
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute('PRAGMA journal_mode=WAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, namespace, query, ttl):
+        row = self._connect().execute(
+            'SELECT result, stored_at FROM tool_results WHERE namespace = ? AND query = ?',
+            (namespace, query),
+        ).fetchone()
+        if row is None or time.time() - row[1] >= ttl:
+            return None
+        return row[0]
+
+    def set(self, namespace, query, result):
+        with self._connect() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO tool_results (namespace, query, result, stored_at) VALUES (?, ?, ?, ?)',
+                (namespace, query, result, time.time()),
+            )
+
+    def purge(self, ttl):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM tool_results WHERE stored_at < ?', (time.time() - ttl,))
+
+
+class ToolResultCache:
+    def __init__(self, store, ttl=TOOL_CACHE_TTL, memory_size=256):
+        self.store = store
+        self.ttl = ttl
+        self.memory = LRUCache(maxsize=memory_size, ttl=ttl)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+    def get_or_run(self, namespace, query, run):
+        with tracing.span('tool.call', tool=namespace) as span:
+            result, hit = self._get_or_run(namespace, query, run)
+            span.set(tracing.CACHE_HIT, hit)
+            return result
+
+    def _get_or_run(self, namespace, query, run):
+        # Returns (result, cache_hit)
+        key = (namespace, normalize_query(query))
+        result = self.memory.get(key)
+        if result is None:
+            result = self.store.get(*key, self.ttl)
+            if result is not None:
+                self.memory.set(key, result)
+
+        with self._lock:
+            if result is None:
+                # A lookup that finished since the check above has cached its result by now
+                result = self.memory.get(key)
+            if result is not None:
+                self.hits += 1
+                return result, True
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self._inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.hits += 1
+        if not owner:
+            # Same lookup already running for another agent or session: wait for its result
+            return future.result(), True
+
+        try:
+            result = str(run(query))
+            self.memory.set(key, result)
+            self.store.set(*key, result)
+            self._written()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _written(self):
+        with self._lock:
+            self._writes += 1
+            purge = self._writes % PURGE_EVERY == 0
+        if purge:
+            self.store.purge(self.ttl)
+
+
+_cache = None
+_tools = {}
+_lock = threading.RLock()
+
+
+def get_cache():
+    global _cache
+    with _lock:
+        if _cache is None:
+            store = SQLiteStore(TOOL_CACHE_PATH)
+            store.purge(TOOL_CACHE_TTL)
+            _cache = ToolResultCache(store)
+        return _cache
+
+
+def cached_tool(tool, namespace=None, name=None):
+    # Same description and arguments as `tool`, with results served through the cache
+    from langchain_core.tools import StructuredTool
+
+    namespace = namespace or tool.name
+    cache = get_cache()
+
+    def run(query):
+        return cache.get_or_run(namespace, query, tool.run)
+
+    return StructuredTool.from_function(
+        func=run,
+        name=name or tool.name,
+        description=tool.description,
+        args_schema=tool.args_schema,
+    )
+
+
+def _shared(name, build):
+    with _lock:
+        tool = _tools.get(name)
+        if tool is None:
+            tool = _tools[name] = build()
+        return tool
+
+
+def _wikipedia():
+    from langchain_community.tools import WikipediaQueryRun
+    from langchain_community.utilities import WikipediaAPIWrapper
+    return WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper(top_k_results=2))
+
+
+def _duckduckgo():
+    from langchain_community.tools import DuckDuckGoSearchRun
+    return DuckDuckGoSearchRun()
+
+
+def wikipedia_tool():
+    return _shared('wikipedia', lambda: cached_tool(_wikipedia(), namespace='wikipedia'))
+
+
+def search_tool(name='duckduckgo_search'):
+    # Every DuckDuckGo tool shares one backend and one cache namespace, whatever name the agent sees
+    backend = _shared('duckduckgo', _duckduckgo)
+    return _shared(f'duckduckgo:{name}', lambda: cached_tool(backend, namespace='duckduckgo', name=name))
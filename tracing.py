@@ -0,0 +1,389 @@
+# tracing.py
+# Stage-level spans for the pipeline: extraction, Granite calls, agent stages, tool calls, parsing.
+# Spans carry attributes such as token counts, HTTP retries and cache hits. Finished spans are:
+# - kept in a bounded in-memory buffer for the app's timing panel,
+# - aggregated into Prometheus metrics (metrics_text(), or an HTTP endpoint on METRICS_PORT),
+# - exported as OpenTelemetry traces in OTLP/JSON, to OTEL_EXPORTER_OTLP_ENDPOINT and/or
+#   appended to TRACE_FILE, when configured.
+# No tracing dependency is required; OTLP/JSON is accepted directly by OpenTelemetry collectors.
+import collections
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = os.getenv('OTEL_SERVICE_NAME', 'workwise')
+OTLP_ENDPOINT = os.getenv('OTEL_EXPORTER_OTLP_TRACES_ENDPOINT') or (
+    os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT', '').rstrip('/') + '/v1/traces'
+    if os.getenv('OTEL_EXPORTER_OTLP_ENDPOINT') else None
+)
+TRACE_FILE = os.getenv('TRACE_FILE')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+RECENT_SPANS = int(os.getenv('TRACING_RECENT_SPANS', 2000))
+
+EXPORT_BATCH_SIZE = 256
+EXPORT_INTERVAL = 5.0
+
+# Attributes that feed metrics beyond duration
+INPUT_TOKENS = 'tokens.input'
+GENERATED_TOKENS = 'tokens.generated'
+RETRIES = 'http.retries'
+CACHE_HIT = 'cache_hit'
+
+DURATION_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_current = contextvars.ContextVar('tracing_current_span', default=None)
+
+
+class Span:
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.start = time.time_ns()
+        self.end_time = None
+        self.error = None
+        self._lock = threading.Lock()
+
+    @property
+    def duration(self):
+        # Seconds; up to now while the span is still open
+        return ((self.end_time or time.time_ns()) - self.start) / 1e9
+
+    def set(self, key, value):
+        with self._lock:
+            self.attributes[key] = value
+
+    def add(self, key, amount=1):
+        with self._lock:
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def end(self, error=None):
+        if self.end_time is not None:
+            return
+        self.end_time = time.time_ns()
+        if error is not None:
+            self.error = f'{type(error).__name__}: {error}'
+        _finish(self)
+
+
+def current_span():
+    return _current.get()
+
+
+def start_span(name, parent=None, root=False, **attributes):
+    # A span that is not made current; end() it yourself. Useful around generators.
+    return Span(name, None if root else (parent or _current.get()), attributes)
+
+
+@contextlib.contextmanager
+def span(name, root=False, **attributes):
+    # Current span for the block; spans started inside it become its children
+    current = start_span(name, root=root, **attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    finally:
+        _current.reset(token)
+        current.end()
+
+
+@contextlib.contextmanager
+def use_span(current):
+    # Makes a span from start_span() current for the block without ending it
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+
+
+def set_attribute(key, value):
+    # On the current span, if there is one
+    current = _current.get()
+    if current is not None:
+        current.set(key, value)
+
+
+def add_attribute(key, amount=1):
+    current = _current.get()
+    if current is not None:
+        current.add(key, amount)
+
+
+def wrap(fn):
+    # Runs fn in a copy of the caller's context, so spans started on pool threads keep their parent
+    context = contextvars.copy_context()
+
+    def wrapper(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+    return wrapper
+
+
+###############################################################################################
+# Finished spans
+
+_recent = collections.deque(maxlen=RECENT_SPANS)
+_recent_lock = threading.Lock()
+_listeners = []
+
+
+def add_listener(listener):
+    # listener(span) is called for every finished span
+    _listeners.append(listener)
+
+
+def _finish(finished):
+    with _recent_lock:
+        _recent.append(finished)
+    metrics.record(finished)
+    for listener in _listeners:
+        try:
+            listener(finished)
+        except Exception as e:
+            logger.warning("Span listener failed: %s", e)
+
+
+def recent_spans(trace_id=None):
+    with _recent_lock:
+        spans = list(_recent)
+    return [s for s in spans if trace_id is None or s.trace_id == trace_id]
+
+
+def timings(trace_ids):
+    # Rows for a timing table: every finished span of the given traces, children under parents
+    trace_ids = set(trace_ids)
+    spans = sorted((s for s in recent_spans() if s.trace_id in trace_ids), key=lambda s: s.start)
+    children = collections.defaultdict(list)
+    ids = {s.span_id for s in spans}
+    for s in spans:
+        children[s.parent_id if s.parent_id in ids else None].append(s)
+
+    rows = []
+
+    def visit(parent_id, depth):
+        for s in children[parent_id]:
+            rows.append({
+                'stage': '  ' * depth + s.name,
+                'seconds': round(s.duration, 3),
+                'status': 'error' if s.error else 'ok',
+                'details': ', '.join(f'{key}={value}' for key, value in sorted(s.attributes.items())),
+            })
+            visit(s.span_id, depth + 1)
+
+    visit(None, 0)
+    return rows
+
+
+###############################################################################################
+# Prometheus metrics
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.durations = {}
+        self.errors = collections.Counter()
+        self.tokens = collections.Counter()
+        self.retries = collections.Counter()
+        self.cache = collections.Counter()
+
+    def record(self, finished):
+        stage = finished.name
+        attributes = finished.attributes
+        with self._lock:
+            counts, total = self.durations.get(stage, ([0] * (len(self.buckets) + 1), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if finished.duration <= bound:
+                    counts[index] += 1
+            counts[-1] += 1
+            self.durations[stage] = (counts, total + finished.duration)
+            if finished.error:
+                self.errors[stage] += 1
+            for key, kind in ((INPUT_TOKENS, 'input'), (GENERATED_TOKENS, 'generated')):
+                if attributes.get(key):
+                    self.tokens[stage, kind] += attributes[key]
+            if attributes.get(RETRIES):
+                self.retries[stage] += attributes[RETRIES]
+            if isinstance(attributes.get(CACHE_HIT), bool):
+                self.cache[stage, 'hit' if attributes[CACHE_HIT] else 'miss'] += 1
+
+    def text(self):
+        # Prometheus text exposition format
+        lines = [
+            '# HELP workwise_stage_duration_seconds Duration of pipeline stages.',
+            '# TYPE workwise_stage_duration_seconds histogram',
+        ]
+        with self._lock:
+            for stage, (counts, total) in sorted(self.durations.items()):
+                label = f'stage="{_escape(stage)}"'
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f'workwise_stage_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+                lines.append(f'workwise_stage_duration_seconds_bucket{{{label},le="+Inf"}} {counts[-1]}')
+                lines.append(f'workwise_stage_duration_seconds_sum{{{label}}} {total}')
+                lines.append(f'workwise_stage_duration_seconds_count{{{label}}} {counts[-1]}')
+            for name, help_text, counter, labels in (
+                ('workwise_stage_errors_total', 'Pipeline stages that raised.', self.errors, ('stage',)),
+                ('workwise_tokens_total', 'Model tokens by stage and kind.', self.tokens, ('stage', 'kind')),
+                ('workwise_http_retries_total', 'HTTP retries by stage.', self.retries, ('stage',)),
+                ('workwise_cache_requests_total', 'Cache lookups by stage and result.', self.cache, ('stage', 'result')),
+            ):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for key, value in sorted(counter.items()):
+                    values = key if isinstance(key, tuple) else (key,)
+                    label = ','.join(f'{label}="{_escape(v)}"' for label, v in zip(labels, values))
+                    lines.append(f'{name}{{{label}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+_collectors = []
+
+
+def add_collector(collector):
+    # collector() returns extra exposition lines for metrics_text(), e.g. scheduler queue metrics
+    _collectors.append(collector)
+
+
+def metrics_text():
+    lines = []
+    for collector in _collectors:
+        try:
+            lines.extend(collector())
+        except Exception as e:
+            logger.warning("Metrics collector failed: %s", e)
+    return metrics.text() + ''.join(line + '\n' for line in lines)
+
+
+def start_metrics_server(port=METRICS_PORT, host='0.0.0.0'):
+    # Serves metrics_text() at /metrics on a daemon thread; returns the server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = metrics_text().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
+
+
+###############################################################################################
+# OpenTelemetry (OTLP/JSON) export
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def otlp_span(finished):
+    data = {
+        'traceId': finished.trace_id,
+        'spanId': finished.span_id,
+        'name': finished.name,
+        'kind': 1,  # SPAN_KIND_INTERNAL
+        'startTimeUnixNano': str(finished.start),
+        'endTimeUnixNano': str(finished.end_time),
+        'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in finished.attributes.items()],
+        'status': {'code': 2, 'message': finished.error} if finished.error else {'code': 1},
+    }
+    if finished.parent_id:
+        data['parentSpanId'] = finished.parent_id
+    return data
+
+
+def otlp_payload(spans):
+    return {'resourceSpans': [{
+        'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+        'scopeSpans': [{'scope': {'name': 'workwise.tracing'}, 'spans': [otlp_span(s) for s in spans]}],
+    }]}
+
+
+class OTLPExporter:
+    # Batches finished spans on a background thread and sends them as OTLP/JSON
+    def __init__(self, endpoint=None, path=None, batch_size=EXPORT_BATCH_SIZE, interval=EXPORT_INTERVAL):
+        self.endpoint = endpoint
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue(maxsize=batch_size * 32)
+        threading.Thread(target=self._loop, name='otlp-export', daemon=True).start()
+
+    def __call__(self, finished):
+        try:
+            self._queue.put_nowait(finished)
+        except queue.Full:
+            logger.warning("Trace export queue full; dropping span %s", finished.name)
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self.export(batch)
+            except Exception as e:
+                logger.warning("Trace export failed: %s", e)
+
+    def export(self, spans):
+        payload = otlp_payload(spans)
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(payload) + '\n')
+        if self.endpoint:
+            import http_client
+            http_client.post(self.endpoint, endpoint='default', retries=1, json=payload)
+
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure():
+    # Starts the exporters configured in the environment; safe to call on every Streamlit rerun
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        _configured = True
+        if OTLP_ENDPOINT or TRACE_FILE:
+            add_listener(OTLPExporter(OTLP_ENDPOINT, TRACE_FILE))
+        if METRICS_PORT:
+            start_metrics_server(METRICS_PORT)
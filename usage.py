@@ -0,0 +1,86 @@
+# usage.py
+# Token accounting for model calls, from the usage fields watsonx returns: input_token_count and
+# generated_token_count on text generation, usage_metadata on ChatWatsonx messages.
+# Every call is recorded into a process-wide total and into each ledger active in the caller's
+# context, so a document, a background job or a batch record can each report what it used.
+# Cached responses cost nothing and are not recorded.
+import contextlib
+import contextvars
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_ledgers = contextvars.ContextVar('usage_ledgers', default=())
+
+
+class TokenUsage:
+    def __init__(self, input_tokens=0, output_tokens=0, calls=0):
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.calls = calls
+        self._lock = threading.Lock()
+
+    @property
+    def total_tokens(self):
+        return self.input_tokens + self.output_tokens
+
+    def add(self, input_tokens=0, output_tokens=0, calls=1):
+        with self._lock:
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.calls += calls
+
+    def merge(self, other):
+        # Adds another ledger, or its to_dict() form, e.g. the usage reported by a finished job
+        if isinstance(other, dict):
+            other = TokenUsage.from_dict(other)
+        self.add(other.input_tokens, other.output_tokens, other.calls)
+
+    def to_dict(self):
+        return {'input_tokens': self.input_tokens, 'output_tokens': self.output_tokens, 'calls': self.calls}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('input_tokens', 0), data.get('output_tokens', 0), data.get('calls', 0))
+
+    def __str__(self):
+        return f'{self.input_tokens} input + {self.output_tokens} output tokens in {self.calls} calls'
+
+
+process_usage = TokenUsage()
+
+
+@contextlib.contextmanager
+def track(ledger=None):
+    # Records every call made in this context (and in threads started with tracing.wrap) into
+    # ledger as well as any enclosing ledgers; yields the ledger
+    ledger = ledger if ledger is not None else TokenUsage()
+    token = _ledgers.set(_ledgers.get() + (ledger,))
+    try:
+        yield ledger
+    finally:
+        _ledgers.reset(token)
+
+
+def record(input_tokens, output_tokens, source, calls=1):
+    input_tokens, output_tokens = int(input_tokens or 0), int(output_tokens or 0)
+    process_usage.add(input_tokens, output_tokens, calls)
+    for ledger in _ledgers.get():
+        ledger.add(input_tokens, output_tokens, calls)
+    logger.info("%s used %d input + %d output tokens", source, input_tokens, output_tokens)
+
+
+def record_generation(result, source='granite'):
+    # result: one entry of a text generation response's results
+    record(result.get('input_token_count', 0), result.get('generated_token_count', 0), source)
+
+
+def record_messages(messages, source):
+    # Chat messages carrying usage_metadata, one per model call; returns (input, output) tokens
+    usage = [message.usage_metadata for message in messages if getattr(message, 'usage_metadata', None)]
+    input_tokens = sum(u.get('input_tokens', 0) for u in usage)
+    output_tokens = sum(u.get('output_tokens', 0) for u in usage)
+    if usage:
+        record(input_tokens, output_tokens, source, calls=len(usage))
+    return input_tokens, output_tokens
@@ -1,25 +1,23 @@
 # utils.py
 import os
-import requests
 from dotenv import load_dotenv
+import contextvars
 import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import budgets
+import compaction
+import http_client
+import iam
+import parsing
+import scheduler
+import tool_cache
+import tracing
+import usage
+import vector_index
 
 load_dotenv()
-IBM_API_KEY = os.getenv('IBM_API_KEY')
-url = "https://iam.cloud.ibm.com/identity/token"
-
-headers = {
-    "Content-Type": "application/x-www-form-urlencoded"
-}
-
-data = {
-    "grant_type": "urn:ibm:params:oauth:grant-type:apikey",
-    "apikey": IBM_API_KEY
-}
-
-response = requests.post(url, headers=headers, data=data)
-watsonx_token = response.json().get("access_token")
-if watsonx_token: print("token created successfully")
 
 ###############################################################################################
 # ReAct Agent V2
@@ -28,6 +26,17 @@ params = {
     "space_id": "825b15ec-b09f-413c-80ed-4e7fd3fc0bb0"
 }
 
+# Concurrency cap and steps per batch when the scorer and suggester fan out per step
+S3_MAX_CONCURRENCY = int(os.getenv('S3_MAX_CONCURRENCY', 4))
+S3_BATCH_SIZE = int(os.getenv('S3_BATCH_SIZE', 1))
+
+SUGGESTER_REMINDER = """REMINDER: Final output must be JSON array with: step_summary, efficiency_score, improvements and expected_impact for EACH business workflow step.
+    - The JSON object output must have the following keys. DO THIS FOR EACH OF THE BUSINESS WORKFLOW STEPS, YOU MUST INCLUDE ALL STEPS AND THEIR KEYS IN THE OUTPUT!!!:
+        - "step_summary": the brief 10 to 15 word summary of each business workflow step with the step number in chronological order.
+        - "explanation": an insightful 30 word description of specific steps to improve workflow efficiency. Include specific tools/methodologies that could be used for instance. Include which affected metrics would improve, and by what extent for each business workflow step.
+        - "efficiency_score": an updated numerical score as an estimate out of 10 that estimates the workflow efficiency after possible implementation of specific steps/tools/methodologies to improve workflow efficiency in this step.
+"""
+
 class WorkflowAnalyzer:
     def __init__(self):
         self.workflow_response = None
@@ -41,132 +50,455 @@ class WorkflowAnalyzer:
 # Create a global instance
 workflow_analyzer = WorkflowAnalyzer()
 
-def gen_ai_service(context, params=params, **custom):
-    from langchain_ibm import ChatWatsonx
-    from ibm_watsonx_ai import APIClient
-    from langchain_core.messages import AIMessage, HumanMessage
-    from langchain_community.tools import WikipediaQueryRun, DuckDuckGoSearchRun
-    from langchain_community.utilities import WikipediaAPIWrapper
-    from langgraph.checkpoint.memory import MemorySaver
-    from langgraph.prebuilt import create_react_agent
-
-    model = "meta-llama/llama-3-3-70b-instruct"
-    service_url = "https://us-south.ml.cloud.ibm.com"
-
-    credentials = {
-        "url": service_url,
-        "token": context.generate_token()
+SUMMARIZER_INSTRUCTIONS = """From the workflow context provided in the conversation:
+- Identify, Analyze and number each business workflow step. Never combine steps.
+- Highlight inefficiency factors.
+- Summarize each business workflow step in 10-15 words.
+- Output format:
+    {
+        "steps": [
+            {
+                "step_number": 1,
+                "summary": "10-15 word description",
+                "inefficiencies": ["list"]
+            }
+        ]
     }
+"""
 
-    client = APIClient(credentials)
-    space_id = params.get("space_id")
-    client.set.default_space(space_id)
-
-    def create_chat_model(watsonx_client):
-        parameters = {
-            "frequency_penalty": 0,
-            "max_tokens": 7500,
-            "presence_penalty": 0,
-            "temperature": 0,
-            "top_p": 1
-        }
-        return ChatWatsonx(
-            model_id=model,
-            url=service_url,
+SCORER_INSTRUCTIONS = 'Score EACH business workflow step separately from 1 to 10, where 10 indicates highest efficiency, using named industry metrics. Be as critical as possible, do not just score highly without justification. Mention the metric used.'
+
+SUGGESTER_INSTRUCTIONS = """ Your role is to suggest improvements for each step. Do not use any tools in this step, your output should be JSON only.
+"""
+
+
+def granite_steps(response_data):
+    # Steps in a Granite response, or [] if there are none to parse
+    try:
+        return parsing.parse_steps(response_data['results'][0]['generated_text'])
+    except (parsing.ParseError, KeyError, IndexError, TypeError):
+        return []
+
+
+def step_query(steps):
+    # Retrieval query for a list of steps: their summaries
+    return ' '.join(
+        str(step.get('summary') or step.get('step_summary') or json.dumps(step)) if isinstance(step, dict) else str(step)
+        for step in steps
+    )
+
+
+_chat_model_class = None
+# Extra attempts, through the scheduler, after a 429 the watsonx client's own retries gave up on
+RATE_LIMIT_RETRIES = int(os.getenv('S3_RATE_LIMIT_RETRIES', 2))
+
+
+def chat_model_class():
+    # ChatWatsonx whose calls wait for the shared scheduler and whose max_tokens follows the budget
+    # of the stage calling it (budgets.output_budget). token_refresher, if given, is called before
+    # every call, so a long run never outlives its IAM token. Defined on first use so importing
+    # utils does not import langchain_ibm.
+    global _chat_model_class
+    if _chat_model_class is None:
+        from typing import Callable, Optional
+
+        from langchain_ibm import ChatWatsonx
+
+        class ScheduledChatWatsonx(ChatWatsonx):
+            token_refresher: Optional[Callable[[], None]] = None
+
+            def _refresh_token(self):
+                if self.token_refresher is not None:
+                    self.token_refresher()
+
+            def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+                kwargs = _with_budget(kwargs)
+                estimate = _estimate_chat_tokens(messages, kwargs.get('max_tokens') or budgets.MAX_CHAT_TOKENS)
+                for attempt in range(RATE_LIMIT_RETRIES + 1):
+                    scheduler.acquire(estimate)
+                    self._refresh_token()
+                    try:
+                        result = super()._generate(messages, stop, run_manager, **kwargs)
+                    except Exception as e:
+                        if attempt == RATE_LIMIT_RETRIES or not _rate_limited(e):
+                            raise
+                        continue
+                    token_usage = (result.llm_output or {}).get('token_usage') or {}
+                    scheduler.correct(estimate, token_usage.get('total_tokens', estimate))
+                    return result
+
+            def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+                kwargs = _with_budget(kwargs)
+                estimate = _estimate_chat_tokens(messages, kwargs.get('max_tokens') or budgets.MAX_CHAT_TOKENS)
+                scheduler.acquire(estimate)
+                self._refresh_token()
+                try:
+                    for chunk in super()._stream(messages, stop, run_manager, **kwargs):
+                        # The last chunk carries the call's usage
+                        usage_metadata = getattr(chunk.message, 'usage_metadata', None)
+                        if usage_metadata:
+                            scheduler.correct(estimate, usage_metadata.get('total_tokens', estimate))
+                        yield chunk
+                except Exception as e:
+                    _rate_limited(e)
+                    raise
+
+        _chat_model_class = ScheduledChatWatsonx
+    return _chat_model_class
+
+
+def _with_budget(kwargs):
+    # A max_tokens keyword overrides the model's default params for one call
+    budget = budgets.current_output_budget()
+    if budget and kwargs.get('max_tokens') is None:
+        kwargs['max_tokens'] = budget
+    return kwargs
+
+
+def _estimate_chat_tokens(messages, max_tokens):
+    return sum(scheduler.estimate_tokens(str(message.content)) for message in messages) + max_tokens
+
+
+def _rate_limited(error):
+    # True for a 429 from watsonx; every scheduled call is then held back for its Retry-After
+    response = getattr(error, 'response', None)
+    if getattr(response, 'status_code', None) != 429:
+        return False
+    scheduler.pause(http_client.retry_after(response) or scheduler.RETRY_AFTER_DEFAULT)
+    return True
+
+
+def flatten_steps(items):
+    # Agents answer either with a list of steps or with {"steps": [...]}
+    steps = []
+    for item in items:
+        if isinstance(item.get('steps'), list):
+            steps.extend(step for step in item['steps'] if isinstance(step, dict))
+        else:
+            steps.append(item)
+    return steps
+
+
+# Where the current run gets fresh tokens from, see S3Engine.run
+_token_source = contextvars.ContextVar('s3_token_source', default=None)
+
+
+class S3Engine:
+    # The watsonx client, chat model and the three compiled agent graphs, built once per process.
+    # Everything that varies between analyses (messages, workflow context, token) is passed to run().
+    model_id = "meta-llama/llama-3-3-70b-instruct"
+    service_url = os.getenv('WATSONX_URL', "https://us-south.ml.cloud.ibm.com")
+
+    def __init__(self, space_id, token):
+        from ibm_watsonx_ai import APIClient
+        from langgraph.prebuilt import create_react_agent
+        import checkpoints
+
+        self.space_id = space_id
+        self._token = token
+        self._token_lock = threading.Lock()
+
+        credentials = {"url": self.service_url, "token": token}
+        if os.getenv('WATSONX_PLATFORM_URL'):
+            # Only needed for service URLs outside IBM Cloud's known regions, e.g. mock_watsonx.py
+            credentials["platform_url"] = os.getenv('WATSONX_PLATFORM_URL')
+        self.client = APIClient(credentials)
+        self.client.set.default_space(space_id)
+
+        # max_tokens is the ceiling; each agent call gets a budget sized to its steps
+        self.model = chat_model_class()(
+            model_id=self.model_id,
+            url=self.service_url,
             space_id=space_id,
-            params=parameters,
-            watsonx_client=watsonx_client,
+            params={
+                "frequency_penalty": 0,
+                "max_tokens": budgets.MAX_CHAT_TOKENS,
+                "presence_penalty": 0,
+                "temperature": 0,
+                "top_p": 1
+            },
+            watsonx_client=self.client,
+            token_refresher=self.refresh_token,
         )
 
-    def create_tools():
-        from langchain_community.utilities import WikipediaAPIWrapper
-        tools = []
-        tools.append(WikipediaQueryRun(api_wrapper=WikipediaAPIWrapper(top_k_results=2)))
-        tools.append(DuckDuckGoSearchRun(name='business_metrics_search'))
-        return tools
+        # One bounded (or on-disk) checkpointer shared by all agents; thread IDs are per run and stage
+        self.checkpointer = checkpoints.create_checkpointer()
+        self.run_store = checkpoints.create_run_store()
+
+        def create_agent(tools, role_instructions):
+            return create_react_agent(self.model, tools=tools, checkpointer=self.checkpointer, state_modifier=role_instructions)
+
+        # Process-wide tool instances whose results are cached across agents and sessions
+        tools = [tool_cache.wikipedia_tool(), tool_cache.search_tool('business_metrics_search')]
+
+        # Initialize agent workers
+        self.summarizer = create_agent(tools, SUMMARIZER_INSTRUCTIONS)
+        self.scorer = create_agent([tool_cache.search_tool()], SCORER_INSTRUCTIONS)
+        self.suggester = create_agent(tools, SUGGESTER_INSTRUCTIONS)
 
-    def create_agent(model, tools, role_instructions):
-        memory = MemorySaver()
-        return create_react_agent(model, tools=tools, checkpointer=memory, state_modifier=role_instructions)
+    def set_token(self, token):
+        # Hands the caller's current token to the client
+        with self._token_lock:
+            if token and token != self._token:
+                self.client.set_token(token)
+                self._token = token
 
+    def refresh_token(self):
+        # Called before every model call: a run can take longer than the token it started with
+        # has left, so the running analysis' token source is asked for its current one
+        token_source = _token_source.get()
+        if token_source is not None:
+            self.set_token(token_source())
+
+    @staticmethod
     def convert_messages(messages):
+        from langchain_core.messages import AIMessage, HumanMessage
         return [
             HumanMessage(content=msg["content"]) if msg["role"] == "user" 
             else AIMessage(content=msg["content"])
             for msg in messages
         ]
 
-    def generate(context):
-        # Get workflow response from the analyzer instance
-        response_data = workflow_analyzer.get_workflow_response()
-        if not response_data:
-            print("Warning: No workflow response data available")
-            response_data = {}
+    def run(self, messages, required_data=None, token=None, token_source=None, fan_out=True,
+            max_concurrency=S3_MAX_CONCURRENCY, batch_size=S3_BATCH_SIZE,
+            context_budget=compaction.CONTEXT_BUDGET, stats=None, run_id=None, on_stage=None, on_token=None,
+            document=None):
+        # Returns the suggester output as a list, e.g. [{"steps": [...]}]. When a stats dict is
+        # given, tokens saved by context compaction are added to stats['tokens_saved'].
+        # Passing the run_id of an interrupted run resumes it after its last completed stage.
+        # on_stage(name, output) is called as each stage completes (output is None for agent
+        # transcripts), which is how background jobs report partial results.
+        # on_token(text) receives the suggester's answer as it streams. Fanned-out batches would
+        # interleave their answers, so a streamed run is always serial.
+        # With the document text, agents get the passages about their steps from its vector index
+        # (vector_index.py) rather than the whole Granite response.
+        # token_source() returns the caller's current token and is called before every model call;
+        # without it the token passed in is used for the whole run.
+        from langchain_core.messages import HumanMessage, messages_from_dict, messages_to_dict
+        import checkpoints
 
-        payload = context.get_json()
-        messages = convert_messages(payload.get("messages", []))
-        
-        model_instance = create_chat_model(client)
-        tools = create_tools()
-        
-        # Initialize agent workers
-        summarizer = create_agent(model_instance, create_tools(), f"""From the context provided: {response_data}
-        - Identify, Analyze and number each business workflow step. Never combine steps.
-        - Highlight inefficiency factors.
-        - Summarize each business workflow step in 10-15 words.
-        - Output format:
-            {{
-                "steps": [
-                    {{
-                        "step_number": 1,
-                        "summary": "10-15 word description",
-                        "inefficiencies": ["list"]
-                    }}
-                ]
-            }}
-        """)
-        
-        scorer = create_agent(model_instance, [DuckDuckGoSearchRun()], 'Score EACH business workflow step separately from 1 to 10, where 10 indicates highest efficiency, using named industry metrics. Be as critical as possible, do not just score highly without justification. Mention the metric used.')
-
-        suggester = create_agent(model_instance, tools, """ Your role is to suggest improvements for each step. Do not use any tools in this step, your output should be JSON only.
-            - The JSON object output should have the following keys:
-                    - \"step_summary\": the brief 10 to 15 word summary of each business workflow step with the step number in chronological order.
-                    - \"efficiency_score\": the numerical score assigned out of 10 for each business workflow step.
-                    - \"explanation\": a description of specific steps to improve workflow efficiency and an estimated improvement in affected metrics for each business workflow step.        
-        """)
-
-        # Chaining the agents together through carried context
-        try:
-            summary_result = summarizer.invoke(
-                {'messages': messages},
-                {'configurable':{'thread_id': 42 }, 'recursion_limit': 300 }
-            )
+        self.set_token(token)
+        batch_size = max(1, batch_size)
+        fan_out = fan_out and on_token is None
+        # Every run gets its own checkpoint threads, so concurrent sessions never share state
+        run_id = run_id or checkpoints.new_run_id()
 
-            scored_result = scorer.invoke(
-                {'messages': summary_result['messages']},
-                {'configurable':{'thread_id': 42 }, 'recursion_limit': 300 }
-            )
+        # Steps found by the Granite analysis; the summarizer and serial stages are budgeted for them
+        analyzed_steps = granite_steps(required_data)
+        expected_steps = len(analyzed_steps) or None
 
-            suggestions = suggester.invoke(
-                {
-                    'messages': [
-                        *summary_result['messages'],
-                        *scored_result['messages'],
-                        {
-                            "role": "user",
-                            "content": "REMINDER: Final output must be JSON array with: step_summary, efficiency_score, improvements and expected_impact for EACH business workflow step."
-                        }
-                    ]
-                }, 
-                {'configurable':{'thread_id': 42 }, 'recursion_limit': 300, 'timeout': 1200 }
+        def grounding(steps):
+            # Top-k passages of the source document about these steps, as messages
+            passages = vector_index.retrieve(document, step_query(steps))
+            return [HumanMessage(content=vector_index.passages_message(passages)['content'])] if passages else []
+
+        def config(stage, **extra):
+            return {'configurable': {'thread_id': f'{run_id}-{stage}'}, 'recursion_limit': 300, **extra}
+
+        def stage(name, compute, encode=None, decode=None, span_name='s3.stage'):
+            # Completed stages are recorded, so a resumed run skips straight past them
+            with tracing.span(span_name, stage=name) as span:
+                stored = self.run_store.get(run_id, name)
+                if stored is not None:
+                    print(f"Run {run_id}: reusing completed stage {name}")
+                    span.set('resumed', True)
+                    return decode(stored) if decode else stored
+                result = compute()
+                self.run_store.set(run_id, name, encode(result) if encode else result)
+                if on_stage is not None:
+                    on_stage(name, None if encode else result)
+                return result
+
+        def invoke(agent, inputs, stage_config, name, steps, stream_to=None):
+            role = name.rsplit('-', 1)[-1]
+            with budgets.output_budget(budgets.chat_budget(role, steps)):
+                result = checkpoints.invoke_stage(agent, inputs, stage_config, stream_to)['messages']
+            # Messages handed in from an earlier stage keep their usage; only count this stage's calls
+            handed_in = {message.id for message in inputs['messages'] if getattr(message, 'id', None)}
+            input_tokens, output_tokens = usage.record_messages(
+                [message for message in result if message.id not in handed_in], f'agent.{role}')
+            tracing.set_attribute(tracing.INPUT_TOKENS, input_tokens)
+            tracing.set_attribute(tracing.GENERATED_TOKENS, output_tokens)
+            return result
+
+        def message_stage(name, agent, inputs, steps=None, stream_to=None, validate=None, **extra):
+            # One span per agent invocation, named after the agent: agent.summarizer, agent.scorer, ...
+            # steps is how many workflow steps the call covers, which sizes its output budget.
+            # validate(messages) raises for output the run cannot use; the stage is then not
+            # recorded, so resuming the run asks the agent again.
+            def compute():
+                result = invoke(agent, inputs, config(name, **extra), name, steps, stream_to)
+                if validate is not None:
+                    validate(result)
+                return result
+
+            return stage(
+                name,
+                compute,
+                messages_to_dict,
+                messages_from_dict,
+                span_name=f"agent.{name.rsplit('-', 1)[-1]}",
             )
 
+        reminder = {
+            "role": "user",
+            "content": SUGGESTER_REMINDER
+        }
+
+        def compacted(messages, report):
+            # Only structured state moves between agents; record what that saved
+            print(f"Context compaction: {report['original_tokens']} -> {report['compacted_tokens']} tokens "
+                  f"({report['saved_tokens']} saved)")
+            if stats is not None:
+                stats['tokens_saved'] = stats.get('tokens_saved', 0) + report['saved_tokens']
+            return messages
+
+        def parsed_suggestions(suggestion_messages):
+            # Unparsable suggestions fail the run instead of completing it without any steps
             try:
-                output_data = json.loads(suggestions["messages"][-1].content)
-                if not isinstance(output_data, list):
-                    output_data = [output_data]
-            except:
-                output_data = []
+                return parsing.parse_steps(suggestion_messages[-1].content)
+            except parsing.ParseError as e:
+                raise parsing.ParseError(f"Could not parse suggester output: {e}") from e
+
+        def score_and_suggest(batch, index):
+            # Scoring and suggesting for one batch of steps is independent of every other batch
+            def compute():
+                scored_messages = message_stage(
+                    f'batch-{index}-scorer',
+                    self.scorer,
+                    {'messages': [
+                        HumanMessage(content=f"Business workflow steps: {json.dumps(batch)}"),
+                        *grounding(batch),
+                    ]},
+                    len(batch),
+                )
+                suggestion_messages = message_stage(
+                    f'batch-{index}-suggester',
+                    self.suggester,
+                    {'messages': [
+                        *compacted(*compaction.compact_steps(
+                            compaction.normalize_steps(batch),
+                            scored_messages,
+                            original=scored_messages,
+                            budget=context_budget,
+                        )),
+                        reminder
+                    ]},
+                    len(batch),
+                    validate=parsed_suggestions,
+                    timeout=1200,
+                )
+                return flatten_steps(parsed_suggestions(suggestion_messages))
+            return stage(f'batch-{index}', compute)
+
+        def run_serial(summary_messages):
+            scored_messages = message_stage(
+                'scorer',
+                self.scorer,
+                {'messages': [
+                    *compacted(*compaction.compact(summary_messages, budget=context_budget)),
+                    *grounding(analyzed_steps),
+                ]},
+                expected_steps,
+            )
+            suggestion_messages = message_stage(
+                'suggester',
+                self.suggester,
+                {'messages': [
+                    *compacted(*compaction.compact(summary_messages, scored_messages, context_budget)),
+                    reminder
+                ]},
+                expected_steps,
+                on_token,
+                validate=parsed_suggestions,
+                timeout=1200,
+            )
+            return parsed_suggestions(suggestion_messages)
+
+        def run_fan_out(steps):
+            # Latency scales with the slowest batch instead of the sum of all steps
+            batches = [steps[i:i + batch_size] for i in range(0, len(steps), batch_size)]
+            with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+                results = pool.map(tracing.wrap(score_and_suggest), batches, range(len(batches)))
+                return [{"steps": [step for batch_steps in results for step in batch_steps]}]
+
+        def run_chain():
+            # The workflow context is a per-run input, so it travels with the messages: the steps
+            # Granite found (the rest of its response is metadata) and the passages behind them
+            workflow_context = json.dumps(analyzed_steps) if analyzed_steps else (required_data or {})
+            summary_messages = message_stage('summarizer', self.summarizer, {'messages': [
+                HumanMessage(content=f"Workflow context: {workflow_context}"),
+                *grounding(analyzed_steps),
+                *self.convert_messages(messages)
+            ]}, expected_steps)
+
+            steps = []
+            if fan_out:
+                try:
+                    steps = flatten_steps(parsing.parse_steps(summary_messages[-1].content))
+                except parsing.ParseError as e:
+                    print(f"Summarizer steps not parsable, running the chain serially: {e}")
+
+            return run_fan_out(steps) if steps else run_serial(summary_messages)
+
+        reset = _token_source.set(token_source)
+        try:
+            with tracing.span('s3.run', run_id=run_id, fan_out=fan_out):
+                return stage('final', run_chain)
+        finally:
+            _token_source.reset(reset)
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(space_id=params["space_id"], token=None):
+    # One engine per space per process; the first caller pays the setup cost
+    with _engines_lock:
+        engine = _engines.get(space_id)
+        if engine is None:
+            engine = _engines[space_id] = S3Engine(space_id, token or iam.get_token())
+        return engine
+
+
+def gen_ai_service(context, params=params, **custom):
+    # AI service entry point: returns (generate, generate_stream), backed by the shared S3Engine.
+    # custom may carry required_data, fan_out, max_concurrency, batch_size, context_budget, stats,
+    # run_id (to resume an interrupted run), on_stage (progress callback) and document (the
+    # extracted text, for retrieval).
+    engine = get_engine(params.get("space_id"), context.generate_token())
+
+    def generate(context, on_token=None):
+        # Per-run workflow response if given, else the one set on the analyzer instance
+        response_data = custom.get('required_data') or workflow_analyzer.get_workflow_response()
+        if not response_data:
+            print("Warning: No workflow response data available")
+            response_data = {}
+
+        payload = context.get_json()
+
+        # Chaining the agents together through carried context; the run's token usage is returned
+        # with the output. The chain queues behind interactive calls in the shared scheduler.
+        run_usage = usage.TokenUsage()
+        try:
+            with usage.track(run_usage), scheduler.priority(scheduler.S3):
+                output_data = engine.run(
+                    payload.get("messages", []),
+                    required_data=response_data,
+                    token=context.generate_token(),
+                    token_source=context.generate_token,
+                    fan_out=custom.get('fan_out', True),
+                    max_concurrency=custom.get('max_concurrency', S3_MAX_CONCURRENCY),
+                    batch_size=custom.get('batch_size', S3_BATCH_SIZE),
+                    context_budget=custom.get('context_budget', compaction.CONTEXT_BUDGET),
+                    stats=custom.get('stats'),
+                    run_id=custom.get('run_id'),
+                    on_stage=custom.get('on_stage'),
+                    on_token=on_token,
+                    document=custom.get('document'),
+                )
+            print(f"S3 run used {run_usage}")
 
             return {
                 "headers": {"Content-Type": "application/json"},
@@ -176,7 +508,8 @@ def gen_ai_service(context, params=params, **custom):
                             "role": "assistant",
                             "content": json.dumps(output_data)
                         }
-                    }]
+                    }],
+                    "usage": run_usage.to_dict()
                 }
             }
         except Exception as e:
@@ -189,21 +522,54 @@ def gen_ai_service(context, params=params, **custom):
                             "role": "assistant",
                             "content": json.dumps([{"error": str(e)}])
                         }
-                    }]
+                    }],
+                    "usage": run_usage.to_dict()
                 }
             }
 
-    return generate, None
+    def generate_stream(context):
+        # The same chain, yielding the answer as the suggester streams it, as ai_service stream
+        # events. A run with nothing to stream (e.g. a resumed one) yields its answer in one piece.
+        events = queue.Queue()
+        streamed = []
+
+        def on_token(text):
+            streamed.append(text)
+            events.put(_delta(text))
+
+        def run():
+            try:
+                events.put(generate(context, on_token))
+            except Exception as e:
+                events.put(e)
+
+        threading.Thread(target=tracing.wrap(run), name='ai-service-stream', daemon=True).start()
+        while True:
+            event = events.get()
+            if isinstance(event, Exception):
+                raise event
+            if 'body' not in event:
+                yield event
+                continue
+            body = event['body']
+            if not streamed:
+                yield _delta(body['choices'][0]['message']['content'])
+            yield {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": body['usage']}
+            return
+
+    return generate, generate_stream
+
+
+def _delta(text):
+    return {"choices": [{"index": 0, "delta": {"role": "assistant", "content": text}}]}
 
 class RealContext:
     def __init__(self, messages):
         self._messages = messages
-        self._token = watsonx_token
-        if not self._token:
-            raise Exception("WATSONX_TOKEN environment variable not set.")
 
     def generate_token(self):
-        return self._token
+        # Shared, expiry-aware token; raises iam.TokenError if IBM_API_KEY is not set
+        return iam.get_token()
 
     def get_token(self):
         return self.generate_token()
@@ -211,11 +577,36 @@ class RealContext:
     def get_json(self):
         return {"messages": self._messages}
 
+DEFAULT_MESSAGES = [
+    {"role": "system", "content": "You are an expert multi-agent framework that analyzes of a business workflow. Maintain JSON format throughout the output of the analysis chain and present in a clean, parsable format."},
+    {"role": "user", "content": "Begin the business workflow analysis chain."}
+]
+
+class S3RunError(Exception):
+    pass
+
+
+def run_error(output):
+    # The error of a failed run's output, which generate() reports as [{"error": ...}] like the
+    # deployed ai_service does; None for any other output
+    if isinstance(output, list) and len(output) == 1 and isinstance(output[0], dict) and list(output[0]) == ['error']:
+        return output[0]['error']
+    return None
+
+
+def analyze_workflow(required_data, run_id=None, report=None, **custom):
+    # One full S3 analysis of a workflow response; the signature jobs.JobManager.submit expects.
+    # Raises S3RunError when the run failed, so the job fails instead of storing the error.
+    context = RealContext(DEFAULT_MESSAGES)
+    generate, _ = gen_ai_service(context, required_data=required_data, run_id=run_id, on_stage=report, **custom)
+    response = generate(context)
+    error = run_error(json.loads(response['body']['choices'][0]['message']['content']))
+    if error is not None:
+        raise S3RunError(error)
+    return response
+
 if __name__ == "__main__":
-    messages = [
-        {"role": "system", "content": "You are an expert multi-agent framework that analyzes of a business workflow. Maintain JSON format throughout the output of the analysis chain and present in a clean, parsable format."},
-        {"role": "user", "content": "Begin the business workflow analysis chain."}
-    ]
+    messages = DEFAULT_MESSAGES
     context = RealContext(messages)
     generate, _ = gen_ai_service(context)
     response = generate(context)
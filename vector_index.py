@@ -0,0 +1,170 @@
+# vector_index.py
+# Local retrieval over one document, so the chat and the S3 agents get the passages relevant to a
+# question instead of whole documents. The text is cut into overlapping paragraph-aligned chunks
+# and embedded on CPU once per document (embeddings.py). The index is stored on disk under its
+# content hash and the vectors are memory-mapped back, so a restart or another worker does not
+# re-embed, and open indexes share pages instead of each holding a copy.
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import embeddings
+import tracing
+from cache import CACHE_DIR, LRUCache, content_hash
+
+INDEX_DIR = os.path.join(CACHE_DIR, 'index')
+CHUNK_CHARS = int(os.getenv('INDEX_CHUNK_CHARS', 800))
+OVERLAP_CHARS = int(os.getenv('INDEX_OVERLAP_CHARS', 150))
+TOP_K = int(os.getenv('INDEX_TOP_K', 4))
+# Bump when chunking changes so stale indexes are not reused
+INDEX_VERSION = 1
+
+_open_indexes = LRUCache(maxsize=int(os.getenv('INDEX_CACHE_SIZE', 16)))
+_build_locks = {}
+_build_locks_lock = threading.Lock()
+_prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='index')
+
+
+def chunk_text(text, max_chars=CHUNK_CHARS, overlap=OVERLAP_CHARS):
+    # Paragraphs (or sentences, for long paragraphs) packed into chunks of up to max_chars; each
+    # chunk starts with the tail of the previous one so a passage cut at a boundary is still found
+    pieces = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = ' '.join(paragraph.split())
+        if len(paragraph) > max_chars:
+            pieces.extend(re.split(r'(?<=[.!?])\s+', paragraph))
+        elif paragraph:
+            pieces.append(paragraph)
+
+    def tail(chunk):
+        # The last overlap characters, from a word boundary
+        tail = chunk[-overlap:] if overlap else ''
+        return tail[tail.find(' ') + 1:] if ' ' in tail else tail
+
+    chunks, current = [], ''
+    for piece in pieces:
+        if current and len(current) + len(piece) + 1 > max_chars:
+            chunks.append(current)
+            current = tail(current)
+        current = f'{current} {piece}' if current else piece
+        while len(current) > max_chars:
+            chunks.append(current[:max_chars])
+            current = tail(current[:max_chars]) + current[max_chars:]
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class DocumentIndex:
+    def __init__(self, chunks, vectors):
+        self.chunks = chunks
+        self.vectors = vectors
+
+    def search(self, query, k=TOP_K):
+        # Returns up to k {'position', 'text', 'score'} dicts, best first
+        import numpy as np
+
+        with tracing.span('retrieval', chunks=len(self.chunks), k=k):
+            if not self.chunks:
+                return []
+            scores = self.vectors @ embeddings.embed([query])[0]
+            k = min(k, len(self.chunks))
+            best = np.argpartition(-scores, k - 1)[:k]
+            best = best[np.argsort(-scores[best])]
+            return [{'position': int(i), 'text': self.chunks[i], 'score': float(scores[i])} for i in best]
+
+
+def index_key(text):
+    return content_hash(embeddings.MODEL_NAME, str(INDEX_VERSION), str(CHUNK_CHARS), str(OVERLAP_CHARS), text)
+
+
+def _load(directory):
+    import numpy as np
+
+    try:
+        with open(os.path.join(directory, 'chunks.json'), encoding='utf-8') as f:
+            chunks = json.load(f)
+        vectors = np.load(os.path.join(directory, 'vectors.npy'), mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+    return DocumentIndex(chunks, vectors) if len(chunks) == len(vectors) else None
+
+
+def _save(directory, chunks, vectors):
+    # Written to a temporary directory and renamed, so readers never see half an index
+    import numpy as np
+
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    staging = tempfile.mkdtemp(dir=INDEX_DIR, suffix='.tmp')
+    with open(os.path.join(staging, 'chunks.json'), 'w', encoding='utf-8') as f:
+        json.dump(chunks, f)
+    np.save(os.path.join(staging, 'vectors.npy'), vectors)
+    try:
+        os.replace(staging, directory)
+    except OSError:
+        # Another worker finished the same index first
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _build_lock(key):
+    with _build_locks_lock:
+        return _build_locks.setdefault(key, threading.Lock())
+
+
+def get_index(text):
+    # The document's index, built on first use. Raises embeddings.EmbeddingUnavailable.
+    key = index_key(text)
+    index = _open_indexes.get(key)
+    if index is not None:
+        return index
+    with _build_lock(key), tracing.span('index') as span:
+        directory = os.path.join(INDEX_DIR, key)
+        index = _open_indexes.get(key) or _load(directory)
+        span.set(tracing.CACHE_HIT, index is not None)
+        if index is None:
+            chunks = chunk_text(text)
+            if not chunks:
+                return DocumentIndex([], None)
+            vectors = embeddings.embed(chunks)
+            _save(directory, chunks, vectors)
+            index = _load(directory) or DocumentIndex(chunks, vectors)
+        span.set('chunks', len(index.chunks))
+        _open_indexes.set(key, index)
+        return index
+
+
+def prefetch(text):
+    # Builds the index in the background, e.g. as soon as a document is extracted
+    return _prefetcher.submit(tracing.wrap(_try_get_index), text)
+
+
+def _try_get_index(text):
+    try:
+        return get_index(text)
+    except embeddings.EmbeddingUnavailable:
+        return None
+
+
+def retrieve(text, query, k=TOP_K):
+    # The k passages of text most relevant to query, in document order, or None when there is no
+    # text or no embedding model; callers then carry on without retrieved context
+    if not text or not query:
+        return None
+    index = _try_get_index(text)
+    if index is None:
+        return None
+    try:
+        results = index.search(query, k)
+    except embeddings.EmbeddingUnavailable:
+        return None
+    return [result['text'] for result in sorted(results, key=lambda result: result['position'])]
+
+
+def passages_message(passages, role='user'):
+    # Retrieved passages as one chat message
+    numbered = '\n\n'.join(f'[{i}] {passage}' for i, passage in enumerate(passages, start=1))
+    return {'role': role, 'content': f'Relevant passages from the business process document:\n\n{numbered}'}